@@ -17,7 +17,13 @@ from study_cards import render_study_cards
 from revision_engine import render_revision_engine
 from exam_modes import render_exam_modes
 from dashboard import render_dashboard
+from bulk_ops import render_bulk_operations
 import data_layer
+import deck_merge
+import image_gc
+import media
+import metrics
+import pdf_export
 
 # =========================
 # SESSION STATE INIT (GLOBAL)
@@ -28,6 +34,9 @@ st.session_state.setdefault("focus_mode", False)
 st.session_state.setdefault("edit_card", False)
 st.session_state.setdefault("revision_filter", None)
 
+image_gc.ensure_collector()
+metrics.ensure_exporter()
+
 # =========================
 # GLOBAL MODE BAR
 # =========================
@@ -62,6 +71,10 @@ def render_backup_page():
     st.subheader("💾 Backup Data")
     st.info("Download a full backup of your data. Keep this file safe.")
 
+    # Uploads still being normalized belong in the archive
+    media.wait_for_ingest()
+    render_image_cleanup()
+
     buffer = data_layer.create_full_backup()
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
     filename = f"neet_pg_backup_{timestamp}.zip"
@@ -78,30 +91,117 @@ def render_backup_page():
         st.rerun()
 
 
+def render_image_cleanup():
+    # Rendering never moves files: show the background collector's last
+    # run (or a dry run before its first one); "Clean up now" collects
+    report = (
+        st.session_state.pop("gc_report", None)
+        or image_gc.gc_status()["last"]
+        or image_gc.collect(dry_run=True)
+    )
+    if "skipped" in report:
+        return
+
+    if report["collected"] and report["mode"] != "dry-run":
+        st.success(
+            f"🧹 Moved {report['collected']} unused images to quarantine "
+            f"({report['reclaimed_bytes'] / 1e6:.1f} MB); backups are "
+            f"{report['backup_bytes_saved'] / 1e6:.1f} MB smaller."
+        )
+    if report["orphans"]:
+        st.caption(
+            f"🧹 {report['orphans']} unused images ({report['orphan_bytes'] / 1e6:.1f} MB) "
+            f"are kept {image_gc.GC_GRACE_SECONDS // 3600} h in case an edit is undone."
+        )
+        if st.button("Clean up now"):
+            st.session_state.gc_report = image_gc.collect(grace_seconds=0)
+            st.rerun()
+    if report["missing"]:
+        st.warning(f"{len(report['missing'])} cards or PYQs point to missing images.")
+
+
+MERGE_POLICY_LABELS = {
+    "newest": "Keep the more recently revised copy",
+    "revisions": "Keep the copy with more revisions",
+    "both": "Keep both copies",
+}
+
+
 def render_restore_page():
     st.subheader("♻️ Restore Data")
-    st.warning("This will overwrite your current data.")
 
+    how = st.radio("Restore how?", ["Replace everything", "Merge into my deck"], horizontal=True)
     uploaded = st.file_uploader("Upload backup ZIP", type=["zip"])
 
-    if uploaded:
-        if st.button("Restore Now"):
+    if how == "Replace everything":
+        st.warning("This will overwrite your current data.")
+        if uploaded and st.button("Restore Now"):
             data_layer.restore_full_backup(uploaded)
             st.success("Restore completed. Reloading app…")
             time.sleep(1)
             st.rerun()
+    else:
+        st.info("Topics from the backup are added to yours; your review history is kept.")
+        policy = st.selectbox(
+            "When a topic exists in both",
+            deck_merge.MERGE_POLICIES,
+            format_func=MERGE_POLICY_LABELS.get
+        )
+        exact = st.checkbox("Match topic names exactly (case and punctuation count)")
+        if uploaded and st.button("Merge Now"):
+            with st.spinner("Merging…"):
+                report = deck_merge.merge_backup(
+                    uploaded, policy=policy, match="exact" if exact else "normalized"
+                )
+            st.success(
+                f"Merged: {report['added']} topics added, {report['replaced']} updated, "
+                f"{report['kept_ours']} kept as they were; {report['cards_added']} cards added, "
+                f"{report['cards_replaced']} replaced."
+            )
+            if report.get("images_missing"):
+                st.warning(f"{report['images_missing']} images were missing from the backup.")
 
     if st.button("← Back to Dashboard"):
         st.session_state.current_view = "dashboard"
         st.rerun()
 
+
+def render_export_page():
+    st.subheader("🖨️ Export PDF Booklets")
+    st.info("Printable revision booklets, one set of PDFs per subject.")
+
+    pyqs = data_layer.load_pyqs()
+    subjects = sorted(pyqs.subject.dropna().unique().tolist())
+    selected = st.multiselect("Subjects (empty = all)", subjects)
+
+    if st.button("Build Booklets"):
+        with st.spinner("Rendering booklets…"):
+            results = pdf_export.export_booklets(selected or None)
+            # Bundled once per build; reruns only hand over the path
+            st.session_state.pdf_booklets = pdf_export.bundle_booklets(results)
+
+    bundle = st.session_state.get("pdf_booklets")
+    if bundle and bundle.exists():
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
+        st.download_button(
+            label="⬇️ Download Booklets",
+            data=bundle.read_bytes,     # read on click, not on every rerun
+            file_name=f"neet_pg_booklets_{timestamp}.zip",
+            mime="application/zip"
+        )
+
+    if st.button("← Back to Dashboard"):
+        st.session_state.pop("pdf_booklets", None)
+        st.session_state.current_view = "dashboard"
+        st.rerun()
+
 # =========================
 # MAIN LAYOUT
 # =========================
 st.markdown("#### 📘 NEET PG Study System")
 
 # 🔑 MODE BAR MUST BE STABLE
-if st.session_state.current_view not in ["backup", "restore"]:
+if st.session_state.current_view not in ["backup", "restore", "export_pdf"]:
     render_mode_bar()
 
 st.markdown("---")
@@ -119,11 +219,23 @@ if st.sidebar.button("⬆️ Restore Data"):
     st.session_state.current_view = "restore"
     st.rerun()
 
+if st.sidebar.button("🖨️ Export PDF"):
+    st.session_state.current_view = "export_pdf"
+    st.rerun()
+
+done, total = media.ingest_progress()
+if total and done < total:
+    st.sidebar.progress(done / total, text=f"🖼️ Processing images {done}/{total}")
+
 # =========================
 # VIEW ROUTER
 # =========================
 view = st.session_state.current_view
 
+# Leaving a revision loop flushes its buffered outcomes
+if view not in ["revision", "revision_weak", "rapid_review"] and data_layer.has_pending():
+    data_layer.flush_pending()
+
 if view == "dashboard":
     render_dashboard()
 
@@ -141,7 +253,10 @@ elif view == "revision_weak":
     st.session_state.revision_filter = "weak"
     render_revision_engine()
 
-elif view in ["rapid_review", "image_sprint"]:
+elif view == "bulk_ops":
+    render_bulk_operations()
+
+elif view in ["rapid_review", "image_sprint", "mock_exam"]:
     render_exam_modes()
 
 elif view == "backup":
@@ -150,6 +265,9 @@ elif view == "backup":
 elif view == "restore":
     render_restore_page()
 
+elif view == "export_pdf":
+    render_export_page()
+
 else:
     st.session_state.current_view = "dashboard"
     st.rerun()
\ No newline at end of file
@@ -0,0 +1,564 @@
+"""
+Module 15 — HTTP API
+
+Responsibilities:
+- JSON endpoints for PYQs, cards, the next-due query and outcomes
+- Strong ETags; If-None-Match answers 304 for unchanged collections
+- Paginated, field-projected listings
+- Batched outcome submission
+- Built-in load test (requests per second against a local instance)
+
+Standard library only: ThreadingHTTPServer with HTTP/1.1 keep-alive.
+Bodies are cached per (data version, day, normalized request) and the
+ETag is a hash of the body, so it stays strong across restarts while a
+revalidation costs one dict lookup. Set API_TOKEN to require
+"Authorization: Bearer <token>" before binding beyond localhost.
+
+Usage:
+    python api.py [--host 127.0.0.1] [--port 8502]
+    python api.py --loadtest [--clients 8] [--seconds 10] [--path /due]
+
+Endpoints:
+    GET  /pyqs?subject=&fields=&limit=&offset=
+    GET  /pyqs/<id>
+    GET  /cards?subject=&fields=&limit=&offset=     (fields may add bullets)
+    GET  /cards/<topic_id>
+    GET  /due?subject=&limit=&order=&fields=&<filter>=true|false
+    GET  /metrics                                   (Prometheus text)
+    POST /outcomes  {"outcomes": [{"topic_id", "outcome", "mode", "time_on_card_ms"}]}
+"""
+
+import argparse
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import data_layer
+import metrics
+
+API_HOST = "127.0.0.1"
+API_PORT = 8502
+API_TOKEN = os.environ.get("API_TOKEN", "")
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DUE_LIMIT = 20
+MAX_BATCH = 500
+RESPONSE_CACHE_SIZE = 256
+GZIP_MIN_BYTES = 1024
+
+DUE_FIELDS = [
+    "id", "topic", "subject", "trigger_line", "pyq_years",
+    "revision_count", "fail_count", "next_revision_date", "card_id",
+]
+CARD_FIELDS = [c for c in data_layer.CARD_COLUMNS if c not in ("body_offset", "body_length")]
+
+_responses = {"lock": threading.Lock(), "cache": OrderedDict(), "hits": 0, "misses": 0}
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# =========================
+# RESPONSE CACHE
+# =========================
+
+def cached_body(key: tuple, build) -> tuple[str, bytes]:
+    """
+    (etag, body) of a GET response. Any write, outcome or external
+    file change moves data_version(), so stale bodies are never hit.
+    """
+    full_key = (data_layer.data_version(), date.today(), key)
+    with _responses["lock"]:
+        hit = _responses["cache"].get(full_key)
+        if hit:
+            _responses["cache"].move_to_end(full_key)
+            _responses["hits"] += 1
+            return hit
+        _responses["misses"] += 1
+
+    body = build()
+    entry = (f'"{hashlib.sha256(body).hexdigest()[:32]}"', body)
+
+    with _responses["lock"]:
+        _responses["cache"][full_key] = entry
+        while len(_responses["cache"]) > RESPONSE_CACHE_SIZE:
+            _responses["cache"].popitem(last=False)
+    return entry
+
+
+@lru_cache(maxsize=RESPONSE_CACHE_SIZE)
+def gzipped(body: bytes) -> bytes:
+    # One compressed copy per cached body
+    return gzip.compress(body, 6, mtime=0)
+
+
+def cache_stats() -> dict:
+    with _responses["lock"]:
+        return {
+            "entries": len(_responses["cache"]),
+            "hits": _responses["hits"],
+            "misses": _responses["misses"],
+        }
+
+
+metrics.register_cache("api_responses", cache_stats)
+
+# =========================
+# PARAMETERS
+# =========================
+
+def param(params: dict, name: str, default=None):
+    values = params.get(name)
+    return values[-1] if values else default
+
+
+def int_param(params: dict, name: str, default: int, maximum: int | None = None) -> int:
+    raw = param(params, name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    if value < 0 or (maximum is not None and value > maximum):
+        raise ApiError(400, f"{name} must be between 0 and {maximum}")
+    return value
+
+
+def bool_param(params: dict, name: str) -> bool | None:
+    raw = param(params, name)
+    if raw is None:
+        return None
+    if raw.lower() in ("1", "true", "yes"):
+        return True
+    if raw.lower() in ("0", "false", "no"):
+        return False
+    raise ApiError(400, f"{name} must be true or false")
+
+
+def fields_param(params: dict, allowed: list[str], default: list[str]) -> list[str]:
+    raw = param(params, "fields")
+    if not raw:
+        return default
+    fields = [f for f in raw.split(",") if f]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ApiError(400, f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def subject_param(params: dict) -> str | None:
+    subject = param(params, "subject")
+    if subject in (None, "", "All"):
+        return None
+    if subject not in data_layer.manifest_subjects("pyqs"):
+        raise ApiError(404, f"Unknown subject: {subject}")
+    return subject
+
+# =========================
+# SERIALIZATION
+# =========================
+
+def with_bullets(df):
+    # Page-sized: bodies come from the LRU cache, not a full store read
+    return df.assign(bullets=[
+        data_layer.card_body({"body_offset": o, "body_length": n})
+        for o, n in zip(df["body_offset"], df["body_length"])
+    ])
+
+
+def records_json(df, fields: list[str]) -> str:
+    if df.empty:
+        return "[]"
+    return df[fields].to_json(orient="records", date_format="iso", force_ascii=False)
+
+
+def page_body(df, fields: list[str], offset: int, limit: int, bullets: bool = False) -> bytes:
+    page = df.iloc[offset:offset + limit]
+    if bullets:
+        page = with_bullets(page)
+    next_offset = offset + limit if offset + limit < len(df) else None
+    return (
+        f'{{"total":{len(df)},"offset":{offset},"limit":{limit},'
+        f'"next_offset":{json.dumps(next_offset)},"items":{records_json(page, fields)}}}'
+    ).encode()
+
+# =========================
+# HANDLERS
+# =========================
+
+def list_pyqs(params: dict, _) -> tuple[str, bytes]:
+    subject = subject_param(params)
+    fields = fields_param(params, data_layer.PYQ_COLUMNS, data_layer.PYQ_COLUMNS)
+    limit = int_param(params, "limit", PAGE_SIZE, MAX_PAGE_SIZE)
+    offset = int_param(params, "offset", 0)
+
+    def build():
+        df = data_layer.load_pyqs(subject).sort_values("id")
+        return page_body(df, fields, offset, limit)
+
+    return cached_body(("pyqs", subject, tuple(fields), limit, offset), build)
+
+
+def get_pyq(params: dict, match) -> tuple[str, bytes]:
+    topic_id = int(match.group(1))
+    subject = data_layer.topic_subjects().get(topic_id)
+    if subject is None:
+        raise ApiError(404, f"No topic {topic_id}")
+    fields = fields_param(params, data_layer.PYQ_COLUMNS, data_layer.PYQ_COLUMNS)
+
+    def build():
+        df = data_layer.load_pyqs(subject or None)
+        row = df[df["id"] == topic_id]
+        if row.empty:
+            raise ApiError(404, f"No topic {topic_id}")
+        return records_json(row, fields)[1:-1].encode()
+
+    return cached_body(("pyq", topic_id, tuple(fields)), build)
+
+
+def list_cards(params: dict, _) -> tuple[str, bytes]:
+    subject = subject_param(params)
+    fields = fields_param(params, CARD_FIELDS + ["bullets"], CARD_FIELDS)
+    limit = int_param(params, "limit", PAGE_SIZE, MAX_PAGE_SIZE)
+    offset = int_param(params, "offset", 0)
+
+    def build():
+        df = data_layer.load_cards(subject).sort_values("card_id")
+        return page_body(df, fields, offset, limit, bullets="bullets" in fields)
+
+    return cached_body(("cards", subject, tuple(fields), limit, offset), build)
+
+
+def get_card(params: dict, match) -> tuple[str, bytes]:
+    topic_id = int(match.group(1))
+    subject = data_layer.topic_subjects().get(topic_id)
+    fields = fields_param(params, CARD_FIELDS + ["bullets"], CARD_FIELDS + ["bullets"])
+
+    def build():
+        df = data_layer.load_cards(subject)
+        row = df[df["topic_id"] == topic_id]
+        if subject is None or row.empty:
+            raise ApiError(404, f"No card for topic {topic_id}")
+        if "bullets" in fields:
+            row = with_bullets(row)
+        return records_json(row.iloc[:1], fields)[1:-1].encode()
+
+    return cached_body(("card", topic_id, tuple(fields)), build)
+
+
+def next_due(params: dict, _) -> tuple[str, bytes]:
+    subject = subject_param(params)
+    limit = int_param(params, "limit", DUE_LIMIT, MAX_PAGE_SIZE)
+    order = param(params, "order", "priority")
+    if order not in data_layer.QUERY_ORDERS:
+        raise ApiError(400, f"order must be one of {', '.join(data_layer.QUERY_ORDERS)}")
+    allowed = data_layer.PYQ_COLUMNS + data_layer.CARD_QUERY_COLUMNS + ["bullets"]
+    fields = fields_param(params, allowed, DUE_FIELDS)
+
+    filters = {f: bool_param(params, f) for f in data_layer.QUERY_FILTERS}
+    if all(v is None for v in filters.values()):
+        filters["due"] = True
+
+    def build():
+        columns = list(dict.fromkeys(
+            [f for f in fields if f != "bullets"]
+            + (["body_offset", "body_length"] if "bullets" in fields else [])
+        ))
+        df = data_layer.query(subject, **filters, order=order, limit=limit, columns=columns)
+        if "bullets" in fields:
+            df = with_bullets(df)
+        return f'{{"count":{len(df)},"items":{records_json(df, fields)}}}'.encode()
+
+    key = ("due", subject, order, limit, tuple(fields), tuple(sorted(filters.items())))
+    return cached_body(key, build)
+
+
+def post_outcomes(body: dict) -> dict:
+    outcomes = body.get("outcomes") if isinstance(body, dict) else None
+    if not isinstance(outcomes, list) or not outcomes:
+        raise ApiError(400, 'Expected {"outcomes": [...]}')
+    if len(outcomes) > MAX_BATCH:
+        raise ApiError(413, f"At most {MAX_BATCH} outcomes per request")
+
+    for i, o in enumerate(outcomes):
+        try:
+            o["topic_id"] = int(o["topic_id"])
+        except (KeyError, TypeError, ValueError):
+            raise ApiError(422, f"Outcome {i} needs an integer topic_id")
+
+    try:
+        results = data_layer.record_outcomes(outcomes)
+    except (KeyError, ValueError) as e:
+        # Nothing was recorded: the batch is validated up front
+        raise ApiError(422, str(e.args[0]))
+
+    for r in results:
+        if r["next_revision_date"] is not None:
+            r["next_revision_date"] = r["next_revision_date"].isoformat(timespec="milliseconds")
+    return {"accepted": len(results), "results": results}
+
+
+ROUTES = [
+    (re.compile(r"^/pyqs$"), list_pyqs),
+    (re.compile(r"^/pyqs/(\d+)$"), get_pyq),
+    (re.compile(r"^/cards$"), list_cards),
+    (re.compile(r"^/cards/(\d+)$"), get_card),
+    (re.compile(r"^/due$"), next_due),
+]
+
+# =========================
+# SERVER
+# =========================
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    # Weak comparison, as If-None-Match requires
+    if not header:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag in tags
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "NeetPGApi/1"
+    # Headers and body go out as separate writes; with Nagle on,
+    # every keep-alive response waits out the delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if not getattr(self.server, "quiet", True):
+            super().log_message(format, *args)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def representation(self, body: bytes, etag: str) -> tuple[bytes, str, bool]:
+        # Each encoding is its own representation: its own strong tag
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) >= GZIP_MIN_BYTES:
+            return gzipped(body), etag[:-1] + '-gz"', True
+        return body, etag, False
+
+    def send_json(self, status: int, body: bytes, etag: str | None = None, gz: bool = False):
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if etag:
+            headers["Cache-Control"] = "no-cache"
+            headers["Vary"] = "Accept-Encoding"
+            headers["ETag"] = etag
+        if gz:
+            headers["Content-Encoding"] = "gzip"
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, message: str):
+        self.send_json(status, json.dumps({"error": message}).encode())
+
+    def authorized(self) -> bool:
+        if not API_TOKEN:
+            return True
+        if self.headers.get("Authorization", "") == f"Bearer {API_TOKEN}":
+            return True
+        self.send_error_json(401, "Missing or wrong bearer token")
+        return False
+
+    def timed(self, respond):
+        self.route, self.status = "unmatched", 0
+        start = time.perf_counter()
+        try:
+            respond()
+        finally:
+            metrics.API_SECONDS.observe(time.perf_counter() - start, self.route, str(self.status))
+
+    def do_GET(self):
+        self.timed(self.get)
+
+    def do_POST(self):
+        self.timed(self.post)
+
+    def get(self):
+        if not self.authorized():
+            return
+        url = urlsplit(self.path)
+
+        if url.path == "/metrics":
+            self.route = "metrics"
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        for pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                self.route = handler.__name__
+                break
+        else:
+            return self.send_error_json(404, f"No route {url.path}")
+
+        try:
+            etag, body = handler(parse_qs(url.query), match)
+        except ApiError as e:
+            return self.send_error_json(e.status, str(e))
+
+        body, etag, gz = self.representation(body, etag)
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_json(200, body, etag, gz)
+
+    def post(self):
+        if not self.authorized():
+            return
+        if urlsplit(self.path).path != "/outcomes":
+            return self.send_error_json(404, f"No route {self.path}")
+        self.route = "post_outcomes"
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"null")
+            result = post_outcomes(body)
+        except json.JSONDecodeError:
+            return self.send_error_json(400, "Body is not JSON")
+        except ApiError as e:
+            return self.send_error_json(e.status, str(e))
+
+        self.send_json(200, json.dumps(result, default=str).encode())
+
+
+def make_server(host: str = API_HOST, port: int = API_PORT, quiet: bool = True) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.quiet = quiet
+    return server
+
+# =========================
+# LOAD TEST
+# =========================
+
+def load_test(
+    host: str = API_HOST,
+    port: int = API_PORT,
+    path: str = "/due",
+    clients: int = 8,
+    seconds: float = 10.0,
+    revalidate: bool = True
+) -> dict:
+    """
+    Keep-alive clients requesting `path` in a loop for `seconds`.
+    With revalidate, clients send the last ETag (as a mobile client
+    polling would) and mostly get 304s.
+    """
+    latencies, statuses, errors = [], {}, [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+    headers = {"Authorization": f"Bearer {API_TOKEN}"} if API_TOKEN else {}
+
+    def client():
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+        etag, local = None, []
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers={**headers, **({"If-None-Match": etag} if etag else {})})
+                resp = conn.getresponse()
+                resp.read()
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=10)
+                continue
+            local.append((time.perf_counter() - start, resp.status))
+            if revalidate:
+                etag = resp.getheader("ETag") or etag
+        conn.close()
+        with lock:
+            for latency, status in local:
+                latencies.append(latency)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    pct = lambda p: round(latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000, 2) if latencies else None
+    return {
+        "path": path,
+        "clients": clients,
+        "seconds": round(elapsed, 2),
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "statuses": statuses,
+        "errors": errors[0],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the deck over HTTP")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    parser.add_argument("--loadtest", action="store_true", help="benchmark an in-process server")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--path", default="/due")
+    parser.add_argument("--no-revalidate", action="store_true", help="ignore ETags in the load test")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, quiet=not args.verbose)
+    if args.loadtest:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        result = load_test(
+            args.host, server.server_address[1], args.path,
+            args.clients, args.seconds, not args.no_revalidate
+        )
+        result["cache"] = cache_stats()
+        print(json.dumps(result, indent=1))
+        server.shutdown()
+    else:
+        print(f"Serving on http://{args.host}:{server.server_address[1]}")
+        # The API serves /metrics itself; only the snapshot thread is needed
+        metrics.ensure_exporter(None, data_layer.BASE_DIR / "metrics_api.json")
+        # Buffered outcomes are written on SIGTERM as on Ctrl-C
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            data_layer.flush_pending()
@@ -0,0 +1,112 @@
+"""
+Module 6 — Bulk Operations
+
+Responsibilities:
+- Select topics by subject, due-date range or explicit ids
+- Mark revised / mark weak in one go
+- Shift due dates by N days
+- Reset revision counters
+
+Every action is one vectorized update and one save.
+"""
+
+import streamlit as st
+from datetime import date, timedelta
+
+import data_layer
+
+ACTION_LABELS = {
+    "✅ Mark revised": "revised",
+    "❌ Mark weak": "weak",
+    "📅 Shift due dates": "shift",
+    "♻️ Reset counters": "reset",
+}
+
+
+def parse_id_list(text: str) -> tuple[list[int] | None, list[str]]:
+    """
+    Ids typed by the user, plus the tokens that are not ids. None means
+    no id filter at all.
+    """
+    tokens = [t.strip() for t in text.replace("\n", ",").split(",") if t.strip()]
+    if not tokens:
+        return None, []
+    invalid = [t for t in tokens if not t.isdigit()]
+    return [int(t) for t in tokens if t.isdigit()], invalid
+
+
+# =========================
+# MAIN UI
+# =========================
+
+def render_bulk_operations():
+    if st.session_state.app_mode != "Build":
+        st.info("Switch to 🛠️ Build Mode to use bulk operations.")
+        return
+
+    st.subheader("📦 Bulk Operations")
+
+    pyqs = data_layer.load_pyqs()
+
+    if pyqs.empty:
+        st.info("No PYQ topics found yet.")
+        return
+
+    # -------------------------
+    # SELECTION
+    # -------------------------
+    st.markdown("### 🎯 Selection")
+
+    subjects = ["All"] + sorted(pyqs.subject.dropna().unique().tolist())
+    subject = st.selectbox("Subject", subjects)
+
+    use_dates = st.checkbox("Filter by due date")
+    start = end = None
+    if use_dates:
+        col1, col2 = st.columns(2)
+        with col1:
+            start = st.date_input("Due from", value=date.today() - timedelta(days=7))
+        with col2:
+            end = st.date_input("Due until", value=date.today())
+
+    id_text = st.text_input("Topic ids (optional, comma separated)")
+    ids, invalid_ids = parse_id_list(id_text)
+    if invalid_ids:
+        st.error(f"Not topic ids: {', '.join(invalid_ids)}. Fix them to apply an action.")
+
+    mask = data_layer.select_pyqs(pyqs, subject=subject, start=start, end=end, ids=ids)
+    st.caption(f"Topics selected: {int(mask.sum())}")
+
+    st.markdown("---")
+
+    # -------------------------
+    # ACTION
+    # -------------------------
+    st.markdown("### ⚙️ Action")
+
+    label = st.radio("Apply", list(ACTION_LABELS.keys()))
+    action = ACTION_LABELS[label]
+
+    days = 0
+    if action == "shift":
+        days = st.number_input("Shift by days (negative = earlier)", value=7, step=1)
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        blocked = bool(invalid_ids) or not mask.any()
+        if st.button("Apply to selection", type="primary", disabled=blocked):
+            affected = data_layer.bulk_update_pyqs(
+                action,
+                subject=subject,
+                start=start,
+                end=end,
+                ids=ids,
+                days=int(days)
+            )
+            st.success(f"Updated {affected} topics.")
+
+    with col2:
+        if st.button("← Back"):
+            st.session_state.current_view = "dashboard"
+            st.rerun()
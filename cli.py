@@ -0,0 +1,590 @@
+"""
+Module 14 — Command Line
+
+Responsibilities:
+- Headless backup / restore / merge / import / export on top of data_layer
+- Two-way sync with another deck directory or server (deck_sync)
+- Deck export as JSONL, Markdown or an Anki package (deck_export)
+- Maintenance: migrate, reschedule, compact, gc
+- Timings of the hot data paths (benchmark)
+- One JSON result per run, JSON-lines progress on stderr, exit codes
+
+Streamlit is never imported, and data modules are imported inside the
+command that needs them, so usage errors and --help return before
+pandas loads. Suitable for cron, e.g. a nightly backup keeping 14:
+
+    python cli.py --data-dir /srv/neet --quiet backup --keep 14
+
+Usage:
+    python cli.py [--data-dir DIR] [--quiet] <command> [options]
+
+Exit codes: 0 ok, 1 failed, 2 usage, 3 bad input, 4 refused (needs --yes)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+_STARTED = time.perf_counter()
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INPUT = 3
+EXIT_REFUSED = 4
+
+BACKUP_DIR = Path("backups")
+BACKUP_PREFIX = "neet_pg_backup_"
+PROGRESS_INTERVAL_SECONDS = 0.2
+
+_output = {"quiet": False, "stream": sys.stdout, "last_progress": 0.0}
+
+
+class CommandError(Exception):
+    def __init__(self, message: str, code: int = EXIT_FAILED):
+        super().__init__(message)
+        self.code = code
+
+# =========================
+# OUTPUT
+# =========================
+
+def emit(result: dict) -> None:
+    stream = _output["stream"]
+    stream.write(json.dumps(result, default=str) + "\n")
+    stream.flush()
+
+
+def progress(stage: str, done: int, total: int) -> None:
+    # Throttled JSON lines on stderr; the last step is always reported
+    if _output["quiet"]:
+        return
+    now = time.monotonic()
+    if done < total and now - _output["last_progress"] < PROGRESS_INTERVAL_SECONDS:
+        return
+    _output["last_progress"] = now
+    sys.stderr.write(json.dumps({"progress": stage, "done": done, "total": total}) + "\n")
+    sys.stderr.flush()
+
+
+def read_records(path: Path) -> list[dict]:
+    # CSV, JSON array or JSON lines; every value as a string
+    import pandas as pd
+
+    if not path.exists():
+        raise CommandError(f"No such file: {path}", EXIT_INPUT)
+    try:
+        if path.suffix.lower() == ".csv":
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        elif path.suffix.lower() in (".jsonl", ".json"):
+            df = pd.read_json(path, lines=path.suffix.lower() == ".jsonl", dtype=False)
+            df = df.fillna("").astype(str)
+        else:
+            raise CommandError(f"Unsupported input format: {path.suffix}", EXIT_INPUT)
+    except ValueError as e:
+        raise CommandError(f"Unreadable {path.name}: {e}", EXIT_INPUT)
+    return df.to_dict("records")
+
+
+def parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {value}")
+
+# =========================
+# BACKUP / RESTORE
+# =========================
+
+def prune_backups(directory: Path, keep: int) -> list[str]:
+    backups = sorted(directory.glob(f"{BACKUP_PREFIX}*.zip"))
+    removed = backups[:-keep] if keep > 0 else []
+    for path in removed:
+        path.unlink()
+    return [str(p) for p in removed]
+
+
+def cmd_backup(args) -> dict:
+    import zipfile
+    import data_layer
+
+    out = Path(args.out) if args.out else (
+        BACKUP_DIR / f"{BACKUP_PREFIX}{datetime.now():%Y-%m-%d_%H-%M-%S}.zip"
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    # Streamed to disk, renamed when complete: cron never leaves half a zip
+    tmp = out.with_name(out.name + ".part")
+    with open(tmp, "wb") as f:
+        data_layer.create_full_backup(f, progress=lambda d, t: progress("backup", d, t))
+    tmp.replace(out)
+
+    with zipfile.ZipFile(out) as z:
+        members = len(z.namelist())
+
+    return {
+        "path": str(out),
+        "bytes": out.stat().st_size,
+        "members": members,
+        "pruned": prune_backups(out.parent, args.keep) if args.keep else [],
+    }
+
+
+def check_archive(path: Path) -> list[str]:
+    # Member names of a readable deck archive
+    import zipfile
+
+    if not path.exists():
+        raise CommandError(f"No such file: {path}", EXIT_INPUT)
+    try:
+        with zipfile.ZipFile(path) as z:
+            names = z.namelist()
+            bad = z.testzip()
+    except zipfile.BadZipFile:
+        raise CommandError(f"Not a zip archive: {path}", EXIT_INPUT)
+    if bad:
+        raise CommandError(f"Corrupt member in archive: {bad}", EXIT_INPUT)
+    if not any(n.startswith("partitions/") or n == "pyq_topics.csv" for n in names):
+        raise CommandError("Archive does not contain a deck", EXIT_INPUT)
+    return names
+
+
+def cmd_restore(args) -> dict:
+    path = Path(args.file)
+    names = check_archive(path)
+    if not args.yes:
+        raise CommandError("restore replaces all current data; pass --yes", EXIT_REFUSED)
+
+    import data_layer
+
+    data_layer.restore_full_backup(path)
+    return {
+        "restored": str(path),
+        "members": len(names),
+        "pyqs": len(data_layer.load_pyqs()),
+        "cards": len(data_layer.load_cards()),
+    }
+
+
+def cmd_merge(args) -> dict:
+    path = Path(args.file)
+    check_archive(path)
+
+    import deck_merge
+
+    report = deck_merge.merge_backup(
+        path, policy=args.policy, match=args.match, dry_run=args.dry_run,
+        progress=lambda d, t: progress("images", d, t)
+    )
+    return {"merged": str(path), **report}
+
+
+def cmd_sync(args) -> dict:
+    if not args.directory and not args.remote:
+        raise CommandError("sync needs a directory or --command", EXIT_USAGE)
+    if args.directory and not Path(args.directory).is_dir():
+        raise CommandError(f"No such directory: {args.directory}", EXIT_INPUT)
+
+    import deck_sync
+
+    return deck_sync.sync(args.directory, args.remote, dry_run=args.dry_run)
+
+# =========================
+# IMPORT / EXPORT
+# =========================
+
+def import_pyqs(records: list[dict], dry_run: bool) -> dict:
+    import pandas as pd
+    import data_layer
+
+    pyqs = data_layer.load_pyqs()
+    seen = set(pyqs["topic"].astype(str).str.strip().str.lower())
+    next_id = data_layer.safe_next_id(pyqs["id"])
+    rows, skipped = [], []
+
+    for n, rec in enumerate(records, 1):
+        topic = str(rec.get("topic", "")).strip()
+        if not topic:
+            skipped.append({"row": n, "reason": "no topic"})
+        elif topic.lower() in seen:
+            skipped.append({"row": n, "reason": "duplicate topic", "topic": topic})
+        else:
+            seen.add(topic.lower())
+            row = data_layer.new_pyq_row(
+                topic=topic,
+                subject=str(rec.get("subject", "")).strip(),
+                trigger_line=str(rec.get("trigger_line", "")),
+                pyq_years=str(rec.get("pyq_years", ""))
+            )
+            row["id"] = next_id
+            row["pyq_image_paths"] = str(rec.get("pyq_image_paths", ""))
+            rows.append(row)
+            next_id += 1
+        progress("import", n, len(records))
+
+    if rows and not dry_run:
+        attrs = pyqs.attrs
+        # All-empty columns (last_revised) would only trigger a dtype warning
+        new_rows = pd.DataFrame(rows).dropna(axis=1, how="all")
+        pyqs = pd.concat([pyqs, new_rows], ignore_index=True)
+        pyqs.attrs = attrs
+        data_layer.save_pyqs(pyqs)
+
+    return {"inserted": len(rows), "updated": 0, "skipped": skipped}
+
+
+def import_cards(records: list[dict], dry_run: bool) -> dict:
+    import data_layer
+
+    pyqs = data_layer.load_pyqs()
+    by_topic = dict(zip(pyqs["topic"].astype(str).str.strip().str.lower(), pyqs["id"]))
+    titles = dict(zip(pyqs["id"], pyqs["topic"].astype(str)))
+    cards, skipped = [], []
+
+    for n, rec in enumerate(records, 1):
+        raw_id = str(rec.get("topic_id", "")).strip()
+        try:
+            topic_id = (
+                int(float(raw_id)) if raw_id else
+                by_topic.get(str(rec.get("topic", "")).strip().lower())
+            )
+        except ValueError:
+            topic_id = None
+        bullets = str(rec.get("bullets", "")).strip()
+
+        if topic_id is None or topic_id not in titles:
+            skipped.append({"row": n, "reason": "unknown topic"})
+        elif not bullets:
+            skipped.append({"row": n, "reason": "no bullets"})
+        else:
+            cards.append({
+                "topic_id": int(topic_id),
+                # Same default as the card editor: the topic name
+                "card_title": str(rec.get("card_title", "")).strip() or titles[topic_id],
+                "bullets": bullets,
+                "image_paths": str(rec.get("image_paths", "")),
+                "external_url": str(rec.get("external_url", "")),
+            })
+        progress("import", n, len(records))
+
+    if dry_run:
+        existing = set(data_layer.load_cards()["topic_id"].dropna().astype(int))
+        topics = {c["topic_id"] for c in cards}
+        inserted, updated = len(topics - existing), len(topics & existing)
+    else:
+        inserted, updated = data_layer.upsert_cards(cards)
+
+    return {"inserted": inserted, "updated": updated, "skipped": skipped}
+
+
+def cmd_import(args) -> dict:
+    records = read_records(Path(args.file))
+    importer = import_pyqs if args.table == "pyqs" else import_cards
+    result = importer(records, args.dry_run)
+    return {"table": args.table, "rows": len(records), "dry_run": args.dry_run, **result}
+
+
+def cmd_export(args) -> dict:
+    import data_layer
+
+    if args.subject and args.subject not in data_layer.manifest_subjects("pyqs"):
+        raise CommandError(f"Unknown subject: {args.subject}", EXIT_INPUT)
+
+    if args.table == "pyqs":
+        df = data_layer.load_pyqs(args.subject)
+    else:
+        df = data_layer.load_cards(args.subject)
+        df = df.assign(bullets=data_layer.card_bodies(df)).drop(
+            columns=["body_offset", "body_length"]
+        )
+
+    if args.out == "-":
+        # Data owns stdout; the result line moves to stderr
+        _output["stream"] = sys.stderr
+        target = sys.stdout
+    else:
+        target = args.out
+
+    if args.format == "csv":
+        df.to_csv(target, index=False)
+    else:
+        df.to_json(target, orient="records", lines=True, date_format="iso", force_ascii=False)
+        if target is sys.stdout:
+            sys.stdout.write("\n")
+
+    return {"table": args.table, "subject": args.subject, "rows": len(df), "out": args.out}
+
+
+def cmd_export_deck(args) -> dict:
+    import data_layer
+    import deck_export
+
+    unknown = set(args.subject or []) - set(data_layer.manifest_subjects("pyqs"))
+    if unknown:
+        raise CommandError(f"Unknown subject: {', '.join(sorted(unknown))}", EXIT_INPUT)
+
+    return deck_export.export_deck(
+        args.format, Path(args.out) if args.out else None, args.subject,
+        with_media=not args.no_media, chunk_size=args.chunk
+    )
+
+# =========================
+# MAINTENANCE
+# =========================
+
+def cmd_migrate(args) -> dict:
+    import data_layer
+
+    legacy = [str(f) for f in (data_layer.PYQ_FILE, data_layer.CARD_FILE) if f.exists()]
+    migrated = data_layer.migrate_legacy_tables()
+    subjects = data_layer.load_manifest()["subjects"]
+    stats = data_layer.card_body_stats()
+
+    return {
+        "migrated": migrated,
+        "legacy_files": legacy,
+        "subjects": len(subjects),
+        "pyqs": sum(e["pyqs"] for e in subjects.values()),
+        "cards": sum(e["cards"] for e in subjects.values()),
+        "card_body_bytes": stats["bytes"],
+        "card_body_dead_bytes": stats["dead_bytes"],
+    }
+
+
+def cmd_reschedule(args) -> dict:
+    import data_layer
+
+    end = args.to
+    if args.overdue:
+        yesterday = date.today() - timedelta(days=1)
+        end = min(end, yesterday) if end else yesterday
+    ids = [int(i) for i in args.ids.split(",")] if args.ids else None
+    action = "reset" if args.reset else "shift"
+
+    if args.dry_run:
+        pyqs = data_layer.load_pyqs(args.subject)
+        mask = data_layer.select_pyqs(pyqs, args.subject, args.start, end, ids)
+        affected = int(mask.sum())
+    else:
+        affected = data_layer.bulk_update_pyqs(
+            action, args.subject, args.start, end, ids, days=args.days or 0
+        )
+
+    return {"action": action, "days": args.days, "affected": affected, "dry_run": args.dry_run}
+
+
+def cmd_compact(args) -> dict:
+    import data_layer
+
+    data_layer.flush_pending()
+    before = data_layer.card_body_stats()["bytes"]
+    reclaimed = data_layer.compact_card_bodies(force=True)
+    return {
+        "reclaimed_bytes": reclaimed,
+        "bytes_before": before,
+        "bytes_after": data_layer.card_body_stats()["bytes"],
+    }
+
+
+def cmd_gc(args) -> dict:
+    import image_gc
+
+    return image_gc.collect(
+        args.grace_hours * 3600,
+        "delete" if args.delete else "quarantine",
+        args.dry_run
+    )
+
+# =========================
+# BENCHMARK
+# =========================
+
+def _timed(fn, repeat: int = 1) -> float:
+    # Median wall time in ms
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(sorted(times)[len(times) // 2], 2)
+
+
+def cmd_benchmark(args) -> dict:
+    start = time.perf_counter()
+    import data_layer
+    import_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    timings = {
+        "cli_start_ms": round((start - _STARTED) * 1000, 2),
+        "import_ms": import_ms,
+        "load_pyqs_cold_ms": _timed(data_layer.load_pyqs),
+        "load_cards_cold_ms": _timed(data_layer.load_cards),
+        "load_pyqs_warm_ms": _timed(data_layer.load_pyqs, args.repeat),
+        "query_index_build_ms": _timed(lambda: data_layer.query(due=True, limit=50)),
+        "query_due_ms": _timed(lambda: data_layer.query(due=True, limit=50), args.repeat),
+        "card_bodies_ms": _timed(lambda: data_layer.card_bodies(data_layer.load_cards())),
+    }
+
+    subjects = data_layer.manifest_subjects("pyqs")
+    if subjects:
+        data_layer.load_pyqs(subjects[0])
+        timings["load_subject_warm_ms"] = _timed(
+            lambda: data_layer.load_pyqs(subjects[0]), args.repeat
+        )
+
+    # One answer's reads and the buffered-update overlay, nothing written
+    ids = list(data_layer.topic_subjects())[:10]
+    if ids:
+        data_layer.get_pyq(ids[0])
+        data_layer.get_card(ids[0])
+        timings["get_pyq_ms"] = _timed(lambda: data_layer.get_pyq(ids[-1]), args.repeat)
+        timings["get_card_ms"] = _timed(lambda: data_layer.get_card(ids[-1]), args.repeat)
+        updates = {i: data_layer.outcome_update(data_layer.get_pyq(i), "revised") for i in ids}
+        timings["apply_10_updates_ms"] = _timed(
+            lambda: data_layer.apply_row_updates(data_layer.read_pyqs(), updates), args.repeat
+        )
+
+    if args.backup:
+        with open(os.devnull, "wb") as sink:
+            timings["backup_ms"] = _timed(lambda: data_layer.create_full_backup(sink))
+
+    return {
+        "pyqs": len(data_layer.load_pyqs()),
+        "cards": len(data_layer.load_cards()),
+        "subjects": len(subjects),
+        "repeat": args.repeat,
+        "timings": timings,
+    }
+
+# =========================
+# ENTRY POINT
+# =========================
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="NEET PG deck tools")
+    parser.add_argument("--data-dir", type=Path, help="deck directory (default: current)")
+    parser.add_argument("--quiet", action="store_true", help="no progress on stderr")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("backup", help="write a full backup zip")
+    p.add_argument("--out", help=f"zip path (default: {BACKUP_DIR}/{BACKUP_PREFIX}<time>.zip)")
+    p.add_argument("--keep", type=int, default=0, help="keep only the newest N backups")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("restore", help="replace all data with a backup zip")
+    p.add_argument("file")
+    p.add_argument("--yes", action="store_true", help="confirm overwriting current data")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("merge", help="merge a backup zip into the current deck")
+    p.add_argument("file")
+    p.add_argument("--policy", choices=["newest", "revisions", "both"], default="newest",
+                   help="which copy of a topic found in both decks is kept")
+    p.add_argument("--match", choices=["normalized", "exact"], default="normalized",
+                   help="topic + subject comparison")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("sync", help="two-way sync with another deck (laptop <-> server)")
+    p.add_argument("directory", nargs="?", help="the other deck's directory")
+    p.add_argument("--command", dest="remote",
+                   help="command running `deck_sync.py serve` at the other deck, e.g. over ssh")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("import", help="add PYQs or cards from CSV / JSON / JSONL")
+    p.add_argument("table", choices=["pyqs", "cards"])
+    p.add_argument("file")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("export", help="write PYQs or cards as CSV / JSONL")
+    p.add_argument("table", choices=["pyqs", "cards"])
+    p.add_argument("--subject")
+    p.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    p.add_argument("--out", default="-", help="file path, or - for stdout")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("export-deck", help="write the deck as JSONL / Markdown / Anki package")
+    p.add_argument("format", choices=["jsonl", "markdown", "anki"])
+    p.add_argument("--subject", action="append", help="only these subjects (repeatable)")
+    p.add_argument("--out", help="directory (jsonl, markdown) or .apkg file")
+    p.add_argument("--no-media", action="store_true", help="leave images out")
+    p.add_argument("--chunk", type=int, default=2000, help="topics per chunk")
+    p.set_defaults(func=cmd_export_deck)
+
+    p = sub.add_parser("migrate", help="convert legacy single-file tables")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("reschedule", help="shift or reset revision dates")
+    action = p.add_mutually_exclusive_group(required=True)
+    action.add_argument("--days", type=int, help="move next revision by N days")
+    action.add_argument("--reset", action="store_true", help="reset progress, due now")
+    p.add_argument("--subject")
+    p.add_argument("--from", dest="start", type=parse_date, help="next revision on/after")
+    p.add_argument("--to", type=parse_date, help="next revision on/before")
+    p.add_argument("--overdue", action="store_true", help="only topics due before today")
+    p.add_argument("--ids", help="comma-separated topic ids")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_reschedule)
+
+    p = sub.add_parser("compact", help="rewrite the card body store")
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser("gc", help="collect orphaned images")
+    p.add_argument("--grace-hours", type=float, default=24.0)
+    p.add_argument("--delete", action="store_true", help="delete instead of quarantine")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_gc)
+
+    p = sub.add_parser("benchmark", help="time loads, queries and backup")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--backup", action="store_true", help="include a backup to /dev/null")
+    p.set_defaults(func=cmd_benchmark)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    _output["quiet"] = args.quiet
+
+    start = time.perf_counter()
+    try:
+        if args.data_dir:
+            if not args.data_dir.is_dir():
+                raise CommandError(f"No such directory: {args.data_dir}", EXIT_INPUT)
+            # File arguments stay relative to where the command was run
+            for name in ("file", "out", "directory"):
+                value = getattr(args, name, None)
+                if value and value != "-":
+                    setattr(args, name, os.path.abspath(value))
+            # data_layer paths are relative to the working directory
+            os.chdir(args.data_dir)
+        result = args.func(args)
+    except BrokenPipeError:
+        # Reader went away (export | head); nothing left to report
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_FAILED
+    except CommandError as e:
+        emit({"ok": False, "command": args.command, "error": str(e)})
+        return e.code
+    except (OSError, ValueError, KeyError) as e:
+        emit({"ok": False, "command": args.command, "error": f"{type(e).__name__}: {e}"})
+        return EXIT_FAILED
+
+    emit({
+        "ok": True,
+        "command": args.command,
+        "seconds": round(time.perf_counter() - start, 3),
+        **result,
+    })
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
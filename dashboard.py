@@ -32,27 +32,22 @@ def render_dashboard():
     if mode == "Study":
         st.subheader("📘 Suggested topics to revise")
 
-        pyqs = data_layer.load_pyqs()
-        cards = data_layer.load_cards()
-
         # Only topics WITH study cards
-        pyqs = pyqs[pyqs.id.isin(cards.topic_id)]
+        pyqs = data_layer.query(
+            has_card=True,
+            columns=["id", "topic", "revision_count", "fail_count"]
+        )
 
         if pyqs.empty:
             st.info("No topics ready for revision yet.")
             st.markdown("➡️ Add PYQs and Study Cards in Build Mode.")
             return
 
-        # Due or weak topics
-        due = pyqs[data_layer.is_due(pyqs)]
-        weak = pyqs[pyqs.fail_count > 0]
-
-        today_list = (
-            due if not due.empty else weak
-        ).sort_values(
-            by=["fail_count", "revision_count"],
-            ascending=[False, True]
-        ).head(5)
+        # Due topics, else weak ones
+        suggestion = dict(has_card=True, order="priority", limit=5, columns=["topic", "subject"])
+        today_list = data_layer.query(due=True, **suggestion)
+        if today_list.empty:
+            today_list = data_layer.query(weak=True, **suggestion)
 
         if today_list.empty:
             st.success("You’re all caught up for today 🎉")
@@ -104,6 +99,26 @@ def render_dashboard():
         if weak_count:
             st.caption(f"Topics marked weak (total): {weak_count}")
 
+        # Precomputed from the review log (no log scan here)
+        daily = data_layer.load_daily_rollup()
+
+        if not daily.empty:
+            st.caption(f"Reviewed today: {data_layer.reviews_today(daily)}")
+            st.caption(f"Revision streak: {data_layer.review_streak(daily)} days")
+
+            with st.expander("Review insights"):
+                st.markdown("**Recall by subject**")
+                st.dataframe(
+                    data_layer.subject_accuracy(daily),
+                    hide_index=True,
+                    use_container_width=True
+                )
+
+                slow = data_layer.slowest_topics(data_layer.load_topic_rollup(), pyqs)
+                if not slow.empty:
+                    st.markdown("**Slowest to recall**")
+                    st.dataframe(slow, hide_index=True, use_container_width=True)
+
         return
 
     # =========================
@@ -124,14 +139,15 @@ def render_dashboard():
                 st.session_state.current_view = "study_cards"
                 st.rerun()
 
-        st.markdown("---")
+        if st.button("📦 Bulk Operations", use_container_width=True):
+            st.session_state.current_view = "bulk_ops"
+            st.rerun()
 
-        pyqs = data_layer.load_pyqs()
-        cards = data_layer.load_cards()
+        st.markdown("---")
 
-        total_pyqs = len(pyqs)
-        total_cards = len(cards)
-        pending_cards = pyqs[~pyqs.id.isin(cards.topic_id)]
+        total_pyqs = len(data_layer.query(columns=["id"]))
+        total_cards = len(data_layer.load_cards())
+        pending_cards = data_layer.query(has_card=False, columns=["id"])
 
         st.caption(f"Total PYQs added: {total_pyqs}")
         st.caption(f"Study Cards created: {total_cards}")
@@ -147,7 +163,7 @@ def render_dashboard():
     if mode == "Exam":
         st.markdown("## ⚡ Exam Recall")
 
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
 
         with col1:
             if st.button("⚡ Rapid Review", use_container_width=True):
@@ -161,4 +177,11 @@ def render_dashboard():
                 st.session_state.last_sprint_subject = None
                 st.rerun()
 
+        with col3:
+            if st.button("📝 Mock Test", use_container_width=True):
+                st.session_state.current_view = "mock_exam"
+                for key in ["mock_paper", "mock_result"]:
+                    st.session_state.pop(key, None)
+                st.rerun()
+
         st.markdown("---")
\ No newline at end of file
@@ -4,11 +4,36 @@ Module 0 — Data Layer (Foundation)
 
 from pathlib import Path
 from datetime import timedelta, date
+import numpy as np
 import pandas as pd
 from io import BytesIO
 import zipfile
+import hashlib
+import json
 import os
 import shutil
+import threading
+import time
+import atexit
+from contextlib import ExitStack, contextmanager
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = "string"
+
+# Sessions share one cached base frame per table; copy-on-write makes
+# the shallow copies they receive behave like private copies.
+try:
+    pd.set_option("mode.copy_on_write", True)
+except (KeyError, ValueError):
+    pass  # always on (pandas >= 3)
 
 # =========================
 # GLOBAL CONFIG
@@ -17,8 +42,16 @@ import shutil
 BASE_DIR = Path(".")
 DATA_VERSION = "v1"
 
-PYQ_FILE = BASE_DIR / "pyq_topics.csv"
-CARD_FILE = BASE_DIR / "study_cards.csv"
+PYQ_FILE = BASE_DIR / "pyq_topics.csv"          # legacy single-file layout
+CARD_FILE = BASE_DIR / "study_cards.csv"         # legacy single-file layout
+PARTITION_DIR = BASE_DIR / "partitions"
+PYQ_PARTITION_DIR = PARTITION_DIR / "pyqs"
+CARD_PARTITION_DIR = PARTITION_DIR / "cards"
+MANIFEST_FILE = PARTITION_DIR / "manifest.json"
+CARD_BODY_FILE = BASE_DIR / "card_bodies.dat"
+REVIEW_LOG_FILE = BASE_DIR / "review_log.csv"
+DAILY_ROLLUP_FILE = BASE_DIR / "review_daily.csv"
+TOPIC_ROLLUP_FILE = BASE_DIR / "review_topics.csv"
 IMAGE_DIR = BASE_DIR / "card_images"
 IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -41,48 +74,195 @@ PYQ_COLUMNS = [
     "schema_version"
 ]
 
+# Hot card metadata. Bullet text lives in CARD_BODY_FILE and is
+# addressed by (body_offset, body_length) in bytes.
 CARD_COLUMNS = [
     "card_id",
     "topic_id",
     "card_title",
-    "bullets",
     "external_url",
     "image_paths",
+    "body_offset",
+    "body_length",
     "created_at",
     "schema_version"
 ]
 
+REVIEW_LOG_COLUMNS = [
+    "topic_id",
+    "subject",
+    "timestamp",
+    "outcome",
+    "mode",
+    "time_on_card_ms"
+]
+
+DAILY_ROLLUP_COLUMNS = ["date", "subject", "mode", "reviews", "revised", "weak", "total_ms"]
+TOPIC_ROLLUP_COLUMNS = ["topic_id", "subject", "reviews", "weak", "total_ms"]
+
+REVIEW_MODES = ["revision", "rapid_review", "image_sprint", "mock_exam"]
+
 DATE_COLUMNS_PYQ = ["last_revised", "next_revision_date", "created_at"]
 DATE_COLUMNS_CARD = ["created_at"]
 
+# In-memory dtypes. Measured on 100k topics + 100k cards:
+# pyqs 44.7 MB -> 11.9 MB, cards 70.0 MB -> 27.9 MB (pyarrow strings).
+PYQ_DTYPES = {
+    "id": "Int32",
+    "topic": STRING_DTYPE,
+    "subject": "category",
+    "pyq_years": STRING_DTYPE,
+    "trigger_line": STRING_DTYPE,
+    "pyq_image_paths": STRING_DTYPE,
+    "revision_count": "Int32",
+    "fail_count": "Int32",
+    "last_revised": "datetime64[ns]",
+    "next_revision_date": "datetime64[ns]",
+    "created_at": "datetime64[ns]",
+    "schema_version": "category",
+}
+
+CARD_DTYPES = {
+    "card_id": "Int32",
+    "topic_id": "Int32",
+    "card_title": STRING_DTYPE,
+    "external_url": STRING_DTYPE,
+    "image_paths": STRING_DTYPE,
+    "body_offset": "Int64",
+    "body_length": "Int32",
+    "created_at": "datetime64[ns]",
+    "schema_version": "category",
+}
+
 # =========================
 # CORE LOAD / SAVE
 # =========================
 
+def _file_label(path: Path) -> str:
+    # Metrics label: the table for partitions, else the file stem
+    return path.parent.name if path.parent.parent == PARTITION_DIR else path.stem
+
+
 def load_csv(path: Path, columns: list, date_cols: list | None = None) -> pd.DataFrame:
+    start = time.perf_counter()
     if path.exists():
         df = pd.read_csv(path)
+        metrics.DISK_BYTES.inc("read", _file_label(path), amount=path.stat().st_size)
     else:
         df = pd.DataFrame(columns=columns)
 
+    df = conform(df, columns, date_cols)
+    metrics.record_io("read", _file_label(path), start, len(df))
+    return df
+
+
+def conform(df: pd.DataFrame, columns: list, date_cols: list | None = None) -> pd.DataFrame:
     # Ensure all columns exist
     for col in columns:
         if col not in df.columns:
             df[col] = None
 
-    # Date coercion
+    # Date coercion. ISO8601 accepts date-only and full timestamps in
+    # one column; an inferred format turned the other kind into NaT
     if date_cols:
         for col in date_cols:
-            df[col] = pd.to_datetime(df[col], errors="coerce")
+            df[col] = pd.to_datetime(df[col], errors="coerce", format="ISO8601")
 
     # 🔑 Always return a safe copy
     return df[columns].copy()
 
 
 def save_csv(df: pd.DataFrame, path: Path, columns: list | None = None) -> None:
+    start = time.perf_counter()
     if columns:
         df = df.reindex(columns=columns)
-    df.to_csv(path, index=False)
+    # Write aside and rename: readers never see a half-written partition
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    df.to_csv(tmp, index=False)
+    tmp.replace(path)
+    metrics.record_io("write", _file_label(path), start, len(df))
+    metrics.DISK_BYTES.inc("write", _file_label(path), amount=path.stat().st_size)
+
+
+def apply_schema(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    for col, dtype in dtypes.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if dtype.startswith("Int"):
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+        elif dtype.startswith("datetime"):
+            df[col] = pd.to_datetime(df[col], errors="coerce").astype(dtype)
+        elif dtype.startswith("string"):
+            # Non-string cells (e.g. NaN in an all-empty column) become <NA>
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+# =========================
+# SHARED BASE FRAMES
+# =========================
+
+# path -> ((mtime_ns, size), frame). One parsed frame per table is
+# shared by every session; callers get shallow copy-on-write copies.
+_frames: dict = {}
+_frame_stats = {"hits": 0, "misses": 0}
+
+
+def _stat_key(path: Path):
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def shared_frame(path, build, key=None) -> pd.DataFrame:
+    # key defaults to the file's (mtime_ns, size)
+    key = _stat_key(path) if key is None else key
+    cached = _frames.get(path)
+
+    if cached and cached[0] == key:
+        _frame_stats["hits"] += 1
+        return cached[1].copy(deep=False)
+
+    _frame_stats["misses"] += 1
+    df = build()
+    _frames[path] = (key, df)
+    return df.copy(deep=False)
+
+
+def remember_frame(path: Path, df: pd.DataFrame) -> None:
+    # Just written by this process: cache it instead of re-parsing
+    _frames[path] = (_stat_key(path), df)
+
+
+def frame_cache_stats() -> dict:
+    return dict(_frame_stats)
+
+
+metrics.register_cache("frames", frame_cache_stats)
+
+
+# id(array) -> (array, pd.Index). Shallow copies of a shared frame
+# share its id array, so the Index and its hash table are built once
+# per file version instead of on every load. The array is held so
+# its id() cannot be reused; a filtered or sorted frame has a new one.
+ID_INDEX_CACHE_SIZE = 64
+_id_indexes: dict = {}
+
+
+def id_index(df: pd.DataFrame, column: str = "id") -> pd.Index:
+    array = df[column].array
+    cached = _id_indexes.get(id(array))
+    if cached and cached[0] is array:
+        return cached[1]
+
+    # Plain int64 (NA -> -1): lookups on a nullable Int32 Index are ~100x slower
+    index = pd.Index(df[column].to_numpy(dtype="int64", na_value=-1))
+    if len(_id_indexes) >= ID_INDEX_CACHE_SIZE:
+        del _id_indexes[next(iter(_id_indexes))]
+    _id_indexes[id(array)] = (array, index)
+    return index
 
 # =========================
 # SAFE ID GENERATION
@@ -97,10 +277,19 @@ def safe_next_id(series: pd.Series) -> int:
 # SPACED REPETITION
 # =========================
 
+SCHEDULE_DAYS = [0, 1, 3, 7, 15, 30]
+
+
 def compute_next_revision(revision_count: int) -> pd.Timestamp:
-    schedule_days = [0, 1, 3, 7, 15, 30]
-    idx = min(int(revision_count), len(schedule_days) - 1)
-    return pd.Timestamp.now() + timedelta(days=schedule_days[idx])
+    idx = min(int(revision_count), len(SCHEDULE_DAYS) - 1)
+    return pd.Timestamp.now() + timedelta(days=SCHEDULE_DAYS[idx])
+
+
+def compute_next_revisions(revision_counts: pd.Series) -> pd.Series:
+    # Vectorized compute_next_revision for a whole column
+    idx = revision_counts.fillna(0).astype(int).clip(0, len(SCHEDULE_DAYS) - 1)
+    days = pd.to_timedelta(SCHEDULE_DAYS, unit="D")
+    return pd.Series(pd.Timestamp.now() + days[idx.values], index=revision_counts.index)
 
 
 def is_due(df: pd.DataFrame) -> pd.Series:
@@ -111,9 +300,7 @@ def is_due(df: pd.DataFrame) -> pd.Series:
 # DATA ACCESS
 # =========================
 
-def load_pyqs() -> pd.DataFrame:
-    df = load_csv(PYQ_FILE, PYQ_COLUMNS, DATE_COLUMNS_PYQ)
-
+def normalize_pyqs(df: pd.DataFrame) -> pd.DataFrame:
     # -------------------------
     # SCHEMA HEALING
     # -------------------------
@@ -146,19 +333,1221 @@ def load_pyqs() -> pd.DataFrame:
     # 🔑 Ensure next_revision_date exists
     df["next_revision_date"] = df["next_revision_date"].fillna(pd.Timestamp.now())
 
+    return apply_schema(df, PYQ_DTYPES)
+
+
+def normalize_cards(df: pd.DataFrame) -> pd.DataFrame:
+    for col in ["card_title", "external_url", "image_paths"]:
+        df[col] = df[col].fillna("").astype(str)
+    return apply_schema(df, CARD_DTYPES)
+
+
+# =========================
+# PARTITIONED STORAGE
+# =========================
+
+# Each table is stored as one CSV per subject, plus a small manifest
+# with the topic ids and counts of every subject. Subject-scoped views
+# read one partition; saves rewrite only partitions whose rows changed.
+MANIFEST_FORMAT = 1
+PARTITION_READ_WORKERS = 8
+UNASSIGNED = ""     # topics without a subject, cards without a topic
+
+TABLES = {
+    "pyqs": (PYQ_PARTITION_DIR, PYQ_COLUMNS, DATE_COLUMNS_PYQ, normalize_pyqs, "id"),
+    "cards": (CARD_PARTITION_DIR, CARD_COLUMNS, DATE_COLUMNS_CARD, normalize_cards, "card_id"),
+}
+
+_manifest = {"key": None, "data": None, "topics": {}, "series": None}
+_migrate_lock = threading.Lock()
+
+
+def partition_path(table: str, subject: str) -> Path:
+    # Hash suffix keeps "Ob/G" and "Ob G" apart
+    safe = "".join(c if c.isalnum() else "_" for c in subject).lower() or "_unassigned"
+    digest = hashlib.sha1(subject.encode()).hexdigest()[:6]
+    return TABLES[table][0] / f"{safe}-{digest}.csv"
+
+
+def load_manifest() -> dict:
+    key = _stat_key(MANIFEST_FILE)
+    if _manifest["data"] is None or _manifest["key"] != key:
+        data = (
+            json.loads(MANIFEST_FILE.read_text()) if key
+            else {"format": MANIFEST_FORMAT, "subjects": {}}
+        )
+        _manifest.update(
+            key=key,
+            data=data,
+            topics={i: s for s, entry in data["subjects"].items() for i in entry["ids"]},
+            series=None
+        )
+    return _manifest["data"]
+
+
+def _write_manifest(data: dict) -> None:
+    PARTITION_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST_FILE.with_name(MANIFEST_FILE.name + ".tmp")
+    tmp.write_text(json.dumps(data, separators=(",", ":")))
+    tmp.replace(MANIFEST_FILE)
+    _manifest["data"] = None
+
+
+def topic_subjects() -> dict:
+    # topic_id -> subject, from the manifest only
+    load_manifest()
+    return _manifest["topics"]
+
+
+def topic_subject_series() -> pd.Series:
+    # Same mapping as a Series: map() over it is a hash join,
+    # mapping over the dict rebuilds a Series on every call
+    load_manifest()
+    if _manifest["series"] is None:
+        _manifest["series"] = pd.Series(_manifest["topics"], dtype=object)
+    return _manifest["series"]
+
+
+def manifest_subjects(count: str = "pyqs") -> list[str]:
+    """
+    Subjects with at least one row, without reading any partition.
+    count: "pyqs", "cards" or "image_cards".
+    """
+    migrate_legacy_tables()
+    return sorted(
+        s for s, entry in load_manifest()["subjects"].items()
+        if s != UNASSIGNED and entry.get(count, 0)
+    )
+
+
+def _partition_keys(table: str, df: pd.DataFrame) -> pd.Series:
+    if table == "pyqs":
+        return df["subject"].astype(object).where(df["subject"].notna(), UNASSIGNED)
+    return df["topic_id"].fillna(-1).astype("int64").map(topic_subject_series()).fillna(UNASSIGNED)
+
+
+def read_partition(table: str, subject: str) -> pd.DataFrame:
+    path = partition_path(table, subject)
+    _, columns, date_cols, normalize, _ = TABLES[table]
+    return shared_frame(path, lambda: normalize(load_csv(path, columns, date_cols)))
+
+
+def read_table(table: str, subject: str | None = None) -> pd.DataFrame:
+    """
+    One partition, or every partition (subject=None) read in
+    parallel and cached as a single frame until any part changes.
+    """
+    migrate_legacy_tables()
+    if subject is not None:
+        return read_partition(table, subject)
+
+    subjects = sorted(load_manifest()["subjects"])
+    key = tuple(_stat_key(partition_path(table, s)) for s in subjects)
+
+    def build():
+        with ThreadPoolExecutor(max_workers=PARTITION_READ_WORKERS) as pool:
+            parts = [p for p in pool.map(lambda s: read_partition(table, s), subjects) if not p.empty]
+        if not parts:
+            return read_partition(table, UNASSIGNED)
+        df = pd.concat(parts, ignore_index=True)
+        # Per-partition categoricals do not share categories
+        return apply_schema(df, PYQ_DTYPES if table == "pyqs" else CARD_DTYPES)
+
+    return shared_frame(("all", table, tuple(subjects)), build, key)
+
+
+def write_partitions(table: str, df: pd.DataFrame, scope: list | None = None) -> list[str]:
+    """
+    Store df into the partitions of `table`.
+    scope: subjects df holds in full (as loaded); rows missing from
+    those partitions are deleted. Other partitions only get df's rows
+    merged in by id. Returns the subjects whose file was rewritten.
+    """
+    directory, columns, _, normalize, key_col = TABLES[table]
+    df = df.reindex(columns=columns)
+    keys = _partition_keys(table, df)
+    scope = set(scope or ())
+
+    touched = scope | set(keys)
+    if table == "pyqs":
+        # Topics whose subject changed leave their old partition
+        touched |= set(df["id"].fillna(-1).astype("int64").map(topic_subject_series()).dropna())
+
+    manifest = load_manifest()
+    entries = {s: dict(e) for s, e in manifest["subjects"].items()}
+    written = []
+
+    for subject in sorted(touched):
+        part = df[keys == subject]
+        if subject not in scope:
+            existing = read_partition(table, subject)
+            existing = existing[~existing[key_col].isin(df[key_col])]
+            part = pd.concat([x for x in (existing, part) if not x.empty] or [part], ignore_index=True)
+        part = normalize(part.reset_index(drop=True))
+
+        path = partition_path(table, subject)
+        cached = _frames.get(path)
+        if cached and cached[0] == _stat_key(path) and cached[1].equals(part):
+            continue
+
+        if part.empty:
+            path.unlink(missing_ok=True)
+            _frames.pop(path, None)
+        else:
+            directory.mkdir(parents=True, exist_ok=True)
+            save_csv(part, path, columns)
+            remember_frame(path, part)
+        written.append(subject)
+
+        entry = entries.setdefault(subject, {"pyqs": 0, "cards": 0, "image_cards": 0, "ids": []})
+        if table == "pyqs":
+            entry["ids"] = [int(i) for i in part["id"].dropna()]
+            entry["pyqs"] = len(part)
+        else:
+            entry["cards"] = len(part)
+            entry["image_cards"] = int((part["image_paths"].fillna("") != "").sum())
+            entry["body_bytes"] = int(part["body_length"].fillna(0).sum())
+        if not entry["pyqs"] and not entry["cards"]:
+            del entries[subject]
+
+    if entries != manifest["subjects"]:
+        _write_manifest({"format": MANIFEST_FORMAT, "subjects": entries})
+
+    return written
+
+
+def migrate_legacy_tables() -> bool:
+    # Single-file layout (older decks and backups): split it once
+    if not (PYQ_FILE.exists() or CARD_FILE.exists()):
+        return False
+
+    with _migrate_lock:
+        if PYQ_FILE.exists():
+            pyqs = normalize_pyqs(load_csv(PYQ_FILE, PYQ_COLUMNS, DATE_COLUMNS_PYQ))
+            with own_write():
+                write_partitions("pyqs", pyqs)
+            PYQ_FILE.unlink()
+
+        if CARD_FILE.exists():
+            cards = read_legacy_cards()
+            with own_write():
+                write_partitions("cards", cards)
+            CARD_FILE.unlink()
+
+    return True
+
+# =========================
+# TABLE ACCESS
+# =========================
+
+def read_pyqs(subject: str | None = None) -> pd.DataFrame:
+    # Raw table as stored on disk (no pending outcomes applied)
+    return read_table("pyqs", subject)
+
+
+def _scope(subject: str | None) -> list:
+    return [subject] if subject is not None else list(load_manifest()["subjects"])
+
+
+def load_pyqs(subject: str | None = None) -> pd.DataFrame:
+    """
+    Disk table + revision outcomes still waiting in the write buffer.
+    subject limits the read to that subject's partition.
+    """
+    start = time.perf_counter()
+    with _buffer["lock"]:
+        pending = dict(_buffer["pending"])
+        seq = _buffer["seq"]
+
+    df = apply_row_updates(read_pyqs(subject), {k: v for k, (_, v) in pending.items()})
+    df.attrs["pending_seq"] = seq
+    df.attrs["partitions"] = _scope(subject)
+    metrics.record_io("load", "pyqs", start, len(df))
     return df
 
 
-def load_cards() -> pd.DataFrame:
-    return load_csv(CARD_FILE, CARD_COLUMNS, DATE_COLUMNS_CARD)
+def load_cards(subject: str | None = None) -> pd.DataFrame:
+    # Metadata only; bullets are fetched per card with card_body()
+    start = time.perf_counter()
+    df = read_table("cards", subject)
+    df.attrs["partitions"] = _scope(subject)
+    metrics.record_io("load", "cards", start, len(df))
+    return df
 
 
 def save_pyqs(df: pd.DataFrame) -> None:
-    save_csv(df, PYQ_FILE, PYQ_COLUMNS)
+    # Outcomes recorded after df was loaded are not in df yet;
+    # merge them so a direct save never drops a buffered answer.
+    start = time.perf_counter()
+    loaded_seq = df.attrs.get("pending_seq", -1)
+    scope = df.attrs.get("partitions")
+
+    with _buffer["io_lock"]:
+        ids = set(df["id"].dropna())
+        snapshot = {k: v for k, v in _pending_snapshot().items() if k in ids}
+        newer = {k: v for k, (s, v) in snapshot.items() if s > loaded_seq}
+        df = apply_row_updates(df.reindex(columns=PYQ_COLUMNS), newer)
+
+        before = topic_subject_series()
+        with own_write():
+            write_partitions("pyqs", df, scope)
+
+            # Cards follow their topic into the new subject partition
+            id_list = pd.Series(sorted(ids), dtype="int64")
+            old = id_list.map(before).fillna(UNASSIGNED)
+            new = id_list.map(topic_subject_series()).fillna(UNASSIGNED)
+            moved = set(old[old != new]) | set(new[old != new])
+            parts = [read_partition("cards", s) for s in moved]
+            if any(not p.empty for p in parts):
+                cards = pd.concat([p for p in parts if not p.empty], ignore_index=True)
+                write_partitions("cards", cards, sorted(moved))
+        _drop_flushed(snapshot)
+    metrics.record_io("save", "pyqs", start, len(df))
 
 
 def save_cards(df: pd.DataFrame) -> None:
-    save_csv(df, CARD_FILE, CARD_COLUMNS)
+    start = time.perf_counter()
+    scope = df.attrs.get("partitions")
+    with own_write():
+        write_partitions("cards", df, scope)
+    metrics.record_io("save", "cards", start, len(df))
+
+
+def read_legacy_cards() -> pd.DataFrame:
+    if "bullets" in pd.read_csv(CARD_FILE, nrows=0).columns:
+        return migrate_card_bodies()
+    return normalize_cards(load_csv(CARD_FILE, CARD_COLUMNS, DATE_COLUMNS_CARD))
+
+# =========================
+# RECORDS
+# =========================
+
+# Single-topic access for the show -> answer -> update loop. A record
+# is a slotted object filled from column arrays at a known position:
+# no Series is built and no mask runs over the table. Positions come
+# from an id map built once per partition file.
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, pos: int):
+        # arrays: column -> ExtensionArray / ndarray; missing columns stay None
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            column = arrays.get(name)
+            setattr(record, name, None if column is None else _scalar(column[pos]))
+        return record
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, pos: int):
+        # Row at position pos of a query result or paper
+        return cls.from_arrays({c: df[c].array for c in cls.__slots__ if c in df.columns}, pos)
+
+    # Read like a Series / dict row, so row["topic"] keeps working
+    def __getitem__(self, name: str):
+        return getattr(self, name)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name, default)
+
+    def update(self, values: dict) -> None:
+        # Columns this record type does not carry are ignored
+        for name, value in values.items():
+            if name in self.__slots__:
+                setattr(self, name, value)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class PYQRecord(Record):
+    __slots__ = tuple(PYQ_COLUMNS)
+
+
+class CardRecord(Record):
+    __slots__ = tuple(CARD_COLUMNS)
+
+
+def _scalar(value):
+    # NA / NaT -> None and numpy scalars -> Python, as a record reader expects
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        return None if isinstance(value, np.floating) and np.isnan(value) else value.item()
+    return value
+
+
+# path -> (stat key, column arrays, {key: position})
+_lookups: dict = {}
+_lookup_stats = {"hits": 0, "misses": 0}
+
+
+def partition_lookup(table: str, subject: str) -> tuple[dict, dict]:
+    """
+    Column arrays of one partition and a {key: row position} map
+    (pyqs by id, cards by topic_id, first card wins), cached until
+    the partition file changes.
+    """
+    path = partition_path(table, subject)
+    key = _stat_key(path)
+    cached = _lookups.get(path)
+    if cached and cached[0] == key:
+        _lookup_stats["hits"] += 1
+        return cached[1], cached[2]
+
+    _lookup_stats["misses"] += 1
+    df = read_partition(table, subject)
+    arrays = {c: df[c].array for c in df.columns}
+    keys = df["id" if table == "pyqs" else "topic_id"].to_numpy(dtype=float, na_value=np.nan)
+    positions = {}
+    for pos, value in enumerate(keys.tolist()):
+        if value == value:
+            positions.setdefault(int(value), pos)
+    _lookups[path] = (key, arrays, positions)
+    return arrays, positions
+
+
+metrics.register_cache("records", lambda: dict(_lookup_stats))
+
+
+def get_pyq(topic_id: int) -> PYQRecord | None:
+    """
+    One topic as a record, buffered outcomes applied; None if unknown.
+    Reads only the topic's partition (through the manifest).
+    """
+    topic_id = int(topic_id)
+    subject = topic_subjects().get(topic_id)
+    if subject is None:
+        return None
+
+    arrays, positions = partition_lookup("pyqs", subject)
+    pos = positions.get(topic_id)
+    if pos is None:
+        return None
+
+    record = PYQRecord.from_arrays(arrays, pos)
+    with _buffer["lock"]:
+        pending = _buffer["pending"].get(topic_id)
+    if pending:
+        record.update(pending[1])
+    return record
+
+
+def get_card(topic_id: int) -> CardRecord | None:
+    # The topic's card, or None; cards live in their topic's partition
+    topic_id = int(topic_id)
+    subject = topic_subjects().get(topic_id, UNASSIGNED)
+    arrays, positions = partition_lookup("cards", subject)
+    pos = positions.get(topic_id)
+    return None if pos is None else CardRecord.from_arrays(arrays, pos)
+
+
+# =========================
+# CARD BODY STORE
+# =========================
+
+# Append-only UTF-8 segments. Edits append a new body and move the
+# card's offset; the old bytes stay until compact_card_bodies().
+#
+# Offsets are logical: card_bodies.<base>.dat holds the bytes from
+# offset <base> on (card_bodies.dat starts at 0) and appends go to the
+# last segment. Compaction writes the live bodies to a new segment past
+# the end of the old ones, saves the new offsets and only then removes
+# the old segments, so an offset from any version of the card table
+# names its own file and can never be read from the wrong one.
+CARD_BODY_CACHE_SIZE = 512
+CARD_BODY_COMPACT_MIN_BYTES = 1 << 20
+
+# Re-entrant: held across load, body append, save and compaction
+_body_lock = threading.RLock()
+_segments = {"key": None, "list": []}
+
+
+def segment_base(name: str) -> int | None:
+    # Logical offset of a body segment's first byte, from its file name
+    stem, suffix = CARD_BODY_FILE.stem, CARD_BODY_FILE.suffix
+    if name == CARD_BODY_FILE.name:
+        return 0
+    if name.startswith(stem + ".") and name.endswith(suffix):
+        base = name[len(stem) + 1:-len(suffix)]
+        return int(base) if base.isdigit() else None
+    return None
+
+
+def segment_path(base: int) -> Path:
+    if not base:
+        return CARD_BODY_FILE
+    return CARD_BODY_FILE.with_name(f"{CARD_BODY_FILE.stem}.{base}{CARD_BODY_FILE.suffix}")
+
+
+def body_segments() -> list[tuple[int, Path]]:
+    """(base, path) of every body segment, oldest first."""
+    key = BASE_DIR.stat().st_mtime_ns
+    if _segments["key"] != key:
+        found = BASE_DIR.glob(f"{CARD_BODY_FILE.stem}*{CARD_BODY_FILE.suffix}")
+        bases = [(segment_base(p.name), p) for p in found]
+        _segments.update(key=key, list=sorted((b, p) for b, p in bases if b is not None))
+    return _segments["list"]
+
+
+def _locate_body(offset: int) -> tuple[Path, int]:
+    # Segment holding a logical offset, and the offset within it
+    for base, path in reversed(body_segments()):
+        if offset >= base:
+            return path, offset - base
+    return CARD_BODY_FILE, offset
+
+
+def card_body_end() -> int:
+    # Logical offset the next append lands at
+    segments = body_segments()
+    base, path = segments[-1] if segments else (0, CARD_BODY_FILE)
+    return base + (path.stat().st_size if path.exists() else 0)
+
+
+def card_body_store_id() -> int:
+    # Changes whenever the store is compacted or restored
+    segments = body_segments()
+    return segments[0][1].stat().st_ino if segments else 0
+
+
+@contextmanager
+def card_body_edit():
+    """
+    Hold while appending bodies and saving the cards that use them:
+    compaction waits, so it never drops bodies not saved yet.
+    """
+    with _body_lock:
+        yield
+
+
+def append_card_bodies(texts: list[str]) -> list[tuple[int, int]]:
+    payloads = [(t if isinstance(t, str) else "").encode("utf-8") for t in texts]
+
+    with _body_lock:
+        offset = card_body_end()
+        path, _ = _locate_body(offset)
+        with open(path, "ab") as f:
+            refs = []
+            for data in payloads:
+                refs.append((offset, len(data)))
+                offset += len(data)
+            f.write(b"".join(payloads))
+        _segments["key"] = None
+    metrics.DISK_BYTES.inc("write", "card_bodies", amount=offset - refs[0][0] if refs else 0)
+    return refs
+
+
+@lru_cache(maxsize=CARD_BODY_CACHE_SIZE)
+def _read_card_body(name: str, inode: int, offset: int, length: int) -> str:
+    # inode in the key: a restored store never serves stale text
+    metrics.DISK_BYTES.inc("read", "card_bodies", amount=length)
+    with open(BASE_DIR / name, "rb") as f:
+        f.seek(offset)
+        return f.read(length).decode("utf-8")
+
+
+def card_body(card) -> str:
+    """
+    Bullet text of one card row (Series, dict or record).
+    Recently shown cards are served from an LRU cache.
+    """
+    offset, length = card["body_offset"], card["body_length"]
+    if pd.isna(offset) or pd.isna(length) or not length:
+        return ""
+    path, pos = _locate_body(int(offset))
+    try:
+        return _read_card_body(path.name, path.stat().st_ino, pos, int(length))
+    except FileNotFoundError:
+        # Compacted away by another process since the cards were read
+        return ""
+
+
+def card_bodies(cards: pd.DataFrame) -> pd.Series:
+    # Bulk variant for exporters: one pass over the store in offset
+    # order, reading only these cards' bytes
+    bodies = [""] * len(cards)
+    offsets = cards["body_offset"].to_numpy(dtype=float, na_value=np.nan)
+    lengths = cards["body_length"].to_numpy(dtype=float, na_value=np.nan)
+    wanted = np.flatnonzero(~np.isnan(offsets) & ~np.isnan(lengths))
+
+    with ExitStack() as stack:
+        files = {}
+        for pos in wanted[np.argsort(offsets[wanted], kind="stable")]:
+            path, at = _locate_body(int(offsets[pos]))
+            if path not in files:
+                files[path] = stack.enter_context(open(path, "rb")) if path.exists() else None
+            if files[path] is not None:
+                files[path].seek(at)
+                bodies[pos] = files[path].read(int(lengths[pos])).decode("utf-8")
+
+    return pd.Series(bodies, index=cards.index, dtype=object)
+
+
+def card_body_stats() -> dict:
+    # Live bytes come from the manifest, kept per partition on save
+    entries = [e for e in load_manifest()["subjects"].values() if e.get("cards")]
+    if all("body_bytes" in e for e in entries):
+        live = sum(e["body_bytes"] for e in entries)
+    else:
+        # Manifest written before body sizes were tracked
+        live = int(load_cards()["body_length"].fillna(0).sum())
+    size = sum(p.stat().st_size for _, p in body_segments() if p.exists())
+    info = _read_card_body.cache_info()
+    return {
+        "bytes": size,
+        "live_bytes": live,
+        "dead_bytes": size - live,
+        "segments": len(body_segments()),
+        "cache_hits": info.hits,
+        "cache_misses": info.misses,
+    }
+
+
+metrics.register_cache("card_bodies", lambda: {
+    "hits": _read_card_body.cache_info().hits,
+    "misses": _read_card_body.cache_info().misses,
+})
+
+
+def migrate_card_bodies() -> pd.DataFrame:
+    # Old card table (bullets inline): move the text out
+    legacy = load_csv(CARD_FILE, CARD_COLUMNS + ["bullets"], DATE_COLUMNS_CARD)
+    refs = append_card_bodies(legacy["bullets"].fillna("").astype(str).tolist())
+    legacy["body_offset"] = [o for o, _ in refs]
+    legacy["body_length"] = [n for _, n in refs]
+    return normalize_cards(legacy[CARD_COLUMNS].copy())
+
+
+def compact_card_bodies(force: bool = False) -> int:
+    """
+    Rewrite the store with live bodies only, once dead bytes
+    outweigh live ones. Returns bytes reclaimed.
+    """
+    with _body_lock:
+        stats = card_body_stats()
+        dead = stats["dead_bytes"]
+        if not force and (dead < CARD_BODY_COMPACT_MIN_BYTES or dead < stats["live_bytes"]):
+            return 0
+
+        cards = load_cards()
+        payloads = [b.encode("utf-8") for b in card_bodies(cards)]
+        lengths = np.array([len(data) for data in payloads], dtype=np.int64)
+
+        # New segment first; the old ones still serve every saved offset
+        base = card_body_end()
+        target = segment_path(base)
+        tmp = target.with_name(target.name + ".tmp")
+        tmp.write_bytes(b"".join(payloads))
+        tmp.replace(target)
+        _segments["key"] = None
+
+        cards["body_offset"] = base + np.cumsum(lengths) - lengths
+        cards["body_length"] = lengths
+        save_cards(cards)
+
+        for _, path in body_segments():
+            if path != target:
+                path.unlink(missing_ok=True)
+        _segments["key"] = None
+
+    _read_card_body.cache_clear()
+    return dead
+
+# =========================
+# CHANGE TRACKING
+# =========================
+
+_version = {"generation": 0, "outcomes": 0, "mtimes": None, "writing": 0}
+
+
+def _file_mtimes() -> tuple:
+    files = [PYQ_FILE, CARD_FILE, MANIFEST_FILE]
+    for directory in (PYQ_PARTITION_DIR, CARD_PARTITION_DIR):
+        if directory.exists():
+            files.extend(sorted(directory.glob("*.csv")))
+    return tuple(
+        (f.name, f.stat().st_mtime_ns) if f.exists() else (f.name, 0)
+        for f in files
+    )
+
+
+@contextmanager
+def own_write(bump: bool = True):
+    # An in-process write must not be mistaken for an external one
+    _version["writing"] += 1
+    try:
+        yield
+    finally:
+        _version["mtimes"] = _file_mtimes()
+        if bump:
+            _version["generation"] += 1
+        _version["writing"] -= 1
+
+
+def data_version(include_outcomes: bool = True) -> tuple:
+    """
+    Cheap change marker shared by all sessions in this process.
+    Files changed by another process bump it as well.
+    include_outcomes=False ignores revision outcomes, for views
+    that only depend on which topics / cards exist.
+    """
+    mtimes = _file_mtimes()
+    if not _version["writing"] and mtimes != _version["mtimes"]:
+        _version["mtimes"] = mtimes
+        _version["generation"] += 1
+
+    if include_outcomes:
+        return (_version["generation"], _version["outcomes"])
+    return (_version["generation"],)
+
+# =========================
+# WRITE-BEHIND BUFFER
+# =========================
+
+FLUSH_EVERY = 10            # answers
+FLUSH_IDLE_SECONDS = 5      # quiet period before flushing
+MAX_PENDING_SECONDS = 30    # upper bound on the loss window
+
+_buffer = {
+    "lock": threading.Lock(),
+    "io_lock": threading.Lock(),
+    "wake": threading.Event(),
+    "pending": {},          # topic_id -> (seq, {column: value})
+    "events": [],           # review log rows not yet appended
+    "rollups_stale": False,  # an update failed after the log append
+    "seq": 0,
+    "since_flush": 0,
+    "first_at": None,
+    "last_at": None,
+    "writer": None,
+    "stats": {"outcomes": 0, "saves": 0, "flushed": 0, "clean_skips": 0},
+}
+
+
+def apply_row_updates(df: pd.DataFrame, updates: dict) -> pd.DataFrame:
+    """
+    Apply {topic_id: {column: value}} to the PYQ table.
+    Rows are located once by id; each column is written by position.
+    """
+    if not updates or df.empty:
+        return df
+
+    patch = pd.DataFrame.from_dict(updates, orient="index")
+    ids = id_index(df)
+    if ids.is_unique:
+        pos = ids.get_indexer(patch.index)
+        patch, pos = patch[pos >= 0], pos[pos >= 0]
+    else:
+        pos = np.flatnonzero(ids.isin(patch.index))
+        patch = patch.reindex(ids[pos])
+    if not len(pos):
+        return df
+
+    for col in patch.columns:
+        values = patch[col]
+        given = values.notna().to_numpy()
+        if not given.any():
+            continue
+        df.iloc[pos[given], df.columns.get_loc(col)] = values[given].to_numpy()
+
+    return df
+
+
+def record_pyq_update(topic_id: int, values: dict) -> None:
+    """
+    Queue a single-topic update (a revision outcome) instead of
+    saving the whole table. Later updates to the same topic win.
+    """
+    record_pyq_updates({topic_id: values})
+
+
+def record_pyq_updates(updates: dict) -> None:
+    # {topic_id: {column: value}} queued under one lock
+    now = time.monotonic()
+
+    with _buffer["lock"]:
+        for topic_id, values in updates.items():
+            _buffer["seq"] += 1
+            previous = _buffer["pending"].get(topic_id, (0, {}))[1]
+            _buffer["pending"][topic_id] = (_buffer["seq"], {**previous, **values})
+        _buffer["since_flush"] += len(updates)
+        _buffer["stats"]["outcomes"] += len(updates)
+        _buffer["first_at"] = _buffer["first_at"] or now
+        _buffer["last_at"] = now
+
+        if _buffer["since_flush"] >= FLUSH_EVERY:
+            _buffer["wake"].set()
+
+    _version["outcomes"] += len(updates)
+    _ensure_writer()
+
+
+def _pending_snapshot() -> dict:
+    with _buffer["lock"]:
+        return dict(_buffer["pending"])
+
+
+def _drop_flushed(snapshot: dict, stat: str = "saves") -> None:
+    # Remove what was written, keeping anything recorded meanwhile.
+    # Only saves that carried buffered updates are counted.
+    if not snapshot:
+        return
+    with _buffer["lock"]:
+        for topic_id, (seq, _) in snapshot.items():
+            if _buffer["pending"].get(topic_id, (None,))[0] == seq:
+                del _buffer["pending"][topic_id]
+        _buffer["stats"][stat] += 1
+        if stat == "saves":
+            _buffer["stats"]["flushed"] += len(snapshot)
+
+
+def flush_pending() -> bool:
+    """
+    Write buffered outcomes in one save.
+    Returns True if the table was rewritten.
+    """
+    start = time.perf_counter()
+    with _buffer["lock"]:
+        _buffer["since_flush"] = 0
+        _buffer["first_at"] = None
+
+    flush_review_events()
+
+    with _buffer["io_lock"]:
+        snapshot = _pending_snapshot()
+        if not snapshot:
+            return False
+
+        updates = {k: v for k, (_, v) in snapshot.items()}
+        subjects = sorted({topic_subjects().get(k, UNASSIGNED) for k in updates})
+        written = []
+
+        # Already visible through load_pyqs: not a data change
+        with own_write(bump=False):
+            for subject in subjects:
+                before = read_pyqs(subject)
+                after = apply_row_updates(before.copy(), updates)
+
+                # Dirty tracking: never rewrite an unchanged partition
+                if not after.equals(before):
+                    written += write_partitions("pyqs", after, [subject])
+
+        _drop_flushed(snapshot, stat="saves" if written else "clean_skips")
+
+    metrics.record_io("flush", "pyqs", start, len(updates))
+    return bool(written)
+
+
+def has_pending() -> bool:
+    with _buffer["lock"]:
+        return bool(_buffer["pending"] or _buffer["events"])
+
+
+def write_stats() -> dict:
+    with _buffer["lock"]:
+        stats = dict(_buffer["stats"])
+        stats["pending"] = len(_buffer["pending"])
+    # One save per buffered update written, had each been saved alone
+    stats["saves_avoided"] = max(stats["flushed"] - stats["saves"], 0)
+    return stats
+
+
+def _writer_loop():
+    while True:
+        _buffer["wake"].wait(timeout=1)
+        _buffer["wake"].clear()
+
+        with _buffer["lock"]:
+            if not _buffer["pending"] and not _buffer["events"]:
+                continue
+            now = time.monotonic()
+            # A manual flush may be writing these rows right now
+            first_at = _buffer["first_at"] or now
+            last_at = _buffer["last_at"] or now
+            due = (
+                _buffer["since_flush"] >= FLUSH_EVERY
+                or now - last_at >= FLUSH_IDLE_SECONDS
+                or now - first_at >= MAX_PENDING_SECONDS
+            )
+
+        if due:
+            try:
+                flush_pending()
+            except OSError:
+                # Keep the loop alive; buffered rows and events are retried next wake
+                pass
+
+
+def _ensure_writer():
+    writer = _buffer["writer"]
+    if writer is None or not writer.is_alive():
+        writer = threading.Thread(target=_writer_loop, daemon=True)
+        _buffer["writer"] = writer
+        writer.start()
+
+
+atexit.register(flush_pending)
+
+# =========================
+# REVIEW LOG
+# =========================
+
+def record_review_event(
+    topic_id: int,
+    subject: str,
+    outcome: str,
+    mode: str,
+    time_on_card_ms: int | None = None
+) -> None:
+    """
+    Buffer one review event; it is appended to the log
+    together with the next flush of the write buffer.
+    """
+    record_review_events([{
+        "topic_id": topic_id,
+        "subject": subject,
+        "timestamp": pd.Timestamp.now(),
+        "outcome": outcome,
+        "mode": mode,
+        "time_on_card_ms": int(time_on_card_ms or 0),
+    }])
+
+
+def record_review_events(events: list[dict]) -> None:
+    # Rows in REVIEW_LOG_COLUMNS order
+    now = time.monotonic()
+
+    with _buffer["lock"]:
+        _buffer["events"].extend(events)
+        _buffer["first_at"] = _buffer["first_at"] or now
+        _buffer["last_at"] = now
+
+    _ensure_writer()
+
+
+REVIEW_OUTCOMES = ["revised", "weak"]
+
+
+def outcome_update(row, outcome: str, mode: str = "revision") -> dict:
+    """
+    Column updates for one answer to a topic row (Series or dict).
+    Rapid review keeps fail_count on "revised" and does not
+    reschedule on "weak"; the revision screen does both.
+    """
+    today = pd.Timestamp(date.today())
+    revision_count = int(row["revision_count"])
+    fail_count = int(row["fail_count"])
+
+    if outcome == "revised":
+        return {
+            "revision_count": revision_count + 1,
+            "fail_count": max(fail_count - 1, 0) if mode == "revision" else max(fail_count, 0),
+            "last_revised": today,
+            "next_revision_date": compute_next_revision(revision_count + 1),
+        }
+    if outcome == "weak":
+        values = {"fail_count": fail_count + 1, "last_revised": today}
+        if mode == "revision":
+            values["next_revision_date"] = compute_next_revision(revision_count)
+        return values
+    raise ValueError(f"Unknown outcome: {outcome}")
+
+
+def record_answer(row, outcome: str, mode: str = "revision", time_on_card_ms: int | None = None) -> dict:
+    """
+    One answer to the card on screen: queue the topic's update and
+    its review event, and apply the update to `row` (record or dict)
+    so it shows the new state. Returns the column updates.
+    """
+    values = outcome_update(row, outcome, mode)
+    record_pyq_update(int(row["id"]), values)
+    record_review_event(int(row["id"]), row["subject"], outcome, mode, time_on_card_ms)
+    row.update(values)
+    return values
+
+
+def record_outcomes(outcomes: list[dict]) -> list[dict]:
+    """
+    Apply a batch of answers ({topic_id, outcome, mode,
+    time_on_card_ms}) in order through the write buffer. A topic
+    answered twice sees its first answer. The whole batch is
+    validated and planned before anything is recorded, so a rejected
+    batch changes nothing. Returns the new state per answer.
+    """
+    checked = []
+    for i, o in enumerate(outcomes):
+        if o.get("outcome") not in REVIEW_OUTCOMES:
+            raise ValueError(f"Unknown outcome: {o.get('outcome')}")
+        mode = o.get("mode", "revision")
+        if mode not in ("revision", "rapid_review"):
+            raise ValueError(f"Unknown mode: {o.get('mode')}")
+        try:
+            topic_id = int(o["topic_id"])
+            ms = int(o.get("time_on_card_ms") or 0)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Outcome {i} needs an integer topic_id and time_on_card_ms")
+        if ms < 0:
+            raise ValueError(f"Outcome {i} has a negative time_on_card_ms")
+        checked.append((topic_id, o["outcome"], mode, ms))
+
+    ids = {topic_id for topic_id, *_ in checked}
+    pyqs = load_pyqs()
+    rows = pyqs.loc[
+        pyqs["id"].isin(ids),
+        ["id", "subject", "revision_count", "fail_count", "next_revision_date"]
+    ]
+    state = {int(r["id"]): r for r in rows.to_dict("records")}
+    missing = ids - set(state)
+    if missing:
+        raise KeyError(f"Unknown topic ids: {sorted(missing)}")
+
+    planned, results = [], []
+    for topic_id, outcome, mode, ms in checked:
+        row = state[topic_id]
+        values = outcome_update(row, outcome, mode)
+        row.update(values)
+        planned.append((row["id"], row["subject"], outcome, mode, ms, values))
+        results.append({
+            "topic_id": row["id"],
+            "revision_count": row["revision_count"],
+            "fail_count": row["fail_count"],
+            "next_revision_date": None if pd.isna(row["next_revision_date"])
+            else row["next_revision_date"],
+        })
+
+    # Nothing above touched the buffer
+    for topic_id, subject, outcome, mode, ms, values in planned:
+        record_pyq_update(topic_id, values)
+        record_review_event(topic_id, subject, outcome, mode, ms)
+    return results
+
+
+def outcome_updates(rows: pd.DataFrame, outcomes: pd.Series) -> pd.DataFrame:
+    """
+    Vectorized outcome_update (revision semantics) for many topics.
+    `outcomes` is aligned with `rows`; returns the new column values
+    with an `id` column, one row per topic.
+    """
+    revised = (outcomes == "revised").to_numpy()
+    revision_count = rows["revision_count"].fillna(0).astype(int) + revised
+    fails = rows["fail_count"].fillna(0).astype(int)
+
+    return pd.DataFrame({
+        "id": rows["id"],
+        "revision_count": revision_count,
+        "fail_count": np.where(revised, (fails - 1).clip(lower=0), fails + 1),
+        "last_revised": pd.Timestamp(date.today()),
+        "next_revision_date": compute_next_revisions(revision_count),
+    })
+
+
+def record_batch_outcomes(answers: pd.DataFrame, mode: str) -> pd.DataFrame:
+    """
+    Write a finished batch of answers (topic_id, outcome,
+    time_on_card_ms; one per topic) with one flush of the write
+    buffer instead of one save per answer. Returns the new state.
+    """
+    if mode not in REVIEW_MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    unknown = set(answers["outcome"]) - set(REVIEW_OUTCOMES)
+    if unknown:
+        raise ValueError(f"Unknown outcome: {sorted(unknown)[0]}")
+    if answers.empty:
+        return pd.DataFrame(columns=["id", "revision_count", "fail_count", "last_revised", "next_revision_date"])
+
+    pyqs = load_pyqs()
+    rows = pyqs.loc[pyqs["id"].isin(answers["topic_id"]), ["id", "subject", "revision_count", "fail_count"]]
+    missing = set(answers["topic_id"]) - set(rows["id"])
+    if missing:
+        raise KeyError(f"Unknown topic ids: {sorted(missing)}")
+
+    answers = answers.drop_duplicates("topic_id", keep="last").set_index("topic_id")
+    outcomes = answers["outcome"].reindex(rows["id"]).set_axis(rows.index)
+    updates = outcome_updates(rows, outcomes)
+
+    record_pyq_updates(updates.set_index("id").to_dict("index"))
+
+    events = pd.DataFrame({
+        "topic_id": rows["id"],
+        "subject": rows["subject"],
+        "timestamp": pd.Timestamp.now(),
+        "outcome": outcomes,
+        "mode": mode,
+        "time_on_card_ms": answers["time_on_card_ms"].reindex(rows["id"])
+        .fillna(0).astype(int).set_axis(rows.index),
+    })
+    record_review_events(events.to_dict("records"))
+
+    flush_pending()
+    return updates
+
+
+def flush_review_events() -> int:
+    with _buffer["lock"]:
+        events, _buffer["events"] = _buffer["events"], []
+
+    if not events and not _buffer["rollups_stale"]:
+        return 0
+
+    start = time.perf_counter()
+    df = pd.DataFrame(events, columns=REVIEW_LOG_COLUMNS)
+
+    with _buffer["io_lock"]:
+        # Append-only: the log is never rewritten
+        try:
+            if events:
+                df.to_csv(
+                    REVIEW_LOG_FILE,
+                    mode="a",
+                    header=not REVIEW_LOG_FILE.exists(),
+                    index=False
+                )
+        except OSError:
+            # Not in the log: back to the front of the buffer for the next flush
+            with _buffer["lock"]:
+                _buffer["events"][:0] = events
+            raise
+
+        # Logged events are never appended twice; rollups that failed
+        # to update are recomputed from the log on a later flush
+        stale = _buffer["rollups_stale"]
+        _buffer["rollups_stale"] = True
+        if stale:
+            rebuild_rollups()
+        else:
+            update_rollups(df)
+        _buffer["rollups_stale"] = False
+    metrics.record_io("append", "review_log", start, len(df))
+
+    return len(df)
+
+
+def load_review_log() -> pd.DataFrame:
+    return load_csv(REVIEW_LOG_FILE, REVIEW_LOG_COLUMNS, ["timestamp"])
+
+# =========================
+# ROLLUPS
+# =========================
+
+def summarize_events(events: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    events = events.assign(
+        date=events["timestamp"].dt.normalize(),
+        revised=(events["outcome"] == "revised").astype(int),
+        weak=(events["outcome"] == "weak").astype(int),
+        time_on_card_ms=events["time_on_card_ms"].fillna(0).astype(int),
+    )
+
+    # dropna=False: topics without a subject still count
+    daily = events.groupby(
+        ["date", "subject", "mode"], as_index=False, dropna=False
+    ).agg(
+        reviews=("topic_id", "size"),
+        revised=("revised", "sum"),
+        weak=("weak", "sum"),
+        total_ms=("time_on_card_ms", "sum"),
+    )
+
+    topics = events.groupby(
+        ["topic_id", "subject"], as_index=False, dropna=False
+    ).agg(
+        reviews=("topic_id", "size"),
+        weak=("weak", "sum"),
+        total_ms=("time_on_card_ms", "sum"),
+    )
+
+    return daily, topics
+
+
+def _merge_counts(existing: pd.DataFrame, new: pd.DataFrame, keys: list) -> pd.DataFrame:
+    if existing.empty:
+        return new
+    return pd.concat([existing, new], ignore_index=True).groupby(
+        keys, as_index=False, dropna=False
+    ).sum()
+
+
+def update_rollups(events: pd.DataFrame) -> None:
+    # Incremental: only the new events are aggregated, then added
+    daily, topics = summarize_events(events)
+
+    daily = _merge_counts(load_daily_rollup(), daily, ["date", "subject", "mode"])
+    topics = _merge_counts(load_topic_rollup(), topics, ["topic_id", "subject"])
+
+    save_csv(daily, DAILY_ROLLUP_FILE, DAILY_ROLLUP_COLUMNS)
+    save_csv(topics, TOPIC_ROLLUP_FILE, TOPIC_ROLLUP_COLUMNS)
+
+
+def rebuild_rollups() -> None:
+    # Full recompute from the log (recovery / schema change)
+    daily, topics = summarize_events(load_review_log())
+    save_csv(daily, DAILY_ROLLUP_FILE, DAILY_ROLLUP_COLUMNS)
+    save_csv(topics, TOPIC_ROLLUP_FILE, TOPIC_ROLLUP_COLUMNS)
+
+
+def load_daily_rollup() -> pd.DataFrame:
+    return load_csv(DAILY_ROLLUP_FILE, DAILY_ROLLUP_COLUMNS, ["date"])
+
+
+def load_topic_rollup() -> pd.DataFrame:
+    return load_csv(TOPIC_ROLLUP_FILE, TOPIC_ROLLUP_COLUMNS)
+
+# =========================
+# REVIEW AGGREGATIONS
+# =========================
+
+def daily_totals(daily: pd.DataFrame) -> pd.DataFrame:
+    return daily.groupby("date", as_index=False)[
+        ["reviews", "revised", "weak", "total_ms"]
+    ].sum().sort_values("date")
+
+
+def review_streak(daily: pd.DataFrame) -> int:
+    """
+    Consecutive days with at least one review, ending today
+    (or yesterday, so the streak survives until today's first card).
+    """
+    days = pd.Series(daily.loc[daily["reviews"] > 0, "date"].dropna().unique())
+    if days.empty:
+        return 0
+
+    days = days.sort_values().reset_index(drop=True)
+    today = pd.Timestamp(date.today())
+    if days.iloc[-1] < today - timedelta(days=1):
+        return 0
+
+    run_id = (days.diff() != timedelta(days=1)).cumsum()
+    return int((run_id == run_id.iloc[-1]).sum())
+
+
+def reviews_today(daily: pd.DataFrame) -> int:
+    today = pd.Timestamp(date.today())
+    return int(daily.loc[daily["date"] == today, "reviews"].sum())
+
+
+def subject_accuracy(daily: pd.DataFrame) -> pd.DataFrame:
+    per_subject = daily.groupby("subject", as_index=False)[["revised", "weak"]].sum()
+    graded = per_subject["revised"] + per_subject["weak"]
+    per_subject["accuracy"] = (per_subject["revised"] / graded.where(graded > 0)).round(2)
+    return per_subject.sort_values("accuracy")
+
+
+def slowest_topics(topics: pd.DataFrame, pyqs: pd.DataFrame, n: int = 5) -> pd.DataFrame:
+    topics = topics[topics["reviews"] > 0].assign(
+        mean_ms=lambda t: (t["total_ms"] / t["reviews"]).round()
+    )
+    slowest = topics.nlargest(n, "mean_ms")
+    return slowest.merge(
+        pyqs[["id", "topic"]], left_on="topic_id", right_on="id", how="left"
+    )[["topic_id", "topic", "subject", "reviews", "weak", "mean_ms"]]
 
 # =========================
 # INVARIANTS
@@ -215,31 +1604,70 @@ def new_card_row(
 # BACKUP / RESTORE
 # =========================
 
-def create_full_backup():
-    buffer = BytesIO()
+DATA_FILES = [
+    PYQ_FILE, CARD_FILE, CARD_BODY_FILE,
+    REVIEW_LOG_FILE, DAILY_ROLLUP_FILE, TOPIC_ROLLUP_FILE
+]
+
+
+def backup_members() -> list[str]:
+    files = [str(f) for f in DATA_FILES if f.exists()]
+    files += [str(p) for _, p in body_segments() if p != CARD_BODY_FILE]
+    for directory in (PARTITION_DIR, IMAGE_DIR):
+        if directory.exists():
+            for root, _, names in os.walk(directory):
+                files.extend(os.path.join(root, f) for f in names)
+    return files
+
+
+def create_full_backup(target=None, progress=None):
+    """
+    Zip every data file and image. target: a path or binary file to
+    stream into; None builds the archive in memory and returns it.
+    progress(done, total) is called after each member.
+    """
+    start = time.perf_counter()
+    flush_pending()
+
+    buffer = BytesIO() if target is None else target
+    members = backup_members()
     with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
-        if PYQ_FILE.exists():
-            z.write(PYQ_FILE)
-        if CARD_FILE.exists():
-            z.write(CARD_FILE)
-        if IMAGE_DIR.exists():
-            for root, _, files in os.walk(IMAGE_DIR):
-                for f in files:
-                    z.write(os.path.join(root, f))
-    buffer.seek(0)
+        for done, f in enumerate(members, 1):
+            z.write(f)
+            if progress:
+                progress(done, len(members))
+
+    try:
+        size = os.path.getsize(buffer) if isinstance(buffer, (str, os.PathLike)) else buffer.tell()
+    except OSError:
+        size = 0    # unseekable stream (a pipe)
+    metrics.BACKUP_SECONDS.observe(time.perf_counter() - start)
+    metrics.BACKUP_BYTES.inc(amount=size)
+    metrics.BACKUP_LAST_BYTES.set(size)
+
+    if target is None:
+        buffer.seek(0)
     return buffer
 
 
 def restore_full_backup(uploaded_file):
-    for f in [PYQ_FILE, CARD_FILE]:
+    # Buffered answers belong to the data being replaced
+    with _buffer["lock"]:
+        _buffer["pending"].clear()
+        _buffer["events"].clear()
+    _read_card_body.cache_clear()
+
+    for f in DATA_FILES + [p for _, p in body_segments()]:
         if f.exists():
             f.unlink()
 
-    if IMAGE_DIR.exists():
-        shutil.rmtree(IMAGE_DIR)
+    for directory in (PARTITION_DIR, IMAGE_DIR):
+        if directory.exists():
+            shutil.rmtree(directory)
 
     with zipfile.ZipFile(uploaded_file, "r") as z:
         z.extractall(".")
+    _segments["key"] = None
 
     IMAGE_DIR.mkdir(parents=True, exist_ok=True)
     return True
@@ -255,30 +1683,381 @@ def upsert_card(
     image_paths: str = "",
     external_url: str = ""
 ):
-    cards = load_cards()
+    upsert_cards([{
+        "topic_id": topic_id,
+        "card_title": card_title,
+        "bullets": bullets,
+        "image_paths": image_paths,
+        "external_url": external_url,
+    }])
 
-    if not cards[cards.topic_id == topic_id].empty:
-        cards.loc[
-            cards.topic_id == topic_id,
-            ["card_title", "bullets", "image_paths", "external_url"]
-        ] = [card_title, bullets, image_paths, external_url]
-    else:
-        new_row = {
-            "card_id": safe_next_id(cards["card_id"]),
-            "topic_id": topic_id,
-            "card_title": card_title,
-            "bullets": bullets,
-            "image_paths": image_paths,
-            "external_url": external_url,
-            "created_at": pd.Timestamp.now(),
-            "schema_version": DATA_VERSION
-        }
-        cards = pd.concat([cards, pd.DataFrame([new_row])], ignore_index=True)
 
-    save_cards(cards)
+def upsert_cards(records: list[dict]) -> tuple[int, int]:
+    """
+    Create or replace the card of each record's topic_id with one
+    body append and one save. Returns (inserted, updated).
+    """
+    if not records:
+        return 0, 0
+
+    # Nothing may compact or save cards between this load and save
+    with _body_lock:
+        cards = load_cards()
+        refs = append_card_bodies([r["bullets"] for r in records])
+        columns = ["card_title", "image_paths", "external_url", "body_offset", "body_length"]
+        now = pd.Timestamp.now()
+
+        # Last record wins when a topic appears twice
+        latest = {}
+        for rec, (body_offset, body_length) in zip(records, refs):
+            latest[int(rec["topic_id"])] = [
+                rec.get("card_title", ""), rec.get("image_paths", ""),
+                rec.get("external_url", ""), body_offset, body_length
+            ]
+
+        patch = pd.DataFrame.from_dict(latest, orient="index", columns=columns)
+        existing = cards["topic_id"].isin(patch.index)
+        keys = cards.loc[existing, "topic_id"].astype("int64")
+        for col in columns:
+            cards.loc[existing, col] = patch[col].reindex(keys).to_numpy()
+
+        known = set(keys)
+        next_id = safe_next_id(cards["card_id"])
+        new_rows = []
+        for topic_id, values in latest.items():
+            if topic_id in known:
+                continue
+            new_rows.append({
+                "card_id": next_id,
+                "topic_id": topic_id,
+                **dict(zip(columns, values)),
+                "created_at": now,
+                "schema_version": DATA_VERSION
+            })
+            next_id += 1
+
+        if new_rows:
+            attrs = cards.attrs
+            cards = pd.concat([cards, pd.DataFrame(new_rows)], ignore_index=True)
+            cards.attrs = attrs
+
+        save_cards(cards)
+        compact_card_bodies()
+    return len(new_rows), len(latest) - len(new_rows)
 
 
 def delete_card(topic_id: int):
-    cards = load_cards()
-    cards = cards[cards.topic_id != topic_id]
-    save_cards(cards)
\ No newline at end of file
+    with _body_lock:
+        cards = load_cards()
+        cards = cards[cards.topic_id != topic_id]
+        save_cards(cards)
+        compact_card_bodies()
+
+# =========================
+# BULK OPERATIONS
+# =========================
+
+BULK_ACTIONS = ["revised", "weak", "shift", "reset"]
+
+
+def select_pyqs(
+    df: pd.DataFrame,
+    subject: str | None = None,
+    start: date | None = None,
+    end: date | None = None,
+    ids: list[int] | None = None,
+    date_col: str = "next_revision_date"
+) -> pd.Series:
+    mask = pd.Series(True, index=df.index)
+
+    if subject and subject != "All":
+        mask &= df["subject"] == subject
+
+    if start is not None:
+        mask &= df[date_col] >= pd.Timestamp(start)
+
+    if end is not None:
+        # Inclusive of the whole end day
+        mask &= df[date_col] < pd.Timestamp(end) + timedelta(days=1)
+
+    if ids is not None:
+        mask &= df["id"].isin(ids)
+
+    return mask
+
+
+def apply_bulk_action(
+    df: pd.DataFrame,
+    mask: pd.Series,
+    action: str,
+    days: int = 0
+) -> pd.DataFrame:
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"Unknown bulk action: {action}")
+
+    if not mask.any():
+        return df
+
+    now = pd.Timestamp.now()
+    today = pd.Timestamp(date.today())
+
+    if action == "revised":
+        df.loc[mask, "revision_count"] = df.loc[mask, "revision_count"] + 1
+        df.loc[mask, "fail_count"] = (df.loc[mask, "fail_count"] - 1).clip(lower=0)
+        df.loc[mask, "last_revised"] = today
+        df.loc[mask, "next_revision_date"] = compute_next_revisions(
+            df.loc[mask, "revision_count"]
+        )
+
+    elif action == "weak":
+        df.loc[mask, "fail_count"] = df.loc[mask, "fail_count"] + 1
+        df.loc[mask, "last_revised"] = today
+        df.loc[mask, "next_revision_date"] = compute_next_revisions(
+            df.loc[mask, "revision_count"]
+        )
+
+    elif action == "shift":
+        df.loc[mask, "next_revision_date"] = (
+            df.loc[mask, "next_revision_date"].fillna(now)
+            + timedelta(days=int(days))
+        )
+
+    elif action == "reset":
+        df.loc[mask, "revision_count"] = 0
+        df.loc[mask, "fail_count"] = 0
+        df.loc[mask, "last_revised"] = pd.NaT
+        df.loc[mask, "next_revision_date"] = now
+
+    return df
+
+
+def bulk_update_pyqs(
+    action: str,
+    subject: str | None = None,
+    start: date | None = None,
+    end: date | None = None,
+    ids: list[int] | None = None,
+    days: int = 0
+) -> int:
+    """
+    Apply one action to every selected topic as a single
+    vectorized update followed by a single save.
+    Returns the number of topics affected.
+    """
+    pyqs = load_pyqs(subject if subject and subject != "All" else None)
+    mask = select_pyqs(pyqs, subject=subject, start=start, end=end, ids=ids)
+
+    affected = int(mask.sum())
+    if affected:
+        pyqs = apply_bulk_action(pyqs, mask, action, days=days)
+        save_pyqs(pyqs)
+
+    return affected
+
+# =========================
+# QUERY API
+# =========================
+
+# One index per subject scope, shared by all sessions and rebuilt when
+# the data version (outcomes included) or the calendar day changes.
+QUERY_FILTERS = ["due", "weak", "never", "needs_revision", "has_card", "has_images"]
+QUERY_ORDERS = {
+    "priority": (["fail_count", "revision_count"], [False, True]),
+    "due": (["next_revision_date"], [True]),
+    "recent": (["last_revised"], [False]),
+    "topic": (["topic"], [True]),
+    "id": (["id"], [True]),
+}
+CARD_QUERY_COLUMNS = ["card_id", "card_title", "image_paths", "body_offset", "body_length"]
+
+
+class ReviewRecord(Record):
+    # A query row: topic plus its card's hot columns
+    __slots__ = tuple(PYQ_COLUMNS + CARD_QUERY_COLUMNS)
+
+QUERY_LOG_SIZE = 50
+
+_indexes: dict = {}
+_index_stats = {"hits": 0, "misses": 0}
+_query_log = deque(maxlen=QUERY_LOG_SIZE)
+
+
+def build_query_index(subject: str | None = None) -> dict:
+    pyqs = load_pyqs(subject).reset_index(drop=True)
+    cards = load_cards(subject).drop_duplicates("topic_id").reset_index(drop=True)
+
+    card_pos = pd.Index(cards["topic_id"]).get_indexer(pyqs["id"])
+    has_card = card_pos >= 0
+    card_images = (cards["image_paths"].fillna("") != "").to_numpy(dtype=bool)
+
+    weak = (pyqs["fail_count"] > 0).to_numpy(dtype=bool, na_value=False)
+    never = (pyqs["revision_count"] == 0).to_numpy(dtype=bool, na_value=False)
+    due = is_due(pyqs).to_numpy(dtype=bool)
+
+    bitmaps = {
+        "due": due,
+        "weak": weak,
+        "never": never,
+        "needs_revision": due | weak | never,
+        "has_card": has_card,
+        "has_images": has_card & card_images[np.where(has_card, card_pos, 0)]
+        if len(cards) else np.zeros(len(pyqs), dtype=bool),
+    }
+
+    return {
+        "pyqs": pyqs,
+        "cards": cards,
+        "card_pos": card_pos,
+        "bitmaps": bitmaps,
+        "counts": {name: int(b.sum()) for name, b in bitmaps.items()},
+        "id_index": pd.Index(pyqs["id"]),
+        "orders": {},
+    }
+
+
+def query_index(subject: str | None = None) -> tuple[dict, bool]:
+    key = (data_version(), date.today())
+    cached = _indexes.get(subject)
+    if cached and cached[0] == key:
+        _index_stats["hits"] += 1
+        return cached[1], False
+
+    _index_stats["misses"] += 1
+    index = build_query_index(subject)
+    _indexes[subject] = (key, index)
+    return index, True
+
+
+metrics.register_cache("query_index", lambda: dict(_index_stats))
+
+
+def _order_permutation(index: dict, order: str) -> np.ndarray:
+    # Sorted row positions, computed once per index
+    if order not in index["orders"]:
+        cols, ascending = QUERY_ORDERS[order]
+        index["orders"][order] = (
+            index["pyqs"][cols]
+            .sort_values(by=cols, ascending=ascending, kind="stable")
+            .index.to_numpy()
+        )
+    return index["orders"][order]
+
+
+def query(
+    subject: str | None = None,
+    *,
+    due: bool | None = None,
+    weak: bool | None = None,
+    never: bool | None = None,
+    needs_revision: bool | None = None,
+    has_card: bool | None = None,
+    has_images: bool | None = None,
+    ids: list | None = None,
+    exclude_ids=None,
+    order: str | None = None,
+    limit: int | None = None,
+    columns: list | None = None
+) -> pd.DataFrame:
+    """
+    Topics matching every given filter (True = must hold,
+    False = must not hold, None = ignored).
+
+    - subject: reads only that subject's partition ("All"/None = all)
+    - needs_revision: due or weak or never revised
+    - has_images: the topic's study card has images
+    - order: one of QUERY_ORDERS; limit stops the scan early
+    - columns: PYQ columns plus any of CARD_QUERY_COLUMNS
+
+    The plan of each call is kept in query_log().
+    """
+    subject = None if subject in (None, "All") else subject
+    filters = {
+        "due": due, "weak": weak, "never": never,
+        "needs_revision": needs_revision, "has_card": has_card, "has_images": has_images,
+    }
+    if order is not None and order not in QUERY_ORDERS:
+        raise ValueError(f"Unknown order: {order}")
+
+    start = last = time.perf_counter()
+    steps = []
+
+    def step(name: str, rows: int):
+        nonlocal last
+        now = time.perf_counter()
+        steps.append({"step": name, "rows": rows, "ms": round((now - last) * 1000, 3)})
+        last = now
+
+    index, built = query_index(subject)
+    n = len(index["pyqs"])
+    step(f"{'build' if built else 'reuse'} index ({subject or 'All'})", n)
+
+    # Most selective bitmap first
+    mask = np.ones(n, dtype=bool)
+    active = [(f, v) for f, v in filters.items() if v is not None]
+    for name, wanted in sorted(
+        active,
+        key=lambda fv: index["counts"][fv[0]] if fv[1] else n - index["counts"][fv[0]]
+    ):
+        bitmap = index["bitmaps"][name]
+        mask &= bitmap if wanted else ~bitmap
+        step(f"{name}={wanted}", int(mask.sum()))
+
+    if ids is not None:
+        keep = np.zeros(n, dtype=bool)
+        pos = index["id_index"].get_indexer(list(ids))
+        keep[pos[pos >= 0]] = True
+        mask &= keep
+        step("ids", int(mask.sum()))
+
+    if exclude_ids:
+        pos = index["id_index"].get_indexer(list(exclude_ids))
+        mask[pos[pos >= 0]] = False
+        step("exclude_ids", int(mask.sum()))
+
+    if order is not None:
+        perm = _order_permutation(index, order)
+        positions = perm[mask[perm]]
+        step(f"order by {order}", len(positions))
+    else:
+        positions = np.flatnonzero(mask)
+
+    if limit is not None:
+        positions = positions[:limit]
+        step(f"limit {limit}", len(positions))
+
+    columns = columns or PYQ_COLUMNS
+    pyq_cols = [c for c in columns if c in PYQ_COLUMNS]
+    card_cols = [c for c in columns if c in CARD_QUERY_COLUMNS]
+
+    result = index["pyqs"][pyq_cols].take(positions).reset_index(drop=True)
+    if card_cols:
+        card_pos = index["card_pos"][positions]
+        found = card_pos >= 0
+        card_part = index["cards"][card_cols].take(np.where(found, card_pos, 0)).reset_index(drop=True)
+        if not found.all():
+            card_part.loc[~found, :] = pd.NA
+        for col in card_cols:
+            result[col] = card_part[col]
+    result = result[[c for c in columns if c in result.columns]]
+    step("project " + ",".join(result.columns), len(result))
+
+    _query_log.append({
+        "subject": subject or "All",
+        "filters": {f: v for f, v in active},
+        "order": order,
+        "limit": limit,
+        "steps": steps,
+        "rows": len(result),
+        "total_ms": round((time.perf_counter() - start) * 1000, 3),
+    })
+    return result
+
+
+def explain(**kwargs) -> dict:
+    # Run the query and return its plan instead of the rows
+    query(**kwargs)
+    return _query_log[-1]
+
+
+def query_log() -> list[dict]:
+    return list(_query_log)
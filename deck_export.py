@@ -0,0 +1,431 @@
+"""
+Module 20 — Deck Export
+
+Responsibilities:
+- Streaming export of PYQs joined with their study cards
+- Formats: JSONL, Markdown (one file per subject), Anki package (.apkg)
+- Images bundled next to the export: hard link, else kernel-side copy
+- Throughput stats for every run
+
+The deck is read one subject partition at a time and written in
+chunks of EXPORT_CHUNK topics; card bodies are read per chunk. Output
+goes straight to its file (the Anki collection to an SQLite file on
+disk), so memory stays at one partition plus one chunk.
+
+Usage:
+    python deck_export.py jsonl|markdown|anki [--out PATH] [--subject S ...]
+                          [--no-media] [--chunk 2000]
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+
+import data_layer
+import media
+
+EXPORT_DIR = data_layer.BASE_DIR / "exports"
+EXPORT_CHUNK = 2000
+EXPORT_FORMATS = ["jsonl", "markdown", "anki"]
+
+EXPORT_COLUMNS = [
+    "id", "topic", "subject", "pyq_years", "trigger_line", "pyq_image_paths",
+    "revision_count", "fail_count", "last_revised", "next_revision_date",
+    "card_title", "bullets", "external_url", "image_paths",
+]
+
+# =========================
+# READING
+# =========================
+
+def export_subjects(subjects: list[str] | None = None) -> list[str]:
+    # Every subject with topics, the unassigned one included
+    present = [s for s, e in data_layer.load_manifest()["subjects"].items() if e.get("pyqs")]
+    return sorted(s for s in present if not subjects or s in subjects)
+
+
+def iter_deck(subjects: list[str] | None = None, chunk_size: int = EXPORT_CHUNK):
+    """
+    (subject, chunk) pairs: chunk_size topics at a time, sorted by
+    topic, joined with their card and its bullets.
+    """
+    data_layer.migrate_legacy_tables()
+    for subject in export_subjects(subjects):
+        pyqs = data_layer.load_pyqs(subject).sort_values("topic", kind="stable")
+        cards = data_layer.load_cards(subject).drop_duplicates("topic_id")
+        cards = cards[["topic_id", "card_title", "external_url", "image_paths", "body_offset", "body_length"]]
+
+        for start in range(0, len(pyqs), chunk_size):
+            chunk = pyqs.iloc[start:start + chunk_size]
+            joined = chunk.merge(cards, left_on="id", right_on="topic_id", how="left")
+            joined["bullets"] = data_layer.card_bodies(joined)
+            for col in ["card_title", "external_url", "image_paths", "pyq_image_paths", "trigger_line", "pyq_years"]:
+                joined[col] = joined[col].fillna("").astype(str)
+            yield subject, joined[EXPORT_COLUMNS]
+
+# =========================
+# MEDIA
+# =========================
+
+def link_or_copy(src: Path, dst: Path) -> str:
+    """
+    Put src at dst without moving bytes through Python: a hard link
+    when both are on one filesystem, else shutil.copyfile, which uses
+    sendfile(2) on Linux. Stored images are never rewritten in place,
+    so a link cannot change under the export.
+    """
+    try:
+        os.link(src, dst)
+        return "linked"
+    except OSError:
+        shutil.copyfile(src, dst)
+        return "copied"
+
+
+class MediaFolder:
+    # Images of an export under one folder, each written once
+    def __init__(self, directory: Path | None, enabled: bool = True):
+        self.directory = directory
+        self.enabled = enabled
+        self.sources: dict[str, Path] = {}
+        self.stats = {"images": 0, "linked": 0, "copied": 0, "missing": 0, "image_bytes": 0}
+
+    def add(self, value) -> list[str]:
+        """Names of a row's images, copied into directory (if any) on first sight; missing ones dropped."""
+        names = []
+        for p in media.split_paths(value) if self.enabled else []:
+            src = Path(p)
+            if not src.exists():
+                self.stats["missing"] += 1
+                continue
+            names.append(src.name)
+            if src.name in self.sources:
+                continue
+            self.sources[src.name] = src
+            if self.directory is None:
+                continue
+            self.directory.mkdir(parents=True, exist_ok=True)
+            dst = self.directory / src.name
+            dst.unlink(missing_ok=True)
+            self.stats[link_or_copy(src, dst)] += 1
+            self.stats["images"] += 1
+            self.stats["image_bytes"] += src.stat().st_size
+        return names
+
+# =========================
+# WRITERS
+# =========================
+
+def _date(value) -> str | None:
+    return None if pd.isna(value) else pd.Timestamp(value).isoformat()
+
+
+def _bullets(text: str) -> list[str]:
+    return [line.strip().lstrip("•").strip() for line in text.splitlines() if line.strip()]
+
+
+def write_jsonl(out: Path, subjects, chunk_size: int, with_media: bool) -> dict:
+    """out/deck.jsonl, one topic per line; images in out/media."""
+    out.mkdir(parents=True, exist_ok=True)
+    images = MediaFolder(out / "media", with_media)
+    rows = 0
+
+    with open(out / "deck.jsonl", "w", encoding="utf-8") as f:
+        for _, chunk in iter_deck(subjects, chunk_size):
+            lines = []
+            for row in chunk.itertuples(index=False):
+                lines.append(json.dumps({
+                    "id": int(row.id),
+                    "topic": row.topic,
+                    "subject": row.subject,
+                    "pyq_years": row.pyq_years,
+                    "trigger_line": row.trigger_line,
+                    "revision_count": int(row.revision_count),
+                    "fail_count": int(row.fail_count),
+                    "last_revised": _date(row.last_revised),
+                    "next_revision_date": _date(row.next_revision_date),
+                    "card_title": row.card_title,
+                    "bullets": _bullets(row.bullets),
+                    "external_url": row.external_url,
+                    "images": [f"media/{n}" for n in images.add(row.image_paths)],
+                    "pyq_images": [f"media/{n}" for n in images.add(row.pyq_image_paths)],
+                }, ensure_ascii=False))
+            f.write("\n".join(lines) + "\n")
+            rows += len(chunk)
+
+    return {"path": str(out / "deck.jsonl"), "topics": rows, **images.stats}
+
+
+def safe_name(subject: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in subject).lower() or "_unassigned"
+
+
+def write_markdown(out: Path, subjects, chunk_size: int, with_media: bool) -> dict:
+    """out/<subject>.md per subject; images in out/media."""
+    out.mkdir(parents=True, exist_ok=True)
+    images = MediaFolder(out / "media", with_media)
+    rows, files, f, current = 0, [], None, None
+
+    try:
+        for subject, chunk in iter_deck(subjects, chunk_size):
+            if subject != current:
+                if f:
+                    f.close()
+                path = out / f"{safe_name(subject)}.md"
+                f = open(path, "w", encoding="utf-8")
+                f.write(f"# {subject or 'Unassigned'}\n\n")
+                files.append(str(path))
+                current = subject
+
+            parts = []
+            for row in chunk.itertuples(index=False):
+                parts.append(f"## {row.topic}\n")
+                if row.pyq_years.strip():
+                    parts.append(f"*PYQ years: {row.pyq_years}*\n")
+                if row.trigger_line.strip():
+                    parts.append(f"> 🧠 {row.trigger_line}\n")
+                parts.extend(f"- {b}" for b in _bullets(row.bullets))
+                for name in images.add(row.image_paths) + images.add(row.pyq_image_paths):
+                    parts.append(f"\n![{name}](media/{name})")
+                if row.external_url.strip():
+                    parts.append(f"\n[Source]({row.external_url})")
+                parts.append("\n")
+            f.write("\n".join(parts))
+            rows += len(chunk)
+    finally:
+        if f:
+            f.close()
+
+    return {"path": str(out), "files": files, "topics": rows, **images.stats}
+
+# =========================
+# ANKI PACKAGE
+# =========================
+
+# Anki 2.1 collection (schema 11), as read by its .apkg importer
+ANKI_SCHEMA = """
+CREATE TABLE col (id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null, usn integer not null,
+    ls integer not null, conf text not null, models text not null, decks text not null,
+    dconf text not null, tags text not null);
+CREATE TABLE notes (id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null, flds text not null,
+    sfld integer not null, csum integer not null, flags integer not null, data text not null);
+CREATE TABLE cards (id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null, type integer not null,
+    queue integer not null, due integer not null, ivl integer not null, factor integer not null,
+    reps integer not null, lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null);
+CREATE TABLE revlog (id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+ANKI_MODEL_ID = 1718230411      # fixed: re-imports update the same note type
+ANKI_DECK_ROOT = "NEET PG"
+ANKI_FIELDS = ["Topic", "Subject", "Trigger", "PYQ Years", "Bullets", "Images"]
+ANKI_CSS = ".card { font-family: sans-serif; font-size: 18px; text-align: left; } img { max-width: 100%; }"
+
+ANKI_DECK_CONF = {
+    "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "timer": 0,
+    "autoplay": True, "replayq": True,
+    "new": {"bury": True, "delays": [1, 10], "initialFactor": 2500, "ints": [1, 4, 7],
+            "order": 1, "perDay": 20, "separate": True},
+    "rev": {"bury": True, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1, "maxIvl": 36500,
+            "minSpace": 1, "perDay": 100},
+    "lapse": {"delays": [10], "leechAction": 0, "leechFails": 8, "minInt": 1, "mult": 0},
+}
+
+
+def anki_deck(deck_id: int, name: str, now: int) -> dict:
+    return {
+        "id": deck_id, "name": name, "desc": "", "mod": now, "usn": -1, "conf": 1, "dyn": 0,
+        "collapsed": False, "extendNew": 10, "extendRev": 50,
+        "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0], "timeToday": [0, 0],
+    }
+
+
+def anki_model(now: int) -> dict:
+    return {
+        "id": str(ANKI_MODEL_ID), "name": "NEET PG Topic", "type": 0, "mod": now, "usn": -1,
+        "sortf": 0, "did": 1, "tags": [], "vers": [], "css": ANKI_CSS,
+        "latexPre": "", "latexPost": "", "latexsvg": False,
+        "flds": [
+            {"name": name, "ord": i, "sticky": False, "rtl": False,
+             "font": "Arial", "size": 20, "media": []}
+            for i, name in enumerate(ANKI_FIELDS)
+        ],
+        "tmpls": [{
+            "name": "Recall", "ord": 0, "did": None, "bqfmt": "", "bafmt": "",
+            "qfmt": "<h2>{{Topic}}</h2><small>{{Subject}}</small>",
+            "afmt": "{{FrontSide}}<hr id=answer>{{#Trigger}}<p><b>🧠 {{Trigger}}</b></p>{{/Trigger}}"
+                    "{{#PYQ Years}}<p>📅 {{PYQ Years}}</p>{{/PYQ Years}}{{Bullets}}{{Images}}",
+        }],
+        "req": [[0, "any", [0]]],
+    }
+
+
+def anki_guid(topic_id: int) -> str:
+    # Stable per topic, so a re-export updates instead of duplicating
+    return hashlib.sha1(f"neetpg:{topic_id}".encode()).hexdigest()[:10]
+
+
+def anki_checksum(text: str) -> int:
+    # Anki: first 8 hex digits of the SHA-1 of the first field
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def write_anki(out: Path, subjects, chunk_size: int, with_media: bool) -> dict:
+    """
+    out (.apkg): collection.anki2 built on disk chunk by chunk, one
+    subdeck per subject, one note per topic; images as package media.
+    """
+    out.parent.mkdir(parents=True, exist_ok=True)
+    now = int(time.time())
+    next_id = int(time.time() * 1000)
+    images = MediaFolder(None, with_media)
+    decks = {"1": anki_deck(1, "Default", now)}
+    rows = 0
+
+    fd, db_path = tempfile.mkstemp(suffix=".anki2", dir=out.parent)
+    os.close(fd)
+    try:
+        db = sqlite3.connect(db_path)
+        db.executescript(ANKI_SCHEMA)
+
+        for subject, chunk in iter_deck(subjects, chunk_size):
+            name = f"{ANKI_DECK_ROOT}::{subject or 'Unassigned'}"
+            deck = next((d for d in decks.values() if d["name"] == name), None)
+            if deck is None:
+                deck = decks[str(next_id)] = anki_deck(next_id, name, now)
+                next_id += 1
+
+            notes, cards = [], []
+            for row in chunk.itertuples(index=False):
+                names = images.add(row.image_paths) + images.add(row.pyq_image_paths)
+                topic = html.escape(row.topic)
+                fields = [
+                    topic,
+                    html.escape(subject),
+                    html.escape(row.trigger_line),
+                    html.escape(row.pyq_years),
+                    "<br>".join(f"• {html.escape(b)}" for b in _bullets(row.bullets)),
+                    "".join(f'<img src="{html.escape(n)}">' for n in names),
+                ]
+                notes.append((
+                    next_id, anki_guid(int(row.id)), ANKI_MODEL_ID, now, -1, f" {safe_name(subject)} ",
+                    "\x1f".join(fields), topic, anki_checksum(topic), 0, "",
+                ))
+                cards.append((next_id + 1, next_id, deck["id"], 0, now, -1, 0, 0, rows + len(notes),
+                              0, 0, 0, 0, 0, 0, 0, 0, ""))
+                next_id += 2
+
+            db.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", notes)
+            db.executemany("INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", cards)
+            db.commit()
+            rows += len(chunk)
+
+        conf = {"activeDecks": [1], "curDeck": 1, "curModel": str(ANKI_MODEL_ID), "nextPos": rows + 1,
+                "newSpread": 0, "collapseTime": 1200, "timeLim": 0, "estTimes": True,
+                "dueCounts": True, "sortType": "noteFld", "sortBackwards": False, "addToCur": True}
+        db.execute(
+            "INSERT INTO col VALUES (1,?,?,?,11,0,0,0,?,?,?,?,?)",
+            (now, now * 1000, now * 1000, json.dumps(conf),
+             json.dumps({str(ANKI_MODEL_ID): anki_model(now)}), json.dumps(decks),
+             json.dumps({"1": ANKI_DECK_CONF}), json.dumps({}))
+        )
+        db.commit()
+        db.close()
+
+        # Images are already compressed: stored, streamed from disk
+        media_files = images.sources
+        tmp = out.with_name(out.name + ".part")
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as z:
+            z.write(db_path, "collection.anki2")
+            z.writestr("media", json.dumps({str(i): n for i, n in enumerate(media_files)}))
+            for i, path in enumerate(media_files.values()):
+                z.write(path, str(i), compress_type=zipfile.ZIP_STORED)
+                images.stats["images"] += 1
+                images.stats["image_bytes"] += path.stat().st_size
+        tmp.replace(out)
+    finally:
+        Path(db_path).unlink(missing_ok=True)
+
+    return {"path": str(out), "topics": rows, "subjects": len(decks) - 1, **images.stats}
+
+# =========================
+# EXPORT
+# =========================
+
+WRITERS = {"jsonl": write_jsonl, "markdown": write_markdown, "anki": write_anki}
+
+
+def default_out(fmt: str) -> Path:
+    return EXPORT_DIR / ("neet_pg.apkg" if fmt == "anki" else fmt)
+
+
+def export_deck(
+    fmt: str,
+    out: Path | None = None,
+    subjects: list[str] | None = None,
+    with_media: bool = True,
+    chunk_size: int = EXPORT_CHUNK
+) -> dict:
+    """
+    Stream the deck out as `fmt` (see EXPORT_FORMATS). Returns the
+    writer's counts plus throughput.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    data_layer.flush_pending()
+    start = time.perf_counter()
+    result = WRITERS[fmt](Path(out or default_out(fmt)), subjects, chunk_size, with_media)
+    seconds = time.perf_counter() - start
+
+    target = Path(result["path"])
+    written = (
+        sum(p.stat().st_size for p in target.rglob("*") if p.is_file()) if target.is_dir()
+        else target.stat().st_size
+    )
+    return {
+        "format": fmt,
+        **result,
+        "bytes": written,
+        "seconds": round(seconds, 2),
+        "topics_per_second": round(result["topics"] / seconds) if seconds else None,
+        "mb_per_second": round(written / 1e6 / seconds, 1) if seconds else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the deck as JSONL, Markdown or an Anki package")
+    parser.add_argument("format", choices=EXPORT_FORMATS)
+    parser.add_argument("--out", type=Path, help="directory (jsonl, markdown) or .apkg file")
+    parser.add_argument("--subject", action="append", help="only these subjects (repeatable)")
+    parser.add_argument("--no-media", action="store_true", help="leave images out")
+    parser.add_argument("--chunk", type=int, default=EXPORT_CHUNK, help="topics per chunk")
+    args = parser.parse_args()
+
+    print(json.dumps(
+        export_deck(args.format, args.out, args.subject, not args.no_media, args.chunk),
+        indent=1
+    ))
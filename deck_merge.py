@@ -0,0 +1,380 @@
+"""
+Module 19 — Deck Merge
+
+Responsibilities:
+- Merge a backup archive (e.g. a colleague's deck) into the current deck
+- Topic matching on topic + subject, exact or normalized
+- Conflict policies: keep newest, keep more revisions, keep both
+- One vectorized remap of id / card_id / topic_id and of the ids in
+  image names (pyq_<id>_*, <topic_id>_*)
+- Streaming: CSV members one at a time, card bodies in chunks, images
+  copied member by member; the archive is never held in memory
+
+Their review log stays out: it is their study history, not ours.
+The matched topic's counters travel with the row the policy keeps.
+
+Usage (see cli.py merge):
+    merge_backup("shared_deck.zip", policy="newest", match="normalized")
+"""
+
+import hashlib
+import shutil
+import zipfile
+from contextlib import ExitStack
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data_layer
+
+MERGE_POLICIES = ["newest", "revisions", "both"]
+MATCH_MODES = ["normalized", "exact"]
+
+BODY_CHUNK = 1000               # card bodies per append to the store
+COPY_BUFFER = 1 << 20
+
+# card_images/<pyq_>?<id>_<original name>, as written by media.ingest_uploads
+IMAGE_NAME = r"^(?P<prefix>pyq_)?(?P<id>\d+)_(?P<rest>.+)$"
+
+# =========================
+# READING THE ARCHIVE
+# =========================
+
+def read_archive_table(z: zipfile.ZipFile, table: str) -> pd.DataFrame:
+    """
+    One table of the archive: its partitions, or the legacy single
+    file of older backups. Extra columns (legacy bullets) are kept.
+    """
+    directory, columns, date_cols, normalize, _ = data_layer.TABLES[table]
+    legacy = (data_layer.PYQ_FILE if table == "pyqs" else data_layer.CARD_FILE).as_posix()
+    prefix = directory.as_posix() + "/"
+
+    names = [n for n in z.namelist() if n.startswith(prefix) and n.endswith(".csv")]
+    if not names and legacy in z.namelist():
+        names = [legacy]
+
+    parts = []
+    for name in names:
+        with z.open(name) as f:
+            parts.append(pd.read_csv(f))
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+
+    extra = df[[c for c in df.columns if c not in columns]]
+    df = normalize(data_layer.conform(df, columns, date_cols))
+    return pd.concat([df, extra], axis=1)
+
+
+def stream_bodies(z: zipfile.ZipFile, cards: pd.DataFrame):
+    """
+    (index, text) of each card, from its legacy bullets column or in
+    offset order from the archive's body store (one forward pass).
+    """
+    if "bullets" in cards.columns:
+        for i, text in cards["bullets"].fillna("").astype(str).items():
+            yield i, text
+        return
+
+    # Body segments of the archive, by the logical offset they start at
+    segments = sorted(
+        (base, name) for name in z.namelist()
+        if (base := data_layer.segment_base(name)) is not None
+    )
+    refs = cards[["body_offset", "body_length"]].dropna().astype("int64").sort_values("body_offset")
+    missing = cards.index.difference(refs.index)
+    for i in missing:
+        yield i, ""
+    if refs.empty or not segments:
+        for i in refs.index:
+            yield i, ""
+        return
+
+    with ExitStack() as stack:
+        members = {}
+        for i, offset, length in refs.itertuples():
+            segment = next(((b, n) for b, n in reversed(segments) if b <= offset), None)
+            if segment is None:
+                yield i, ""
+                continue
+            base, name = segment
+            if name not in members:
+                members[name] = stack.enter_context(z.open(name))
+            members[name].seek(offset - base)
+            yield i, members[name].read(length).decode("utf-8", errors="replace")
+
+# =========================
+# MATCHING
+# =========================
+
+def normalized(values: pd.Series) -> pd.Series:
+    # Case, punctuation and spacing ignored
+    return values.astype("string").fillna("").str.lower().str.replace(r"\W+", " ", regex=True).str.strip()
+
+
+def topic_keys(df: pd.DataFrame, match: str) -> pd.Series:
+    if match == "normalized":
+        return normalized(df["topic"]) + "\x1f" + normalized(df["subject"])
+    return df["topic"].astype("string").fillna("") + "\x1f" + df["subject"].astype("string").fillna("")
+
+
+def our_spelling(ours: pd.DataFrame, theirs: pd.DataFrame, match: str) -> pd.DataFrame:
+    """
+    Their topic / subject texts as we write them: a matched topic
+    keeps ours, a new topic takes our spelling of its subject.
+    """
+    theirs = theirs.astype({"topic": "string", "subject": "string"})
+    if match == "normalized":
+        spelling = pd.Series(ours["subject"].astype("string").to_numpy(), index=normalized(ours["subject"]))
+        spelling = spelling[~spelling.index.duplicated()]
+        theirs["subject"] = normalized(theirs["subject"]).map(spelling).fillna(theirs["subject"])
+    return theirs
+
+
+def _stamp(df: pd.DataFrame) -> np.ndarray:
+    # Last activity: last revision, else creation
+    return df["last_revised"].fillna(df["created_at"]).to_numpy(dtype="datetime64[ns]")
+
+
+def plan_topics(ours: pd.DataFrame, theirs: pd.DataFrame, policy: str, match: str) -> pd.DataFrame:
+    """
+    For each incoming topic: the id it gets here (target) and the
+    action — "add" (new topic), "replace" (their row wins a match)
+    or "skip" (our row wins).
+    """
+    our_ids = pd.Series(ours["id"].astype("int64").to_numpy(), index=topic_keys(ours, match))
+    our_ids = our_ids[~our_ids.index.duplicated()]
+
+    matched_id = topic_keys(theirs, match).map(our_ids)
+    if policy == "both":
+        matched_id[:] = np.nan
+    matched = matched_id.notna().to_numpy()
+
+    # Our row for every incoming one (NaN rows where unmatched)
+    our_rows = ours.set_index(ours["id"].astype("int64")).reindex(matched_id.fillna(-1).astype("int64"))
+    if policy == "newest":
+        wins = _stamp(theirs) > _stamp(our_rows)
+    elif policy == "revisions":
+        wins = theirs["revision_count"].to_numpy(dtype=float) > our_rows["revision_count"].to_numpy(dtype=float)
+    else:
+        wins = np.zeros(len(theirs), dtype=bool)
+
+    new_ids = data_layer.safe_next_id(ours["id"]) + np.cumsum(~matched) - 1
+    return pd.DataFrame({
+        "source_id": theirs["id"].astype("int64").to_numpy(),
+        "target_id": np.where(matched, matched_id.fillna(0).to_numpy(dtype="int64"), new_ids),
+        "action": np.select([~matched, wins], ["add", "replace"], "skip"),
+    }, index=theirs.index)
+
+# =========================
+# IMAGE REFERENCES
+# =========================
+
+def image_refs(paths: pd.Series, old_ids: pd.Series, new_ids: pd.Series, prefix: str) -> pd.DataFrame:
+    """
+    One row per image reference: the archive member and the name it
+    gets here. Names carrying the row's old id get the new one.
+    """
+    refs = paths.fillna("").astype(str).str.split(";").explode()
+    refs = refs[refs.str.strip() != ""]
+    if refs.empty:
+        return pd.DataFrame(columns=["row", "member", "target"])
+
+    member = refs.str.replace("\\", "/", regex=False).str.removeprefix("./")
+    name = member.str.rsplit("/", n=1).str[-1]
+    parts = name.str.extract(IMAGE_NAME)
+    owned = (
+        (parts["prefix"].fillna("") == prefix)
+        & (parts["id"] == old_ids.reindex(refs.index).astype(str))
+    )
+    renamed = prefix + new_ids.reindex(refs.index).astype(str) + "_" + parts["rest"]
+    target = name.where(~owned, renamed)
+
+    return pd.DataFrame({
+        "row": refs.index,
+        "member": member.to_numpy(),
+        "target": (data_layer.IMAGE_DIR.as_posix() + "/" + target).to_numpy(),
+    })
+
+
+def _digest(f) -> bytes:
+    h = hashlib.sha1()
+    for block in iter(lambda: f.read(COPY_BUFFER), b""):
+        h.update(block)
+    return h.digest()
+
+
+def _same_file(z: zipfile.ZipFile, member: str, path: Path) -> bool:
+    if z.getinfo(member).file_size != path.stat().st_size:
+        return False
+    with z.open(member) as theirs, open(path, "rb") as ours:
+        return _digest(theirs) == _digest(ours)
+
+
+def place_image(z: zipfile.ZipFile, member: str, target: str) -> tuple[str | None, str]:
+    """
+    Copy one archive image to target (streamed). An identical file
+    already there is reused; a different one keeps its name and the
+    copy gets a free one. Returns (path, "copied"/"reused"/"missing").
+    """
+    if member not in z.NameToInfo:
+        return None, "missing"
+
+    path = Path(target)
+    n = 0
+    while path.exists():
+        if _same_file(z, member, path):
+            return str(path), "reused"
+        n += 1
+        path = Path(target).with_name(f"{Path(target).stem}-{n}{Path(target).suffix}")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    with z.open(member) as src, open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER)
+    tmp.replace(path)
+    return str(path), "copied"
+
+
+def rewrite_paths(index: pd.Index, refs: pd.DataFrame, placed: dict) -> pd.Series:
+    # Joined ";" lists per row, references that could not be placed dropped
+    final = refs["member"].combine(refs["target"], lambda m, t: placed.get((m, t)))
+    kept = refs.assign(path=final).dropna(subset=["path"])
+    joined = kept.groupby("row", sort=False)["path"].agg(";".join)
+    return joined.reindex(index, fill_value="")
+
+# =========================
+# MERGE
+# =========================
+
+def merge_backup(
+    source,
+    policy: str = "newest",
+    match: str = "normalized",
+    dry_run: bool = False,
+    progress=None
+) -> dict:
+    """
+    Merge a backup zip (path or binary file) into the current deck.
+    progress(done, total) is called after each image. Returns counts.
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f"Unknown merge policy: {policy}")
+    if match not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode: {match}")
+
+    data_layer.flush_pending()
+
+    with zipfile.ZipFile(source) as z:
+        theirs = read_archive_table(z, "pyqs").dropna(subset=["id"]).drop_duplicates("id")
+        ours = data_layer.load_pyqs()
+        plan = plan_topics(ours, theirs, policy, match)
+
+        # Cards of their topics: ours where we have one, unless theirs won
+        our_cards = data_layer.load_cards()
+        our_card_ids = pd.Series(
+            our_cards["card_id"].astype("int64").to_numpy(),
+            index=our_cards["topic_id"].astype("int64").to_numpy()
+        )
+        our_card_ids = our_card_ids[~our_card_ids.index.duplicated()]
+
+        cards = read_archive_table(z, "cards").dropna(subset=["topic_id"])
+        cards = cards.drop_duplicates("topic_id", keep="last")
+        by_source = plan.set_index("source_id")
+        cards = cards[cards["topic_id"].astype("int64").isin(by_source.index)]
+        source_topic = cards["topic_id"].astype("int64")
+        target_topic = source_topic.map(by_source["target_id"])
+        action = source_topic.map(by_source["action"])
+        cards = cards[(action != "skip") | ~target_topic.isin(our_card_ids.index)]
+        source_topic, target_topic = source_topic[cards.index], target_topic[cards.index]
+
+        has_card = target_topic.isin(our_card_ids.index)
+        next_card_id = data_layer.safe_next_id(our_cards["card_id"])
+        card_ids = target_topic.map(our_card_ids).where(
+            has_card, next_card_id + (~has_card).cumsum() - 1
+        ).astype("int64")
+
+        rows = our_spelling(ours, theirs[plan["action"] != "skip"], match)
+        targets = plan.loc[rows.index, "target_id"]
+        replaced = plan.loc[rows.index, "action"] == "replace"
+        known = ours.set_index(ours["id"].astype("int64"))
+        rows.loc[replaced, ["topic", "subject"]] = known.loc[targets[replaced], ["topic", "subject"]].astype("string").to_numpy()
+
+        refs = pd.concat([
+            image_refs(rows["pyq_image_paths"], rows["id"].astype("int64"), targets, "pyq_")
+            .assign(table="pyqs"),
+            image_refs(cards["image_paths"], source_topic, target_topic, "")
+            .assign(table="cards"),
+        ], ignore_index=True)
+        pairs = refs[["member", "target"]].drop_duplicates()
+
+        report = {
+            "policy": policy,
+            "match": match,
+            "dry_run": dry_run,
+            "topics_in": len(theirs),
+            "added": int((plan["action"] == "add").sum()),
+            "replaced": int((plan["action"] == "replace").sum()),
+            "kept_ours": int((plan["action"] == "skip").sum()),
+            "cards_added": int((~has_card).sum()),
+            "cards_replaced": int(has_card.sum()),
+            "images": len(pairs),
+        }
+        if dry_run:
+            return report
+
+        # Images first: nothing references them until the tables are saved
+        placed, outcomes = {}, {"copied": 0, "reused": 0, "missing": 0}
+        for done, (member, target) in enumerate(pairs.itertuples(index=False), 1):
+            placed[(member, target)], outcome = place_image(z, member, target)
+            outcomes[outcome] += 1
+            if progress:
+                progress(done, len(pairs))
+        report.update({f"images_{k}": v for k, v in outcomes.items()})
+
+        # Card bodies: streamed from their store into ours in chunks.
+        # The store is not compacted until the rows using them are saved.
+        with data_layer.card_body_edit():
+            offsets = pd.Series(np.nan, index=cards.index)
+            lengths = pd.Series(np.nan, index=cards.index)
+            chunk = []
+            for item in stream_bodies(z, cards):
+                chunk.append(item)
+                if len(chunk) == BODY_CHUNK:
+                    _append_bodies(chunk, offsets, lengths)
+                    chunk = []
+            _append_bodies(chunk, offsets, lengths)
+
+            now = pd.Timestamp.now()
+            pyq_rows = rows.reindex(columns=data_layer.PYQ_COLUMNS).assign(
+                id=targets,
+                pyq_image_paths=rewrite_paths(rows.index, refs[refs["table"] == "pyqs"], placed),
+                created_at=rows["created_at"].fillna(now),
+                schema_version=data_layer.DATA_VERSION,
+            )
+            card_rows = cards.reindex(columns=data_layer.CARD_COLUMNS).assign(
+                card_id=card_ids,
+                topic_id=target_topic,
+                image_paths=rewrite_paths(cards.index, refs[refs["table"] == "cards"], placed),
+                body_offset=offsets,
+                body_length=lengths,
+                created_at=cards["created_at"].fillna(now),
+                schema_version=data_layer.DATA_VERSION,
+            )
+
+            # Only the merged rows: partitions merge them in by id
+            if not pyq_rows.empty:
+                data_layer.save_pyqs(pyq_rows.reset_index(drop=True))
+            if not card_rows.empty:
+                data_layer.save_cards(card_rows.reset_index(drop=True))
+                data_layer.compact_card_bodies()
+
+    return report
+
+
+def _append_bodies(chunk: list, offsets: pd.Series, lengths: pd.Series) -> None:
+    if not chunk:
+        return
+    index, texts = zip(*chunk)
+    refs = np.array(data_layer.append_card_bodies(list(texts)))
+    offsets[list(index)] = refs[:, 0]
+    lengths[list(index)] = refs[:, 1]
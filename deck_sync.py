@@ -0,0 +1,856 @@
+"""
+Module 22 — Deck Sync
+
+Responsibilities:
+- Two-way sync with another data directory (laptop <-> shared server)
+- Hash-tree summaries of pyqs, cards and the image store
+  (table -> partition -> bucket -> row), kept per partition file and
+  rebuilt only for files that changed
+- Only differing rows and missing images cross the wire
+- Deterministic three-way merge against the state of the last sync:
+  a side that did not touch a row takes the other side's copy,
+  revision / fail counters add up both sides' increments, content
+  edited on both sides keeps the peer's (server's) copy
+- Topics created on both sides under the same id: ours gets a new id
+
+The peer runs this module as `serve` over stdin / stdout (a JSON line
+per message, raw bytes after it for rows and images), either in a
+local directory or through any command that reaches it:
+
+    python deck_sync.py sync ../server_copy
+    python deck_sync.py sync --command "ssh srv 'cd /srv/neet && python deck_sync.py serve'"
+
+Each side keeps a row hash + counters snapshot per peer after every
+sync (sync/peers/); with one server in the middle that is the same
+information as a two-entry version vector per row. Images are only
+ever added: a name taken on both sides with different content keeps
+each side's own file. Review logs stay local, as in deck_merge.
+"""
+
+import argparse
+import io
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data_layer
+
+SYNC_DIR = data_layer.BASE_DIR / "sync"
+REPLICA_FILE = SYNC_DIR / "replica.json"
+PEER_DIR = SYNC_DIR / "peers"
+BODY_HASH_FILE = SYNC_DIR / "body_hashes.npz"
+
+SYNC_TABLES = ["images", "pyqs", "cards"]     # images first: rows never point at a missing file
+BUCKETS = 64                    # leaves per partition in the hash tree
+FETCH_CHUNK = 5000              # row keys per fetch request
+
+PYQ_CONTENT = ["topic", "subject", "pyq_years", "trigger_line", "pyq_image_paths"]
+PYQ_PROGRESS = ["revision_count", "fail_count", "last_revised", "next_revision_date"]
+CARD_CONTENT = ["card_title", "external_url", "image_paths"]
+CARD_SYNC_COLUMNS = ["topic_id"] + CARD_CONTENT + ["bullets"]
+
+SUMMARY_COLUMNS = ["key", "bucket", "hash", "content", "progress", "revision_count", "fail_count"]
+
+# table -> {partition: (stat key, summary frame)}
+_summaries: dict = {}
+_body_hashes = {"inode": None, "index": None, "hashes": None, "dirty": False}
+
+# =========================
+# ROW HASHES
+# =========================
+
+def _text(series: pd.Series) -> pd.Series:
+    return series.astype(object).where(series.notna(), "").astype(str)
+
+
+def _ints(series: pd.Series) -> np.ndarray:
+    return pd.to_numeric(series, errors="coerce").to_numpy(dtype="int64", na_value=-1)
+
+
+def _stamps(series: pd.Series) -> np.ndarray:
+    return np.asarray(series, dtype="datetime64[ns]").view("int64")
+
+
+def _hash(frame: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def _summary(keys, buckets, content, progress=None, counts=None) -> pd.DataFrame:
+    # Cards and images have no progress: the row hash is the content hash
+    if progress is None:
+        whole, progress = content, np.zeros(len(content), dtype="uint64")
+    else:
+        whole = _hash(pd.DataFrame({"content": content, "progress": progress}))
+    revisions, fails = counts if counts is not None else (np.zeros(len(content), dtype="int64"),) * 2
+    return pd.DataFrame({
+        "key": keys, "bucket": buckets, "hash": whole, "content": content, "progress": progress,
+        "revision_count": revisions, "fail_count": fails,
+    })
+
+
+def pyq_summary(df: pd.DataFrame) -> pd.DataFrame:
+    ids = _ints(df["id"])
+    content = _hash(pd.DataFrame({"id": ids, **{c: _text(df[c]).to_numpy() for c in PYQ_CONTENT}}))
+    counts = (_ints(df["revision_count"]), _ints(df["fail_count"]))
+    progress = _hash(pd.DataFrame({
+        "revision_count": counts[0], "fail_count": counts[1],
+        "last_revised": _stamps(df["last_revised"]),
+        "next_revision_date": _stamps(df["next_revision_date"]),
+    }))
+    out = _summary(ids, ids % BUCKETS, content, progress, counts)
+    return out[ids >= 0].reset_index(drop=True)
+
+
+def card_summary(df: pd.DataFrame, bodies: np.ndarray) -> pd.DataFrame:
+    # Keyed by topic: card ids are local to each deck
+    keys = _ints(df["topic_id"])
+    content = _hash(pd.DataFrame({
+        "topic_id": keys, **{c: _text(df[c]).to_numpy() for c in CARD_CONTENT}, "body": bodies,
+    }))
+    out = _summary(keys, keys % BUCKETS, content)
+    return out[keys >= 0].reset_index(drop=True)
+
+
+def image_summary() -> pd.DataFrame:
+    names, sizes = [], []
+    if data_layer.IMAGE_DIR.is_dir():
+        with os.scandir(data_layer.IMAGE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    names.append(entry.name)
+                    sizes.append(entry.stat().st_size)
+    keys = np.array(names, dtype=object)
+    content = _hash(pd.DataFrame({"name": keys, "size": np.array(sizes, dtype="int64")}))
+    return _summary(keys, pd.util.hash_array(keys) % BUCKETS, content)
+
+
+def body_hashes(cards: pd.DataFrame) -> np.ndarray:
+    """
+    Hash of each card's bullet text. Bodies at a given offset never
+    change until the store is compacted or restored (new store id),
+    so each one is read and hashed once; the table is kept in sync/.
+    """
+    cache = _body_hashes
+    inode = data_layer.card_body_store_id()
+    if cache["inode"] is None:
+        _load_body_hashes()
+    if cache["inode"] != inode:
+        cache.update(inode=inode, index=pd.Index([], dtype="int64"), hashes=np.array([], dtype="uint64"))
+
+    # (offset, length) packed into one int64; NA refs read as ""
+    offsets = cards["body_offset"].to_numpy(dtype="int64", na_value=-1)
+    lengths = cards["body_length"].to_numpy(dtype="int64", na_value=0)
+    refs = (offsets << 24) | lengths
+
+    pos = cache["index"].get_indexer(refs)
+    out = np.zeros(len(refs), dtype="uint64")
+    out[pos >= 0] = cache["hashes"][pos[pos >= 0]]
+
+    missing = np.flatnonzero(pos < 0)
+    if len(missing):
+        texts = data_layer.card_bodies(cards.iloc[missing]).to_numpy(dtype=object)
+        out[missing] = pd.util.hash_array(texts)
+        new = pd.Index(refs[missing]).drop_duplicates()
+        cache["index"] = cache["index"].append(new)
+        cache["hashes"] = np.concatenate([cache["hashes"], out[missing][~pd.Index(refs[missing]).duplicated()]])
+        cache["dirty"] = True
+    return out
+
+
+def _load_body_hashes() -> None:
+    try:
+        with np.load(BODY_HASH_FILE) as f:
+            _body_hashes.update(inode=int(f["inode"]), index=pd.Index(f["refs"]), hashes=f["hashes"])
+    except (OSError, ValueError, KeyError):
+        _body_hashes.update(inode=-1)
+
+
+def _save_body_hashes() -> None:
+    cache = _body_hashes
+    if not cache["dirty"]:
+        return
+    SYNC_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = BODY_HASH_FILE.with_name(BODY_HASH_FILE.name + ".tmp.npz")
+    np.savez(tmp, inode=np.array(cache["inode"]), refs=cache["index"].to_numpy(), hashes=cache["hashes"])
+    tmp.replace(BODY_HASH_FILE)
+    cache["dirty"] = False
+
+# =========================
+# SUMMARIES
+# =========================
+
+def _summary_file(table: str) -> Path:
+    return SYNC_DIR / f"{table}_summary.npz"
+
+
+def _sources(table: str) -> dict:
+    # partition -> stat key of the file its summary is built from
+    if table == "images":
+        key = data_layer._stat_key(data_layer.IMAGE_DIR)
+        return {"": key} if key else {}
+    data_layer.migrate_legacy_tables()
+    subjects = data_layer.load_manifest()["subjects"]
+    keys = {s: data_layer._stat_key(data_layer.partition_path(table, s)) for s in subjects}
+    return {s: k for s, k in keys.items() if k}
+
+
+def _summarize(table: str, part: str) -> pd.DataFrame:
+    if table == "images":
+        return image_summary()
+    df = data_layer.read_partition(table, part)
+    if table == "pyqs":
+        return pyq_summary(df)
+    return card_summary(df, body_hashes(df))
+
+
+def _load_summaries(table: str) -> dict:
+    cache = {}
+    try:
+        with np.load(_summary_file(table)) as f:
+            owner = f["owner"]
+            columns = {c: f[c] for c in SUMMARY_COLUMNS}
+            for i, part in enumerate(f["parts"].tolist()):
+                rows = owner == i
+                frame = pd.DataFrame({c: v[rows] for c, v in columns.items()})
+                if table == "images":
+                    frame["key"] = frame["key"].astype(object)
+                cache[part] = (tuple(f["stats"][i].tolist()), frame)
+    except (OSError, ValueError, KeyError):
+        pass
+    return cache
+
+
+def _save_summaries(table: str, cache: dict) -> None:
+    parts = list(cache)
+    frames = [cache[p][1] for p in parts]
+    rows = pd.concat(frames, ignore_index=True) if frames else _summary([], [], np.array([], dtype="uint64"))
+    SYNC_DIR.mkdir(parents=True, exist_ok=True)
+    path = _summary_file(table)
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez(
+        tmp,
+        parts=np.array(parts, dtype=str),
+        stats=np.array([cache[p][0] for p in parts], dtype="int64").reshape(-1, 2),
+        owner=np.repeat(np.arange(len(parts)), [len(f) for f in frames]).astype("int32"),
+        **{c: rows[c].to_numpy(dtype=str if table == "images" and c == "key" else None) for c in SUMMARY_COLUMNS}
+    )
+    tmp.replace(path)
+
+
+def summary(table: str) -> pd.DataFrame:
+    """
+    One row per pyq / card / image: key, bucket, hash and the pieces
+    the merge needs. Partitions whose file is unchanged since the last
+    call (in any process) are not read again.
+    """
+    if table not in _summaries:
+        _summaries[table] = _load_summaries(table)
+    cache = _summaries[table]
+    current = _sources(table)
+
+    stale = [p for p, key in current.items() if cache.get(p, (None,))[0] != key]
+    gone = [p for p in cache if p not in current]
+    for part in stale:
+        cache[part] = (current[part], _summarize(table, part))
+    for part in gone:
+        del cache[part]
+    if stale or gone:
+        _save_summaries(table, cache)
+        _save_body_hashes()
+
+    frames = [frame.assign(part=part) for part, (_, frame) in cache.items()]
+    if not frames:
+        return _summary([], [], np.array([], dtype="uint64")).assign(part="")
+    return pd.concat(frames, ignore_index=True)
+
+
+def _xor(values) -> int:
+    return int(np.bitwise_xor.reduce(np.asarray(values, dtype="uint64"))) if len(values) else 0
+
+
+def part_hashes(rows: pd.DataFrame) -> dict:
+    # Top of the tree; XOR is order-free and each row hash includes its key
+    return {part: _xor(h) for part, h in rows.groupby("part", sort=False)["hash"]}
+
+
+def bucket_hashes(rows: pd.DataFrame, parts: list) -> list:
+    rows = rows[rows["part"].isin(parts)]
+    return [[p, int(b), _xor(h)] for (p, b), h in rows.groupby(["part", "bucket"], sort=False)["hash"]]
+
+
+def bucket_rows(rows: pd.DataFrame, buckets: list) -> pd.DataFrame:
+    if not buckets:
+        return rows.iloc[:0]
+    wanted = pd.MultiIndex.from_tuples([tuple(b) for b in buckets])
+    return rows[pd.MultiIndex.from_arrays([rows["part"], rows["bucket"]]).isin(wanted)]
+
+# =========================
+# ROWS
+# =========================
+
+def table_rows(table: str, keys: list) -> pd.DataFrame:
+    # Full rows of these keys, reading only the partitions they live in
+    rows = summary(table)
+    parts = rows.loc[rows["key"].isin(keys), "part"].unique()
+    frames = [data_layer.read_partition(table, p) for p in parts]
+    key_col = "id" if table == "pyqs" else "topic_id"
+    columns = data_layer.PYQ_COLUMNS if table == "pyqs" else data_layer.CARD_COLUMNS
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    df = df[df[key_col].isin(keys)].reset_index(drop=True)
+    if table == "cards":
+        df["bullets"] = data_layer.card_bodies(df)
+    return df
+
+
+def encode_rows(df: pd.DataFrame) -> bytes:
+    return df.to_json(orient="records", date_format="iso", date_unit="ns").encode()
+
+
+def decode_rows(table: str, payload: bytes) -> pd.DataFrame:
+    df = pd.DataFrame()
+    if payload:
+        df = pd.read_json(io.BytesIO(payload), orient="records", dtype=False, convert_dates=False)
+    if table == "pyqs":
+        df = data_layer.conform(df, data_layer.PYQ_COLUMNS, data_layer.DATE_COLUMNS_PYQ)
+        return data_layer.normalize_pyqs(df)
+    df = data_layer.conform(df, CARD_SYNC_COLUMNS)
+    for col in CARD_CONTENT + ["bullets"]:
+        df[col] = df[col].fillna("").astype(str)
+    df["topic_id"] = pd.to_numeric(df["topic_id"], errors="coerce").astype("Int64")
+    return df
+
+
+def rows_summary(table: str, df: pd.DataFrame) -> pd.DataFrame:
+    if table == "pyqs":
+        return pyq_summary(df)
+    return card_summary(df, pd.util.hash_array(df["bullets"].to_numpy(dtype=object)))
+
+
+def apply_rows(table: str, df: pd.DataFrame, delete: list) -> None:
+    """Upsert df's rows and delete the given keys in this deck."""
+    if table == "pyqs":
+        subjects = data_layer.topic_subjects()
+        for subject in sorted({subjects[i] for i in delete if i in subjects}):
+            part = data_layer.load_pyqs(subject)
+            kept = part[~part["id"].isin(delete)]
+            kept.attrs = dict(part.attrs)
+            data_layer.save_pyqs(kept)
+        if len(df):
+            data_layer.save_pyqs(df)
+        return
+
+    with data_layer.card_body_edit():
+        if delete:
+            cards = data_layer.load_cards()
+            kept = cards[~cards["topic_id"].isin(delete)]
+            kept.attrs = dict(cards.attrs)
+            data_layer.save_cards(kept)
+        if len(df):
+            data_layer.upsert_cards(df.to_dict("records"))
+        elif delete:
+            data_layer.compact_card_bodies()
+
+
+def rename_topics(renamed: dict) -> None:
+    # Cards follow their topic to its new id
+    with data_layer.card_body_edit():
+        cards = data_layer.load_cards()
+        hit = cards["topic_id"].isin(list(renamed))
+        if hit.any():
+            cards.loc[hit, "topic_id"] = cards.loc[hit, "topic_id"].astype("int64").map(renamed).to_numpy()
+            data_layer.save_cards(cards)
+
+
+def image_path(name: str) -> Path:
+    if not name or Path(name).name != name or name.startswith("."):
+        raise ValueError(f"Bad image name: {name!r}")
+    return data_layer.IMAGE_DIR / name
+
+
+def store_image(name: str, data: bytes) -> bool:
+    # Never overwrites: a name taken here keeps our file
+    path = image_path(name)
+    if path.exists():
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+    return True
+
+# =========================
+# REPLICA STATE
+# =========================
+
+def replica_id() -> str:
+    if REPLICA_FILE.exists():
+        return json.loads(REPLICA_FILE.read_text())["replica"]
+    SYNC_DIR.mkdir(parents=True, exist_ok=True)
+    replica = uuid.uuid4().hex
+    REPLICA_FILE.write_text(json.dumps({"replica": replica}))
+    return replica
+
+
+def _base_file(peer: str) -> Path:
+    if not peer.isalnum():
+        raise ValueError(f"Bad replica id: {peer!r}")
+    return PEER_DIR / f"{peer}.npz"
+
+
+def load_base(peer: str) -> dict:
+    """Row summaries both decks agreed on at the last sync with peer."""
+    base = {}
+    try:
+        with np.load(_base_file(peer)) as f:
+            for table in ("pyqs", "cards"):
+                base[table] = pd.DataFrame({c: f[f"{table}_{c}"] for c in SUMMARY_COLUMNS}).set_index("key")
+    except (OSError, ValueError, KeyError):
+        pass
+    return base
+
+
+def save_base(peer: str) -> None:
+    PEER_DIR.mkdir(parents=True, exist_ok=True)
+    path = _base_file(peer)
+    tmp = path.with_name(path.name + ".tmp.npz")
+    arrays = {}
+    for table in ("pyqs", "cards"):
+        rows = summary(table)
+        arrays.update({f"{table}_{c}": rows[c].to_numpy() for c in SUMMARY_COLUMNS})
+    np.savez(tmp, **arrays)
+    tmp.replace(path)
+
+# =========================
+# WIRE FORMAT
+# =========================
+
+def write_message(stream, header: dict, payload: bytes = b"") -> int:
+    line = (json.dumps({**header, "bytes": len(payload)}, separators=(",", ":")) + "\n").encode()
+    stream.write(line)
+    stream.write(payload)
+    stream.flush()
+    return len(line) + len(payload)
+
+
+def read_message(stream) -> tuple[dict, bytes]:
+    line = stream.readline()
+    if not line:
+        raise EOFError
+    header = json.loads(line)
+    payload = stream.read(header.get("bytes", 0))
+    return header, payload
+
+# =========================
+# SERVER
+# =========================
+
+def _tops() -> dict:
+    return {table: part_hashes(summary(table)) for table in SYNC_TABLES}
+
+
+def _op_hello(msg, _payload, session):
+    data_layer.flush_pending()
+    session["peer"] = msg["replica"]
+    ids = summary("pyqs")["key"]
+    return {"replica": replica_id(), "max_id": int(ids.max()) if len(ids) else 0, "tables": _tops()}, b""
+
+
+def _op_tops(_msg, _payload, _session):
+    return {"tables": _tops()}, b""
+
+
+def _op_buckets(msg, _payload, _session):
+    return {"buckets": bucket_hashes(summary(msg["table"]), msg["parts"])}, b""
+
+
+def _op_hashes(msg, _payload, _session):
+    rows = bucket_rows(summary(msg["table"]), msg["buckets"])
+    return {"keys": rows["key"].tolist(), "hashes": rows["hash"].tolist()}, b""
+
+
+def _op_fetch(msg, _payload, _session):
+    df = table_rows(msg["table"], msg["keys"])
+    columns = data_layer.PYQ_COLUMNS if msg["table"] == "pyqs" else CARD_SYNC_COLUMNS
+    return {"rows": len(df)}, encode_rows(df[columns])
+
+
+def _op_apply(msg, payload, _session):
+    df = decode_rows(msg["table"], payload)
+    apply_rows(msg["table"], df, msg["delete"])
+    return {"rows": len(df), "deleted": len(msg["delete"])}, b""
+
+
+def _op_get_image(msg, _payload, _session):
+    path = image_path(msg["name"])
+    if not path.exists():
+        return {"missing": True}, b""
+    return {"name": msg["name"]}, path.read_bytes()
+
+
+def _op_put_image(msg, payload, _session):
+    return {"stored": store_image(msg["name"], payload)}, b""
+
+
+def _op_done(msg, _payload, session):
+    if msg.get("commit") and session.get("peer"):
+        save_base(session["peer"])
+    return {"tables": _tops()}, b""
+
+
+HANDLERS = {
+    "hello": _op_hello,
+    "tops": _op_tops,
+    "buckets": _op_buckets,
+    "hashes": _op_hashes,
+    "fetch": _op_fetch,
+    "apply": _op_apply,
+    "get_image": _op_get_image,
+    "put_image": _op_put_image,
+    "done": _op_done,
+}
+
+
+def serve(instream=None, outstream=None) -> None:
+    """Answer one sync session on stdin / stdout."""
+    instream = instream or sys.stdin.buffer
+    outstream = outstream or sys.stdout.buffer
+    # Anything printed by the data modules must not corrupt the stream
+    sys.stdout = sys.stderr
+    session = {}
+
+    while True:
+        try:
+            msg, payload = read_message(instream)
+        except EOFError:
+            return
+        try:
+            reply, data = HANDLERS[msg["op"]](msg, payload, session)
+        except Exception as e:
+            reply, data = {"error": f"{type(e).__name__}: {e}"}, b""
+        write_message(outstream, reply, data)
+        if msg["op"] == "done":
+            return
+
+# =========================
+# CLIENT
+# =========================
+
+class Peer:
+    """The other deck: a `serve` process spoken to over pipes."""
+
+    def __init__(self, command: list, cwd=None):
+        self.proc = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.stats = {"round_trips": 0, "bytes_sent": 0, "bytes_received": 0}
+
+    def call(self, op: str, payload: bytes = b"", **fields) -> tuple[dict, bytes]:
+        try:
+            self.stats["bytes_sent"] += write_message(self.proc.stdin, {"op": op, **fields}, payload)
+            reply, data = read_message(self.proc.stdout)
+        except (EOFError, BrokenPipeError):
+            raise ConnectionError(f"Sync peer exited during {op} (status {self.proc.poll()})") from None
+        self.stats["round_trips"] += 1
+        self.stats["bytes_received"] += len(data) + len(json.dumps(reply))
+        if "error" in reply:
+            raise ValueError(f"Sync peer failed on {op}: {reply['error']}")
+        return reply, data
+
+    def close(self) -> None:
+        self.proc.stdin.close()
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def diff_keys(peer: Peer, table: str, tops: dict) -> pd.DataFrame:
+    """
+    Walk both trees down to the rows that differ: partitions, then
+    buckets, then row hashes. Returns key, local, remote (hash or NA).
+    """
+    rows = summary(table)
+    ours, theirs = part_hashes(rows), tops[table]
+    parts = sorted(p for p in set(ours) | set(theirs) if ours.get(p) != theirs.get(p))
+    empty = pd.DataFrame({"key": [], "local": [], "remote": []})
+    if not parts:
+        return empty
+
+    reply, _ = peer.call("buckets", table=table, parts=parts)
+    mine = {(p, b): h for p, b, h in bucket_hashes(rows, parts)}
+    other = {(p, b): h for p, b, h in reply["buckets"]}
+    buckets = sorted(k for k in set(mine) | set(other) if mine.get(k) != other.get(k))
+    if not buckets:
+        return empty
+
+    reply, _ = peer.call("hashes", table=table, buckets=buckets)
+    local = bucket_rows(rows, buckets).set_index("key")["hash"].astype(object)
+    remote = pd.Series(reply["hashes"], index=reply["keys"], dtype=object)
+    both = pd.DataFrame({"local": local, "remote": remote})
+    both = both[both["local"].ne(both["remote"])]
+    return both.rename_axis("key").reset_index()
+
+
+def fetch_rows(peer: Peer, table: str, keys: list) -> pd.DataFrame:
+    frames = []
+    for start in range(0, len(keys), FETCH_CHUNK):
+        _, data = peer.call("fetch", table=table, keys=keys[start:start + FETCH_CHUNK])
+        frames.append(decode_rows(table, data))
+    return pd.concat(frames, ignore_index=True) if frames else decode_rows(table, b"")
+
+
+def _same_topic(a: dict, b: dict) -> bool:
+    return (
+        str(a["topic"]).strip().casefold() == str(b["topic"]).strip().casefold()
+        and str(a["subject"]) == str(b["subject"])
+    )
+
+
+def _stamp(value) -> pd.Timestamp:
+    return pd.Timestamp.min if pd.isna(value) else pd.Timestamp(value)
+
+
+def merge_progress(ours: dict, theirs: dict, base) -> dict:
+    """
+    Counters: base + both sides' increments (max without a base).
+    Dates: the side that revised last; on a tie the earlier due date.
+    """
+    if base is not None:
+        revisions = ours["revision_count"] + theirs["revision_count"] - int(base["revision_count"])
+        fails = ours["fail_count"] + theirs["fail_count"] - int(base["fail_count"])
+    else:
+        revisions = max(ours["revision_count"], theirs["revision_count"])
+        fails = max(ours["fail_count"], theirs["fail_count"])
+
+    latest = max(
+        (ours, theirs),
+        key=lambda r: (_stamp(r["last_revised"]), -_stamp(r["next_revision_date"]).value)
+    )
+    return {
+        "revision_count": max(0, int(revisions)),
+        "fail_count": max(0, int(fails)),
+        "last_revised": latest["last_revised"],
+        "next_revision_date": latest["next_revision_date"],
+    }
+
+
+def plan_rows(table: str, keys: list, ours: pd.DataFrame, theirs: pd.DataFrame, base: pd.DataFrame) -> dict:
+    """
+    Three-way decision per differing key. A side whose row still
+    matches the base lost no edit and takes the other side's row
+    (a deletion included); content edited on both sides keeps theirs.
+    """
+    key_col = "id" if table == "pyqs" else "topic_id"
+    ours_sum = rows_summary(table, ours).set_index("key")
+    theirs_sum = rows_summary(table, theirs).set_index("key")
+    ours_rows = ours.set_index(ours[key_col].astype("int64")).to_dict("index")
+    theirs_rows = theirs.set_index(theirs[key_col].astype("int64")).to_dict("index")
+    plan = {"pull": [], "push": [], "drop_local": [], "drop_remote": [], "collisions": [], "conflicts": 0}
+
+    # Column arrays: a row of the mixed uint64 / int64 frame would be float
+    base_pos = dict(zip(keys, base.index.get_indexer(keys)))
+    base_cols = {c: base[c].to_numpy() for c in base.columns}
+
+    for key in keys:
+        mine, other = ours_rows.get(key), theirs_rows.get(key)
+        pos = base_pos[key]
+        b = {c: v[pos] for c, v in base_cols.items()} if pos >= 0 else None
+
+        if mine is None and other is None:
+            continue
+        if other is None:
+            if b is not None and ours_sum.at[key, "hash"] == b["hash"]:
+                plan["drop_local"].append(key)
+            else:
+                plan["push"].append(mine)
+            continue
+        if mine is None:
+            if b is not None and theirs_sum.at[key, "hash"] == b["hash"]:
+                plan["drop_remote"].append(key)
+            else:
+                plan["pull"].append(other)
+            continue
+
+        if b is not None and ours_sum.at[key, "hash"] == b["hash"]:
+            plan["pull"].append(other)
+            continue
+        if b is not None and theirs_sum.at[key, "hash"] == b["hash"]:
+            plan["push"].append(mine)
+            continue
+
+        if table == "cards":
+            plan["conflicts"] += 1
+            plan["pull"].append(other)
+            continue
+        if b is None and not _same_topic(mine, other):
+            # Created on both sides since the last sync under one id
+            plan["collisions"].append(key)
+            continue
+
+        same_content = ours_sum.at[key, "content"] == theirs_sum.at[key, "content"]
+        if b is not None and ours_sum.at[key, "content"] == b["content"]:
+            merged = dict(other)
+        elif b is not None and theirs_sum.at[key, "content"] == b["content"]:
+            merged = dict(mine)
+        else:
+            plan["conflicts"] += not same_content
+            merged = dict(other)
+
+        if b is not None and ours_sum.at[key, "progress"] == b["progress"]:
+            merged.update({c: other[c] for c in PYQ_PROGRESS})
+        elif b is not None and theirs_sum.at[key, "progress"] == b["progress"]:
+            merged.update({c: mine[c] for c in PYQ_PROGRESS})
+        else:
+            merged.update(merge_progress(mine, other, b))
+        plan["pull"].append(merged)
+        plan["push"].append(merged)
+
+    return plan
+
+
+def _frame(table: str, records: list) -> pd.DataFrame:
+    if table == "pyqs":
+        df = data_layer.conform(pd.DataFrame(records), data_layer.PYQ_COLUMNS, data_layer.DATE_COLUMNS_PYQ)
+        return data_layer.normalize_pyqs(df)
+    return data_layer.conform(pd.DataFrame(records), CARD_SYNC_COLUMNS)
+
+
+def sync_rows(peer: Peer, table: str, tops: dict, base: dict, next_id: int, dry_run: bool) -> dict:
+    diff = diff_keys(peer, table, tops)
+    keys = [int(k) for k in diff["key"]]
+    report = {"differing": len(keys), "pulled": 0, "pushed": 0, "deleted_here": 0, "deleted_there": 0,
+              "conflicts": 0, "renamed": {}}
+    if not keys:
+        return report
+
+    ours = table_rows(table, keys)
+    theirs = fetch_rows(peer, table, keys)
+    empty = pd.DataFrame(columns=SUMMARY_COLUMNS).set_index("key")
+    plan = plan_rows(table, keys, ours, theirs, base.get(table, empty))
+
+    # Same id, different topics: theirs keeps the id, ours moves
+    if plan["collisions"]:
+        mine = ours.set_index(ours["id"].astype("int64"))
+        theirs_by_id = theirs.set_index(theirs["id"].astype("int64"))
+        for key in plan["collisions"]:
+            report["renamed"][key] = next_id
+            plan["pull"].append({**theirs_by_id.loc[key].to_dict(), "id": key})
+            plan["pull"].append({**mine.loc[key].to_dict(), "id": next_id})
+            plan["push"].append({**mine.loc[key].to_dict(), "id": next_id})
+            next_id += 1
+
+    pull, push = _frame(table, plan["pull"]), _frame(table, plan["push"])
+    report.update(
+        pulled=len(pull), pushed=len(push), conflicts=plan["conflicts"],
+        deleted_here=len(plan["drop_local"]), deleted_there=len(plan["drop_remote"])
+    )
+    if dry_run:
+        return report
+
+    columns = data_layer.PYQ_COLUMNS if table == "pyqs" else CARD_SYNC_COLUMNS
+    if len(push) or plan["drop_remote"]:
+        peer.call("apply", encode_rows(push[columns]), table=table, delete=plan["drop_remote"])
+    if len(pull) or plan["drop_local"]:
+        apply_rows(table, pull[columns], plan["drop_local"])
+    if report["renamed"]:
+        rename_topics(report["renamed"])
+    return report
+
+
+def sync_images(peer: Peer, tops: dict, dry_run: bool) -> dict:
+    diff = diff_keys(peer, "images", tops)
+    only_here = diff.loc[diff["remote"].isna(), "key"].tolist()
+    only_there = diff.loc[diff["local"].isna(), "key"].tolist()
+    report = {"pulled": len(only_there), "pushed": len(only_here),
+              "conflicts": int((diff["local"].notna() & diff["remote"].notna()).sum()), "bytes": 0}
+    if dry_run:
+        return report
+
+    for name in only_here:
+        data = image_path(name).read_bytes()
+        peer.call("put_image", data, name=name)
+        report["bytes"] += len(data)
+    for name in only_there:
+        reply, data = peer.call("get_image", name=name)
+        if not reply.get("missing"):
+            store_image(name, data)
+            report["bytes"] += len(data)
+    return report
+
+
+def peer_command(directory=None, command: str | None = None) -> tuple[list, Path | None]:
+    if command:
+        return shlex.split(command), None
+    directory = Path(directory).resolve()
+    if not directory.is_dir():
+        raise ValueError(f"No such directory: {directory}")
+    if directory == Path.cwd().resolve():
+        raise ValueError("Cannot sync a deck with itself")
+    return [sys.executable, str(Path(__file__).resolve()), "serve"], directory
+
+
+def sync(directory=None, command: str | None = None, dry_run: bool = False) -> dict:
+    """
+    Sync this deck with the one in `directory` (or behind `command`).
+    Both end up with the same pyqs and cards; images are exchanged
+    both ways. Returns per-table counts and transfer totals.
+    """
+    start = time.perf_counter()
+    data_layer.flush_pending()
+    argv, cwd = peer_command(directory, command)
+    me = replica_id()
+
+    with Peer(argv, cwd) as peer:
+        hello, _ = peer.call("hello", replica=me)
+        if hello["replica"] == me:
+            raise ValueError("Peer is a copy of this deck (same replica id); delete its sync/replica.json")
+        base = load_base(hello["replica"])
+        ids = summary("pyqs")["key"]
+        next_id = max(hello["max_id"], int(ids.max()) if len(ids) else 0) + 1
+
+        report = {"peer": hello["replica"], "first_sync": not base, "dry_run": dry_run}
+        report["images"] = sync_images(peer, hello["tables"], dry_run)
+        report["pyqs"] = sync_rows(peer, "pyqs", hello["tables"], base, next_id, dry_run)
+        # Topic writes above may have moved cards between partitions
+        tops, _ = peer.call("tops")
+        report["cards"] = sync_rows(peer, "cards", tops["tables"], base, next_id, dry_run)
+
+        done, _ = peer.call("done", commit=not dry_run)
+        if not dry_run:
+            save_base(hello["replica"])
+        tops = _tops()
+        report["converged"] = all(tops[t] == done["tables"][t] for t in ("pyqs", "cards"))
+        report.update(peer.stats)
+
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync this deck with another data directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("sync", help="two-way sync with a peer")
+    p.add_argument("directory", nargs="?", help="the other deck's directory")
+    p.add_argument("--command", dest="remote", help="command that runs `deck_sync.py serve` at the peer")
+    p.add_argument("--dry-run", action="store_true")
+    sub.add_parser("serve", help="answer a sync session on stdin / stdout")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve()
+    else:
+        if not args.directory and not args.remote:
+            parser.error("sync needs a directory or --command")
+        print(json.dumps(sync(args.directory, args.remote, args.dry_run), indent=1, default=str))
@@ -4,15 +4,18 @@ Module 4 — Exam Modes
 Responsibilities:
 - Rapid Review Mode
 - Image Sprint Mode (one item at a time)
+- Timed Mock Test (answers saved in one batch at the end)
 
 Read-only. No content creation.
 """
 
 import streamlit as st
 import time
-from datetime import date
 
 import data_layer
+import media
+import mock_exam
+import review_queue
 
 # =========================
 # SESSION STATE
@@ -32,59 +35,38 @@ def render_rapid_review():
 
     init_exam_state()
 
-    base_pyqs = data_layer.load_pyqs()
-    cards = data_layer.load_cards()
+    subjects = review_queue.get_session_subjects("rapid_subjects", require_card=False)
 
-    if base_pyqs.empty:
+    if not subjects:
         st.info("No PYQs available.")
         return
 
-    # ---- Column safety ----
-    for col in ["revision_count", "fail_count", "pyq_image_paths"]:
-        if col not in base_pyqs.columns:
-            base_pyqs[col] = "" if col == "pyq_image_paths" else 0
-
-    subjects = ["All"] + sorted(base_pyqs.subject.unique().tolist())
-    subject = st.selectbox("Subject", subjects)
-
-    pyqs = base_pyqs
-    if subject != "All":
-        pyqs = pyqs[pyqs.subject == subject]
+    subject = st.selectbox("Subject", ["All"] + subjects)
 
     # ---- Candidate selection ----
-    candidates = pyqs[
-        (pyqs["revision_count"] == 0)
-        | (pyqs["fail_count"] > 0)
-        | (data_layer.is_due(pyqs))
-    ]
+    queue = review_queue.get_session_queue("rapid_queue", subject, require_card=False)
+    row = queue.current()
 
-    if candidates.empty:
+    if row is None:
         st.info("No topics available for rapid review.")
         return
 
-    candidates = candidates.sort_values(
-        by=["fail_count", "revision_count"],
-        ascending=[False, True]
-    )
-
-    row = candidates.iloc[0]
-
     # =========================
     # HEADER
     # =========================
-    st.markdown(f"### {row.topic}")
-    st.caption(row.subject)
+    st.markdown(f"### {row['topic']}")
+    st.caption(row["subject"])
 
     # =========================
     # PYQ META (ALWAYS VISIBLE)
     # =========================
     st.markdown("---")
 
-    if isinstance(row.trigger_line, str) and row.trigger_line.strip():
-        st.markdown(f"**🧠 Trigger line:** {row.trigger_line}")
+    if isinstance(row["trigger_line"], str) and row["trigger_line"].strip():
+        st.markdown(f"**🧠 Trigger line:** {row['trigger_line']}")
 
-    if isinstance(row.pyq_years, str) and row.pyq_years.strip():
-        st.markdown(f"**📅 PYQ Years:** {row.pyq_years}")
+    if isinstance(row["pyq_years"], str) and row["pyq_years"].strip():
+        st.markdown(f"**📅 PYQ Years:** {row['pyq_years']}")
 
     st.markdown("---")
 
@@ -93,37 +75,26 @@ def render_rapid_review():
     # =========================
     # STUDY CARD (PRIMARY)
     # =========================
-    card_df = cards[cards.topic_id == row.id]
-
-    if not card_df.empty:
-        card = card_df.iloc[0]
-
-        if isinstance(card.image_paths, str) and card.image_paths.strip():
+    if row["has_card"]:
+        if row["image_paths"]:
             st.markdown("#### 🖼️ Study Card Images")
-            for p in card.image_paths.split(";"):
-                st.image(p)
+            for p in row["image_paths"]:
+                st.image(media.image_url(p))
             content_shown = True
 
-        if isinstance(card.bullets, str) and card.bullets.strip():
-            for line in card.bullets.splitlines():
+        bullets = data_layer.card_body(row)
+        if bullets.strip():
+            for line in bullets.splitlines():
                 st.write(line)
             content_shown = True
 
     # =========================
     # PYQ IMAGES (SECONDARY)
     # =========================
-    pyq_images = base_pyqs.loc[
-        base_pyqs.id == row.id, "pyq_image_paths"
-    ].values
-
-    if (
-        len(pyq_images) > 0
-        and isinstance(pyq_images[0], str)
-        and pyq_images[0].strip()
-    ):
+    if row["pyq_image_paths"]:
         st.markdown("#### 🖼️ PYQ Image")
-        for p in pyq_images[0].split(";"):
-            st.image(p)
+        for p in row["pyq_image_paths"]:
+            st.image(media.image_url(p))
         content_shown = True
 
     if not content_shown:
@@ -137,24 +108,16 @@ def render_rapid_review():
 
     with col1:
         if st.button("✅ Revised"):
-            base_pyqs.loc[base_pyqs.id == row.id, "revision_count"] += 1
-            base_pyqs.loc[base_pyqs.id == row.id, "fail_count"] = (
-                base_pyqs.loc[base_pyqs.id == row.id, "fail_count"].clip(lower=0)
-            )
-            base_pyqs.loc[base_pyqs.id == row.id, "last_revised"] = date.today()
-            base_pyqs.loc[
-                base_pyqs.id == row.id, "next_revision_date"
-            ] = data_layer.compute_next_revision(
-                base_pyqs.loc[base_pyqs.id == row.id, "revision_count"].values[0]
-            )
-            data_layer.save_pyqs(base_pyqs)
+            data_layer.record_answer(row, "revised", "rapid_review", queue.elapsed_ms())
+            queue.ack_write()
+            queue.advance()
             st.rerun()
 
     with col2:
         if st.button("❌ Weak"):
-            base_pyqs.loc[base_pyqs.id == row.id, "fail_count"] += 1
-            base_pyqs.loc[base_pyqs.id == row.id, "last_revised"] = date.today()
-            data_layer.save_pyqs(base_pyqs)
+            data_layer.record_answer(row, "weak", "rapid_review", queue.elapsed_ms())
+            queue.ack_write()
+            queue.advance()
             st.rerun()
 
 
@@ -167,21 +130,18 @@ def render_image_sprint():
 
     init_exam_state()
 
-    pyqs = data_layer.load_pyqs()
-    cards = data_layer.load_cards()
-
-    cards = cards[cards.image_paths.notna() & (cards.image_paths != "")]
-    if cards.empty:
+    subjects = data_layer.manifest_subjects("image_cards")
+    if not subjects:
         st.info("No study cards with images available.")
         return
 
-    subjects = sorted(
-        pyqs[pyqs.id.isin(cards.topic_id)].subject.unique().tolist()
-    )
     subject = st.selectbox("Subject (mandatory)", subjects)
 
-    topic_ids = pyqs[pyqs.subject == subject].id
-    cards = cards[cards.topic_id.isin(topic_ids)]
+    cards = data_layer.query(
+        subject,
+        has_images=True,
+        columns=["id", "topic", "image_paths"]
+    )
 
     if cards.empty:
         st.info("No image cards for this subject.")
@@ -200,28 +160,161 @@ def render_image_sprint():
         st.success("Sprint completed 🎉")
         return
 
-    card = cards.iloc[st.session_state.sprint_index]
-    topic = pyqs[pyqs.id == card.topic_id].topic.values[0]
+    card = data_layer.ReviewRecord.from_frame(cards, st.session_state.sprint_index)
+
+    st.markdown(f"### {card.topic}")
 
-    st.markdown(f"### {topic}")
+    # ---- time-on-card ----
+    shown = st.session_state.get("sprint_shown")
+    if not shown or shown[0] != card.id:
+        st.session_state.sprint_shown = (card.id, time.monotonic())
 
-    for p in card.image_paths.split(";"):
-        st.image(p)
+    for p in media.ready_paths(card.image_paths):
+        st.image(media.image_url(p))
 
     col1, col2 = st.columns(2)
 
     with col1:
         if st.button("Next ▶️"):
+            log_sprint_view(card.id, subject)
             st.session_state.sprint_index += 1
             st.rerun()
 
     with col2:
         if auto:
             time.sleep(delay)
+            log_sprint_view(card.id, subject)
             st.session_state.sprint_index += 1
             st.rerun()
 
 
+def log_sprint_view(topic_id: int, subject: str):
+    shown_at = st.session_state.sprint_shown[1]
+    data_layer.record_review_event(
+        topic_id, subject, "seen", "image_sprint",
+        int((time.monotonic() - shown_at) * 1000)
+    )
+
+
+# =========================
+# MOCK TEST MODE
+# =========================
+
+def render_mock_exam():
+    st.subheader("📝 Mock Test")
+
+    if "mock_paper" not in st.session_state:
+        render_mock_setup()
+    elif "mock_result" in st.session_state:
+        render_mock_result()
+    else:
+        render_mock_item()
+
+
+def render_mock_setup():
+    size = st.selectbox("Questions", mock_exam.PAPER_SIZES, index=len(mock_exam.PAPER_SIZES) - 1)
+    require_card = st.toggle("Only topics with study cards", value=False)
+    st.caption(
+        f"Time allowed: {size * mock_exam.SECONDS_PER_ITEM // 60} min. "
+        "Answers are saved together when the test ends."
+    )
+
+    if st.button("📝 Start Mock Test"):
+        paper = mock_exam.sample_paper(size, require_card=require_card)
+        if paper.empty:
+            st.info("No PYQs available.")
+            return
+        st.session_state.mock_paper = paper
+        st.session_state.mock_index = 0
+        st.session_state.mock_deadline = time.time() + len(paper) * mock_exam.SECONDS_PER_ITEM
+        st.session_state.mock_shown = time.monotonic()
+        st.rerun()
+
+
+def render_mock_item():
+    paper = st.session_state.mock_paper
+    i = st.session_state.mock_index
+    left = st.session_state.mock_deadline - time.time()
+
+    if left <= 0 or i >= len(paper):
+        finish_mock_exam()
+        st.rerun()
+
+    row = data_layer.ReviewRecord.from_frame(paper, i)
+
+    st.progress(i / len(paper), text=f"Question {i + 1} of {len(paper)}")
+    st.caption(f"⏱️ {int(left) // 60}:{int(left) % 60:02d} left")
+
+    st.markdown(f"### {row['topic']}")
+    st.caption(row["subject"])
+
+    with st.expander("Show answer"):
+        if isinstance(row["trigger_line"], str) and row["trigger_line"].strip():
+            st.markdown(f"**🧠 Trigger line:** {row['trigger_line']}")
+        if isinstance(row["pyq_years"], str) and row["pyq_years"].strip():
+            st.markdown(f"**📅 PYQ Years:** {row['pyq_years']}")
+
+        if row["card_id"] is not None:
+            for p in media.ready_paths(row["image_paths"]):
+                st.image(media.image_url(p))
+            for line in data_layer.card_body(row).splitlines():
+                st.write(line)
+
+        for p in media.ready_paths(row["pyq_image_paths"]):
+            st.image(media.image_url(p))
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        if st.button("✅ Revised"):
+            answer_mock_item(i, "revised")
+            st.rerun()
+
+    with col2:
+        if st.button("❌ Weak"):
+            answer_mock_item(i, "weak")
+            st.rerun()
+
+    with col3:
+        if st.button("⏹️ End Test"):
+            finish_mock_exam()
+            st.rerun()
+
+
+def answer_mock_item(i: int, outcome: str):
+    # Kept in the session; nothing is written until the test ends
+    paper = st.session_state.mock_paper
+    paper.at[i, "outcome"] = outcome
+    paper.at[i, "time_ms"] = int((time.monotonic() - st.session_state.mock_shown) * 1000)
+    st.session_state.mock_index = i + 1
+    st.session_state.mock_shown = time.monotonic()
+
+
+def finish_mock_exam():
+    paper = st.session_state.mock_paper
+    mock_exam.submit_paper(paper)
+    st.session_state.mock_result = mock_exam.score_paper(paper)
+
+
+def render_mock_result():
+    totals, table = st.session_state.mock_result
+
+    if totals["accuracy"] is None:
+        st.info("No questions answered.")
+    else:
+        st.success(
+            f"{totals['revised']} / {totals['answered']} revised ({totals['accuracy']}%), "
+            f"{totals['items'] - totals['answered']} not reached, "
+            f"{totals['seconds'] // 60} min {totals['seconds'] % 60} s"
+        )
+        st.dataframe(table, hide_index=True, use_container_width=True)
+
+    if st.button("🔁 New Mock Test"):
+        for key in ["mock_paper", "mock_result"]:
+            st.session_state.pop(key, None)
+        st.rerun()
+
+
 # =========================
 # MAIN ENTRY
 # =========================
@@ -237,5 +330,7 @@ def render_exam_modes():
         render_image_sprint()
     elif view == "rapid_review":
         render_rapid_review()
+    elif view == "mock_exam":
+        render_mock_exam()
     else:
         st.info("Select an exam tool to begin.")
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""
+Module 13 — Image GC
+
+Responsibilities:
+- Live reference set from card image_paths and PYQ pyq_image_paths
+- Orphaned files in card_images/ and references to missing files
+- Quarantine (or delete) of orphans after a grace period
+- Incremental background runs from a persisted reference index
+- Reclaimed bytes and backup-size savings
+
+Deleted cards and replaced uploads leave their files behind, and every
+backup zips them again. The reference index keeps the image paths of
+each partition file with its (mtime, size), so a run only re-reads
+partitions that changed and only re-lists card_images/ when the
+directory itself changed.
+
+Usage:
+    python image_gc.py [--grace-hours 24] [--delete] [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import pandas as pd
+
+import data_layer
+import media
+
+GC_INDEX_FILE = data_layer.BASE_DIR / "image_refs.json"
+QUARANTINE_DIR = data_layer.BASE_DIR / "image_quarantine"
+GC_INDEX_FORMAT = 1
+
+GC_GRACE_SECONDS = 24 * 3600        # an orphan must stay unreferenced this long
+QUARANTINE_SECONDS = 14 * 24 * 3600  # quarantined files are deleted after this
+GC_INTERVAL_SECONDS = 600
+GC_MODE = "quarantine"              # or "delete"
+
+# Image path column of each table
+REF_COLUMNS = {"cards": "image_paths", "pyqs": "pyq_image_paths"}
+
+_gc = {
+    "lock": threading.Lock(),
+    "index": None,
+    "report": None,
+    "thread": None,
+}
+
+# =========================
+# REFERENCE INDEX
+# =========================
+
+def _empty_index() -> dict:
+    return {
+        "format": GC_INDEX_FORMAT,
+        "partitions": {},       # "cards/<file>" -> {"stat": [mtime_ns, size], "paths": [...]}
+        "dir_mtime": None,
+        "files": {},            # path -> [size, mtime_ns]
+        "orphans": {},          # path -> [first_seen, size, mtime_ns]
+        "quarantine": {},       # quarantined name -> {"path", "at", "bytes"}
+        "totals": {"collected": 0, "reclaimed_bytes": 0, "backup_bytes_saved": 0},
+    }
+
+
+def load_index() -> dict:
+    if _gc["index"] is None:
+        try:
+            index = json.loads(GC_INDEX_FILE.read_text())
+            if index.get("format") != GC_INDEX_FORMAT:
+                index = _empty_index()
+        except (FileNotFoundError, ValueError):
+            index = _empty_index()
+        _gc["index"] = index
+    return _gc["index"]
+
+
+def _save_index(index: dict) -> None:
+    tmp = GC_INDEX_FILE.with_name(GC_INDEX_FILE.name + ".tmp")
+    tmp.write_text(json.dumps(index, separators=(",", ":")))
+    tmp.replace(GC_INDEX_FILE)
+
+
+def _norm(path: str) -> str:
+    return os.path.normpath(path)
+
+
+def refresh_references(index: dict) -> int:
+    """
+    Re-read the image path column of partitions whose file changed,
+    drop partitions that no longer exist. Returns partitions read.
+    """
+    data_layer.migrate_legacy_tables()
+    seen, read = set(), 0
+
+    for table, column in REF_COLUMNS.items():
+        directory = data_layer.TABLES[table][0]
+        if not directory.exists():
+            continue
+        for f in directory.glob("*.csv"):
+            key = f"{table}/{f.name}"
+            stat = f.stat()
+            seen.add(key)
+            entry = index["partitions"].get(key)
+            if entry and entry["stat"] == [stat.st_mtime_ns, stat.st_size]:
+                continue
+
+            values = pd.read_csv(f, usecols=[column], dtype=str, keep_default_na=False)[column]
+            paths = sorted({_norm(p) for v in values for p in media.split_paths(v)})
+            index["partitions"][key] = {"stat": [stat.st_mtime_ns, stat.st_size], "paths": paths}
+            read += 1
+
+    for key in set(index["partitions"]) - seen:
+        del index["partitions"][key]
+    return read
+
+
+def live_references(index: dict) -> set[str]:
+    return {p for entry in index["partitions"].values() for p in entry["paths"]}
+
+
+def refresh_files(index: dict) -> bool:
+    # card_images/ is listed again only when its mtime moved
+    directory = data_layer.IMAGE_DIR
+    mtime = directory.stat().st_mtime_ns if directory.exists() else None
+    if mtime == index["dir_mtime"]:
+        return False
+
+    files = {}
+    if directory.exists():
+        with os.scandir(directory) as it:
+            for e in it:
+                # Skip in-flight ingestion temp files (".name.tid.tmp")
+                if e.is_file() and not e.name.startswith("."):
+                    stat = e.stat()
+                    files[_norm(e.path)] = [stat.st_size, stat.st_mtime_ns]
+    index["files"] = files
+    index["dir_mtime"] = mtime
+    return True
+
+# =========================
+# COLLECTION
+# =========================
+
+def deflated_size(path: Path) -> int:
+    # What the file costs in a ZIP_DEFLATED backup
+    z = zlib.compressobj(6, zlib.DEFLATED, -15)
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            size += len(z.compress(block))
+    return size + len(z.flush())
+
+
+def _quarantine(path: str, now: float, index: dict) -> None:
+    QUARANTINE_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"{int(now)}_{Path(path).name}"
+    size = os.path.getsize(path)
+    shutil.move(path, QUARANTINE_DIR / name)
+    index["quarantine"][name] = {"path": path, "at": now, "bytes": size}
+
+
+def _restore_missing(missing: list[str], index: dict) -> list[str]:
+    # A reference came back (e.g. an undone edit): return its file
+    by_path = {q["path"]: name for name, q in index["quarantine"].items()}
+    restored = []
+    for path in missing:
+        name = by_path.get(path)
+        if name and (QUARANTINE_DIR / name).exists():
+            shutil.move(QUARANTINE_DIR / name, path)
+            del index["quarantine"][name]
+            restored.append(path)
+    return restored
+
+
+def _purge_quarantine(now: float, index: dict) -> int:
+    purged = 0
+    for name, q in list(index["quarantine"].items()):
+        if now - q["at"] >= QUARANTINE_SECONDS:
+            (QUARANTINE_DIR / name).unlink(missing_ok=True)
+            del index["quarantine"][name]
+            purged += 1
+    return purged
+
+
+def collect(
+    grace_seconds: float = GC_GRACE_SECONDS,
+    mode: str = GC_MODE,
+    dry_run: bool = False
+) -> dict:
+    """
+    One incremental GC pass. Orphans are collected once they have
+    been unreferenced (and unmodified) for grace_seconds; files still
+    being ingested are never touched. Returns the run report.
+    """
+    if mode not in ("quarantine", "delete"):
+        raise ValueError(f"Unknown GC mode: {mode}")
+
+    with _gc["lock"]:
+        start = time.perf_counter()
+        now = time.time()
+        index = load_index()
+
+        read = refresh_references(index)
+        rescanned = refresh_files(index)
+        live = live_references(index)
+        files = index["files"]
+
+        # No tables at all (fresh install, restore in progress):
+        # everything would look orphaned, so do nothing
+        if not index["partitions"]:
+            _gc["report"] = {"skipped": "no tables", "seconds": 0.0}
+            return _gc["report"]
+
+        restored = [] if dry_run else _restore_missing(
+            sorted(p for p in live if p not in files), index
+        )
+        if restored:
+            index["dir_mtime"] = None
+            refresh_files(index)
+            files = index["files"]
+
+        orphans = {}
+        for path, (size, mtime) in files.items():
+            if path in live or media.is_ingesting(path):
+                continue
+            first_seen, old_size, old_mtime = index["orphans"].get(path, [now, size, mtime])
+            if (old_size, old_mtime) != (size, mtime):
+                first_seen = now
+            orphans[path] = [first_seen, size, mtime]
+        index["orphans"] = orphans
+
+        due = [
+            p for p, (first_seen, _, mtime) in orphans.items()
+            if now - first_seen >= grace_seconds and now - mtime / 1e9 >= grace_seconds
+        ]
+
+        collected, reclaimed, saved = 0, 0, 0
+        for path in sorted(due):
+            try:
+                size = os.path.getsize(path)
+                backup_bytes = deflated_size(Path(path))
+                if not dry_run:
+                    if mode == "delete":
+                        os.remove(path)
+                    else:
+                        _quarantine(path, now, index)
+            except FileNotFoundError:
+                orphans.pop(path, None)
+                files.pop(path, None)
+                continue
+
+            if not dry_run:
+                del orphans[path]
+                files.pop(path, None)
+            collected += 1
+            reclaimed += size
+            saved += backup_bytes
+
+        purged = 0 if dry_run else _purge_quarantine(now, index)
+
+        # Paths outside card_images/ are not in `files`; check the disk
+        missing = sorted(
+            p for p in live
+            if p not in files and not media.is_ingesting(p) and not os.path.exists(p)
+        )
+
+        if not dry_run:
+            index["dir_mtime"] = (
+                data_layer.IMAGE_DIR.stat().st_mtime_ns if data_layer.IMAGE_DIR.exists() else None
+            )
+            totals = index["totals"]
+            totals["collected"] += collected
+            totals["reclaimed_bytes"] += reclaimed
+            totals["backup_bytes_saved"] += saved
+            _save_index(index)
+
+        report = {
+            "files": len(files),
+            "image_bytes": sum(size for size, _ in files.values()),
+            "referenced": len(live),
+            "orphans": len(orphans),
+            "orphan_bytes": sum(o[1] for o in orphans.values()),
+            "collected": collected,
+            "mode": "dry-run" if dry_run else mode,
+            "reclaimed_bytes": reclaimed,
+            "backup_bytes_saved": saved,
+            "missing": missing,
+            "restored": restored,
+            "quarantined": len(index["quarantine"]),
+            "purged": purged,
+            "partitions_read": read,
+            "rescanned": rescanned,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        _gc["report"] = report
+        return report
+
+# =========================
+# BACKGROUND
+# =========================
+
+def _collector_loop():
+    while True:
+        time.sleep(GC_INTERVAL_SECONDS)
+        try:
+            collect()
+        except (OSError, ValueError, KeyError):
+            # A partition or image replaced mid-run; retried next interval
+            _gc["index"] = None
+
+
+def ensure_collector():
+    thread = _gc["thread"]
+    if thread is None or not thread.is_alive():
+        thread = threading.Thread(target=_collector_loop, daemon=True, name="image-gc")
+        _gc["thread"] = thread
+        thread.start()
+
+
+def gc_status() -> dict:
+    """
+    Last run report (None before the first run) plus lifetime totals
+    and quarantine size, for the backup page.
+    """
+    with _gc["lock"]:
+        index = load_index()
+        return {
+            "last": _gc["report"],
+            "totals": dict(index["totals"]),
+            "quarantined": len(index["quarantine"]),
+            "quarantine_bytes": sum(q["bytes"] for q in index["quarantine"].values()),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect orphaned card images")
+    parser.add_argument("--grace-hours", type=float, default=GC_GRACE_SECONDS / 3600)
+    parser.add_argument("--delete", action="store_true", help="delete instead of quarantine")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    print(json.dumps(collect(
+        args.grace_hours * 3600,
+        "delete" if args.delete else "quarantine",
+        args.dry_run
+    ), indent=1))
@@ -0,0 +1,501 @@
+"""
+Module 17 — Load Test
+
+Responsibilities:
+- Synthetic decks of configurable size in a scratch directory
+- N concurrent headless sessions of App.py (Streamlit AppTest)
+- Replay of click traces: revision loops, rapid review, image sprints,
+  card edits, PYQ captures
+- Rerun latency percentiles, throughput, errors, lost updates as JSON
+
+Every session is its own AppTest, run from a thread of a worker
+process. Sessions of one process share data_layer's caches and write
+buffer as the sessions of one Streamlit server do. AppTest keeps its
+runtime in a process-wide global, so a process runs one rerun at a
+time (sessions queue for it much as they queue for the GIL); the
+queueing is part of the measured latency. One step = one rerun.
+
+--processes N > 1 models N app instances on the same BASE_DIR: each
+has its own write buffer, so lost updates are expected there.
+
+Lost updates are found from the review log: every "revised" event
+must show up as +1 on its topic's revision_count once the buffer is
+flushed. Events themselves are checked against the clicks made.
+
+Traces are lists of steps (JSON, see TRACES):
+    {"goto": [mode, view]}             set the view and rerun
+    {"click": label}                   click a button
+    {"choose": [label, ...]}           click one of them at random
+    {"input": [label, text]}           type into a text field ({session}, {n})
+    {"select": label}                  pick a random option
+    {"repeat": n, "steps": [...]}
+
+Usage:
+    python loadtest.py [--sessions 20] [--seconds 60] [--topics 5000]
+                       [--traces traces.json] [--out result.json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+APP_FILE = Path(__file__).resolve().parent / "App.py"
+
+SESSIONS = 20
+PROCESSES = 1           # one app instance
+RUN_SECONDS = 60
+DECK_TOPICS = 5000
+IMAGE_CARD_RATIO = 0.2
+RERUN_TIMEOUT = 60
+THINK_SECONDS = 0.0     # pause between steps of one session
+
+OUTCOME_LABELS = {"✅ Revised": "revised", "❌ Weak": "weak"}
+
+TRACES = [
+    {
+        "name": "revision",
+        "weight": 5,
+        "steps": [
+            {"goto": ["Study", "dashboard"]},
+            {"click": "▶️ Start Revision"},
+            {"repeat": 12, "steps": [{"choose": ["✅ Revised", "✅ Revised", "❌ Weak"]}]},
+        ],
+    },
+    {
+        "name": "rapid_review",
+        "weight": 2,
+        "steps": [
+            {"goto": ["Exam", "dashboard"]},
+            {"click": "⚡ Rapid Review"},
+            {"repeat": 10, "steps": [{"choose": ["✅ Revised", "❌ Weak"]}]},
+        ],
+    },
+    {
+        "name": "image_sprint",
+        "weight": 2,
+        "steps": [
+            {"goto": ["Exam", "dashboard"]},
+            {"click": "🖼️ Image Sprint"},
+            {"repeat": 8, "steps": [{"click": "Next ▶️"}]},
+        ],
+    },
+    {
+        "name": "card_edit",
+        "weight": 1,
+        "steps": [
+            {"goto": ["Build", "dashboard"]},
+            {"click": "🗂️ Create / Update Study Card"},
+            {"select": "Select Topic"},
+            {"click": "✏️ Edit Card"},
+            {"click": "💾 Save Study Card"},
+        ],
+    },
+    {
+        "name": "pyq_capture",
+        "weight": 1,
+        "steps": [
+            {"goto": ["Build", "dashboard"]},
+            {"click": "➕ Add PYQ"},
+            {"input": ["Topic", "Load topic {session}-{n}"]},
+            {"input": ["Trigger line (one-liner)", "Synthetic trigger line"]},
+            {"click": "Save PYQ"},
+            {"click": "🏠 Back to Dashboard"},
+        ],
+    },
+]
+
+# =========================
+# SYNTHETIC DECK
+# =========================
+
+SUBJECTS = [
+    "Medicine", "Surgery", "ObG", "Pediatrics", "Pathology", "Pharmacology",
+    "Microbiology", "PSM", "Anatomy", "Physiology", "Radiology", "Dermatology",
+]
+
+
+def build_deck(topics: int = DECK_TOPICS, image_ratio: float = IMAGE_CARD_RATIO, seed: int = 0) -> dict:
+    """
+    Write a deck of `topics` PYQs, each with a study card, into the
+    current directory (data_layer.BASE_DIR). A small pool of images is
+    shared by image_ratio of the cards.
+    """
+    import numpy as np
+    import pandas as pd
+    from PIL import Image
+
+    import data_layer
+
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now().normalize()
+
+    pyqs = pd.DataFrame({
+        "id": np.arange(1, topics + 1),
+        "topic": [f"Topic {i}" for i in range(1, topics + 1)],
+        "subject": rng.choice(SUBJECTS, topics),
+        "pyq_years": "2019, 2022",
+        "trigger_line": "Synthetic trigger line",
+        "pyq_image_paths": "",
+        "revision_count": rng.integers(0, 6, topics),
+        "fail_count": rng.integers(0, 3, topics),
+        "last_revised": now - pd.to_timedelta(rng.integers(1, 60, topics), unit="D"),
+        "next_revision_date": now + pd.to_timedelta(rng.integers(-10, 30, topics), unit="D"),
+        "created_at": now,
+        "schema_version": data_layer.DATA_VERSION,
+    })
+    data_layer.save_pyqs(pyqs.reindex(columns=data_layer.PYQ_COLUMNS))
+
+    data_layer.IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    pool = []
+    for i in range(8):
+        path = data_layer.IMAGE_DIR / f"loadtest_{i}.png"
+        Image.new("RGB", (64, 64), (30 * i, 90, 160)).save(path)
+        pool.append(str(path))
+
+    with_images = rng.random(topics) < image_ratio
+    data_layer.upsert_cards([
+        {
+            "topic_id": int(topic_id),
+            "card_title": f"Topic {topic_id}",
+            "bullets": "• First point\n• Second point\n• Third point",
+            "image_paths": pool[topic_id % len(pool)] if images else "",
+            "external_url": "",
+        }
+        for topic_id, images in zip(pyqs["id"], with_images)
+    ])
+    return {"topics": topics, "image_cards": int(with_images.sum())}
+
+# =========================
+# SESSIONS
+# =========================
+
+class Session:
+    """
+    One simulated student: an AppTest replaying traces until the
+    deadline. Latencies and counters are per session, merged later.
+    """
+
+    def __init__(self, number: int, traces: list[dict], seed: int, lock: threading.Lock):
+        from streamlit.testing.v1 import AppTest
+
+        self.number = number
+        self.lock = lock
+        self.traces = traces
+        self.rng = random.Random(seed)
+        self.app = AppTest.from_file(str(APP_FILE), default_timeout=RERUN_TIMEOUT)
+        self.latencies: list[tuple[str, float]] = []
+        self.errors: list[str] = []
+        self.missing = 0        # steps whose widget was not on screen
+        self.outcomes = {"revised": 0, "weak": 0}
+        self.sprint_views = 0
+        self.inputs = 0
+        self.think = THINK_SECONDS
+
+    def rerun(self, trace: str, action) -> bool:
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                action()
+                self.app.run()
+        except Exception as e:      # a timeout or a script error the runner re-raised
+            self.errors.append(f"{trace}: {type(e).__name__}: {e}"[:300])
+            return False
+        self.latencies.append((trace, time.perf_counter() - start))
+
+        if self.app.exception:
+            self.errors.extend(f"{trace}: {e.value}"[:300] for e in self.app.exception)
+            return False
+        return True
+
+    def button(self, label: str):
+        for b in self.app.button:
+            if b.label == label and not b.disabled:
+                return b
+        return None
+
+    def step(self, trace: str, step: dict) -> None:
+        if "repeat" in step:
+            for _ in range(step["repeat"]):
+                for inner in step["steps"]:
+                    self.step(trace, inner)
+            return
+
+        if "goto" in step:
+            mode, view = step["goto"]
+
+            def goto():
+                self.app.session_state["app_mode"] = mode
+                self.app.session_state["current_view"] = view
+            self.rerun(trace, goto)
+
+        elif "click" in step or "choose" in step:
+            label = step.get("click") or self.rng.choice(step["choose"])
+            widget = self.button(label)
+            if widget is None:
+                self.missing += 1
+                return
+            if self.rerun(trace, widget.click):
+                if label in OUTCOME_LABELS:
+                    self.outcomes[OUTCOME_LABELS[label]] += 1
+                elif label == "Next ▶️":
+                    self.sprint_views += 1
+
+        elif "input" in step:
+            label, text = step["input"]
+            fields = [w for w in list(self.app.text_input) + list(self.app.text_area) if w.label == label]
+            if not fields:
+                self.missing += 1
+                return
+            self.inputs += 1
+            # Typing does not rerun inside a form; the submit click does
+            fields[0].input(text.format(session=self.number, n=self.inputs))
+
+        elif "select" in step:
+            boxes = [s for s in self.app.selectbox if s.label == step["select"]]
+            if not boxes or not boxes[0].options:
+                self.missing += 1
+                return
+            self.rerun(trace, lambda: boxes[0].select(self.rng.choice(boxes[0].options)))
+
+    def run(self, deadline: float) -> None:
+        weights = [t.get("weight", 1) for t in self.traces]
+        while time.time() < deadline:
+            trace = self.rng.choices(self.traces, weights)[0]
+            for step in trace["steps"]:
+                if time.time() >= deadline:
+                    break
+                self.step(trace["name"], step)
+                if self.think:
+                    time.sleep(self.think)
+
+    def result(self) -> dict:
+        return {
+            "latencies": self.latencies,
+            "errors": self.errors,
+            "missing": self.missing,
+            "outcomes": self.outcomes,
+            "sprint_views": self.sprint_views,
+        }
+
+
+def run_worker(work_dir: str, numbers: list[int], traces: list[dict], seed: int,
+               think: float, seconds: float, barrier, results) -> None:
+    """
+    Worker process: open its sessions (first render untimed), wait
+    for every worker, replay traces for `seconds`, flush, report.
+    """
+    os.chdir(work_dir)
+    import data_layer
+
+    lock = threading.Lock()
+    sessions = [Session(n, traces, seed + n, lock) for n in numbers]
+    for s in sessions:
+        s.think = think
+        s.rerun("start", lambda: None)
+
+    barrier.wait()
+    deadline = time.time() + seconds
+    threads = [threading.Thread(target=s.run, args=(deadline,)) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Outcomes still buffered in this process count as written
+    data_layer.flush_pending()
+    results.put([s.result() for s in sessions])
+
+# =========================
+# CONSISTENCY
+# =========================
+
+def revision_counts() -> dict:
+    import data_layer
+    pyqs = data_layer.read_pyqs()
+    return dict(zip(pyqs["id"].astype(int), pyqs["revision_count"].fillna(0).astype(int)))
+
+
+def review_log_rows() -> int:
+    import data_layer
+    return len(data_layer.load_review_log())
+
+
+def check_updates(before: dict, log_start: int, sessions: list[dict]) -> dict:
+    """
+    Compare what the sessions did with what reached disk. A "revised"
+    event whose +1 is missing from revision_count is a lost update.
+    """
+    import data_layer
+
+    data_layer.flush_pending()
+    after = revision_counts()
+    events = data_layer.load_review_log().iloc[log_start:]
+
+    revised = events[events["outcome"] == "revised"]
+    expected = revised.groupby(revised["topic_id"].astype(int)).size()
+
+    lost, extra = 0, 0
+    for topic_id, n in expected.items():
+        delta = after.get(topic_id, 0) - before.get(topic_id, 0)
+        lost += max(n - delta, 0)
+        extra += max(delta - n, 0)
+
+    outcome_clicks = sum(sum(s["outcomes"].values()) for s in sessions)
+    clicks = outcome_clicks + sum(s["sprint_views"] for s in sessions)
+    return {
+        "outcome_clicks": outcome_clicks,
+        "revised_clicks": sum(s["outcomes"]["revised"] for s in sessions),
+        "events_logged": len(events),
+        "lost_events": max(clicks - len(events), 0),
+        "lost_updates": int(lost),
+        "unexpected_updates": int(extra),
+        "topics_revised": len(expected),
+    }
+
+# =========================
+# REPORT
+# =========================
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(int(p * len(values)), len(values) - 1)] * 1000, 1)
+
+    return {
+        "count": len(values),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+def build_info() -> dict:
+    info = {"python": sys.version.split()[0]}
+    try:
+        import streamlit
+        info["streamlit"] = streamlit.__version__
+    except ImportError:
+        pass
+    try:
+        info["commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=APP_FILE.parent, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except OSError:
+        info["commit"] = None
+    return info
+
+
+def run_load_test(
+    sessions: int = SESSIONS,
+    seconds: float = RUN_SECONDS,
+    traces: list[dict] | None = None,
+    processes: int = PROCESSES,
+    think: float = THINK_SECONDS,
+    seed: int = 0
+) -> dict:
+    """
+    Replay traces from `sessions` sessions spread over `processes`
+    workers for `seconds` against the deck in the current directory.
+    Returns the report.
+    """
+    traces = traces or TRACES
+    processes = max(1, min(processes, sessions))
+    before, log_start = revision_counts(), review_log_rows()
+
+    # spawn: no inherited Streamlit / writer threads in the workers
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(processes + 1)
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(
+            target=run_worker,
+            args=(os.getcwd(), list(range(sessions))[p::processes], traces, seed,
+                  think, seconds, barrier, results),
+        )
+        for p in range(processes)
+    ]
+    for w in workers:
+        w.start()
+
+    barrier.wait()
+    start = time.monotonic()
+    runs = [s for _ in workers for s in results.get()]
+    elapsed = time.monotonic() - start
+    for w in workers:
+        w.join()
+
+    # The first render of each session is warm-up, outside the window
+    latencies = [l for s in runs for l in s["latencies"] if l[0] != "start"]
+    warmup = [l for s in runs for _, l in s["latencies"] if _ == "start"]
+    errors = [e for s in runs for e in s["errors"]]
+    by_trace = {}
+    for name, latency in latencies:
+        by_trace.setdefault(name, []).append(latency)
+
+    return {
+        "sessions": sessions,
+        "processes": processes,
+        "seconds": round(elapsed, 1),
+        "reruns": len(latencies),
+        "reruns_per_second": round(len(latencies) / elapsed, 2),
+        "latency": percentiles([l for _, l in latencies]),
+        "first_render": percentiles(warmup),
+        "by_trace": {name: percentiles(v) for name, v in sorted(by_trace.items())},
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:10],
+        "missing_widgets": sum(s["missing"] for s in runs),
+        "consistency": check_updates(before, log_start, runs),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive App.py with concurrent simulated sessions")
+    parser.add_argument("--sessions", type=int, default=SESSIONS)
+    parser.add_argument("--processes", type=int, default=PROCESSES, help="app instances (worker processes)")
+    parser.add_argument("--seconds", type=float, default=RUN_SECONDS)
+    parser.add_argument("--topics", type=int, default=DECK_TOPICS, help="synthetic deck size")
+    parser.add_argument("--image-ratio", type=float, default=IMAGE_CARD_RATIO)
+    parser.add_argument("--traces", type=Path, help="JSON list of traces (default: built-in)")
+    parser.add_argument("--work-dir", type=Path, help="deck directory (default: a new temp dir)")
+    parser.add_argument("--keep-deck", action="store_true", help="reuse the deck in --work-dir")
+    parser.add_argument("--think", type=float, default=THINK_SECONDS, help="seconds between steps")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="also write the report here")
+    args = parser.parse_args()
+
+    traces = json.loads(args.traces.read_text()) if args.traces else TRACES
+    out = args.out.resolve() if args.out else None
+    work_dir = (args.work_dir or Path(tempfile.mkdtemp(prefix="neetpg_load_"))).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    # data_layer paths are relative to the working directory
+    os.chdir(work_dir)
+    os.environ.setdefault("METRICS_PORT", "0")
+
+    build_start = time.perf_counter()
+    deck = {"reused": True} if args.keep_deck else build_deck(args.topics, args.image_ratio, args.seed)
+    deck["build_seconds"] = round(time.perf_counter() - build_start, 2)
+
+    report = {
+        "build": build_info(),
+        "deck": {**deck, "dir": str(work_dir)},
+        "traces": [t["name"] for t in traces],
+        **run_load_test(args.sessions, args.seconds, traces, args.processes, args.think, args.seed),
+    }
+    text = json.dumps(report, indent=1, default=str)
+    if out:
+        out.write_text(text + "\n")
+    print(text)
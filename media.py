@@ -0,0 +1,415 @@
+"""
+Module 8 — Media
+
+Responsibilities:
+- Content hashes for stored images
+- Perceptual hashes (pHash) for near-duplicate detection
+- Downscaled, content-addressed image derivatives
+- Stable, cacheable URLs for images shown in the app
+- Background ingestion of uploads (orientation, EXIF strip, resize)
+
+Derivatives are cached on disk and never modify the originals.
+
+Displayed images are published under static/media/ (Streamlit static
+serving, /app/static/media/...) with content-hash names, so a URL never
+changes meaning and st.image receives a URL instead of a file to read.
+Unlike the other image files this directory is not under
+data_layer.BASE_DIR: Streamlit only serves the static/ folder next to
+the main script, so STATIC_MEDIA_DIR follows App.py wherever the data
+lives. It holds links to derivatives only and can be deleted freely.
+Streamlit's static route only sends ETag / Last-Modified; set
+MEDIA_BASE_URL to serve static/media/ from a proxy or CDN with
+"Cache-Control: public, max-age=31536000, immutable".
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import data_layer
+import metrics
+
+DERIVED_DIR = data_layer.BASE_DIR / "image_cache"
+
+# Streamlit serves static/ next to the main script, not under BASE_DIR
+STATIC_MEDIA_DIR = Path(__file__).resolve().parent / "static" / "media"
+STATIC_MEDIA_URL = "/app/static/media"
+MEDIA_BASE_URL = os.environ.get("MEDIA_BASE_URL", "").rstrip("/")
+DISPLAY_IMAGE_PX = 1600
+
+# Uploads are stored at most this large; phone photos shrink ~10-20x
+INGEST_MAX_PX = 2048
+INGEST_QUALITY = 85
+INGEST_WORKERS = 4
+
+# (path, mtime_ns, size) -> (published URL, bytes): repeat views never open the file
+_url_memo: dict = {}
+
+# (path, mtime_ns, size) -> sha256 hex, so unchanged files are hashed once
+_hash_memo: dict = {}
+
+# path -> (mtime_ns, size, phash), persisted so restarts do not rehash
+PHASH_FILE = data_layer.BASE_DIR / "image_phash.json"
+PHASH_SIZE = 32     # DCT input side; the top-left 8x8 block gives 64 bits
+_phash = {"lock": threading.Lock(), "table": None, "version": 0}
+
+# =========================
+# HASHING
+# =========================
+
+def content_hash(path: str | Path) -> str:
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+
+    if key not in _hash_memo:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _hash_memo[key] = h.hexdigest()
+
+    return _hash_memo[key]
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def phash_image(img: Image.Image) -> int:
+    """
+    64-bit DCT perceptual hash. Low frequencies survive re-saving,
+    JPEG quality changes and light crops, so copies of the same image
+    land a few bits apart while byte hashes differ completely.
+    """
+    small = img.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = np.asarray(small, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:8, :8].ravel()
+    # The DC term is the mean brightness; it would skew the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def compute_phash(source) -> int | None:
+    # source: a path or raw bytes. Top-level so process pools can call it.
+    try:
+        with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as img:
+            img.draft("L", (PHASH_SIZE * 8, PHASH_SIZE * 8))
+            return phash_image(ImageOps.exif_transpose(img))
+    except OSError:
+        return None
+
+
+def _phash_table() -> dict:
+    # Callers hold _phash["lock"]
+    if _phash["table"] is None:
+        try:
+            raw = json.loads(PHASH_FILE.read_text())
+        except (FileNotFoundError, ValueError):
+            raw = {}
+        _phash["table"] = {p: (m, s, int(h, 16)) for p, (m, s, h) in raw.items()}
+    return _phash["table"]
+
+
+def cached_phash(path: str | Path) -> int | None:
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+
+    with _phash["lock"]:
+        entry = _phash_table().get(str(path))
+    if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+        return entry[2]
+    return None
+
+
+def remember_phash(path: str | Path, value: int, persist: bool = True) -> None:
+    stat = Path(path).stat()
+    with _phash["lock"]:
+        _phash_table()[str(path)] = (stat.st_mtime_ns, stat.st_size, value)
+        _phash["version"] += 1
+    if persist:
+        save_phashes()
+
+
+def save_phashes() -> None:
+    with _phash["lock"]:
+        data = {p: [m, s, f"{h:016x}"] for p, (m, s, h) in _phash_table().items()}
+        tmp = PHASH_FILE.with_name(PHASH_FILE.name + ".tmp")
+        tmp.write_text(json.dumps(data, separators=(",", ":")))
+        tmp.replace(PHASH_FILE)
+
+
+def perceptual_hash(path: str | Path) -> int | None:
+    # None for missing or unreadable files
+    value = cached_phash(path)
+    if value is None and Path(path).exists():
+        value = compute_phash(Path(path))
+        if value is not None:
+            remember_phash(path, value)
+    return value
+
+
+def phash_version() -> int:
+    # Bumps whenever a hash is recorded; lets indexes notice new images
+    return _phash["version"]
+
+
+def split_paths(value) -> list[str]:
+    if not isinstance(value, str) or not value.strip():
+        return []
+    return [p for p in value.split(";") if p.strip()]
+
+
+def ready_paths(value) -> list[str]:
+    # Stored images that exist now (uploads still being ingested do not)
+    return [p for p in split_paths(value) if Path(p).exists()]
+
+# =========================
+# DERIVATIVES
+# =========================
+
+def derivative(path: str | Path, max_px: int = 1024, fmt: str = "JPEG") -> Path | None:
+    """
+    Downscaled copy of an image, named by the source content hash.
+    Returns None if the source is missing or not a readable image.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+
+    ext = "jpg" if fmt == "JPEG" else fmt.lower()
+    out = DERIVED_DIR / f"{content_hash(path)[:16]}_{max_px}.{ext}"
+
+    if out.exists():
+        return out
+
+    DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+
+    try:
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_px, max_px))
+            if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+            # Write-then-rename so parallel workers never read a partial file
+            tmp = out.with_suffix(f".{os.getpid()}.tmp")
+            img.save(tmp, fmt, quality=80, optimize=True)
+            tmp.replace(out)
+    except OSError:
+        return None
+
+    return out
+
+# =========================
+# SERVING
+# =========================
+
+def static_serving_enabled() -> bool:
+    from streamlit import config
+    return bool(config.get_option("server.enableStaticServing"))
+
+
+def publish(path: str | Path) -> Path | None:
+    """
+    Display derivative linked into STATIC_MEDIA_DIR under its
+    content-hash name. Derivatives are never rewritten in place,
+    so a hard link is safe; copy where links are unsupported.
+    """
+    src = Path(path)
+    fmt = "PNG" if src.suffix.lower() == ".png" else "JPEG"
+    derived = derivative(src, DISPLAY_IMAGE_PX, fmt)
+    if derived is None:
+        return None
+
+    target = STATIC_MEDIA_DIR / derived.name
+    if not target.exists():
+        STATIC_MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            os.link(derived, tmp)
+        except OSError:
+            shutil.copyfile(derived, tmp)
+        tmp.replace(target)
+
+    return target
+
+
+def image_url(path: str | Path) -> str:
+    """
+    What to pass to st.image for a stored image: a stable URL when
+    static serving is on (or MEDIA_BASE_URL is set), else the path.
+    """
+    path = Path(path)
+    if not path.exists():
+        return str(path)
+    stat = path.stat()
+
+    if not (MEDIA_BASE_URL or static_serving_enabled()):
+        # Streamlit reads the file and sends it whole
+        metrics.IMAGES_SERVED.inc("file")
+        metrics.IMAGE_BYTES.inc("file", amount=stat.st_size)
+        return str(path)
+
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+
+    if key not in _url_memo:
+        published = publish(path)
+        if published is None:
+            return str(path)
+        _url_memo[key] = (
+            f"{MEDIA_BASE_URL or STATIC_MEDIA_URL}/{published.name}",
+            published.stat().st_size,
+        )
+
+    # Derivative size; a browser revalidating its cached copy gets less
+    url, size = _url_memo[key]
+    metrics.IMAGES_SERVED.inc("static")
+    metrics.IMAGE_BYTES.inc("static", amount=size)
+    return url
+
+# =========================
+# INGESTION
+# =========================
+
+# Pillow releases the GIL while decoding / encoding, so a thread pool
+# overlaps uploads without pickling image bytes into other processes.
+_ingest = {
+    "lock": threading.Lock(),
+    "pool": None,
+    "jobs": {},             # target path -> Future of the current batch
+    "stats": {"files": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0, "failed": 0},
+}
+
+
+def normalize_image(data: bytes, target: Path) -> dict:
+    """
+    Decode, apply EXIF orientation, cap to INGEST_MAX_PX and re-encode
+    without metadata. Data that cannot be decoded or re-encoded
+    (corrupt, truncated, a decompression bomb) is stored as uploaded.
+    """
+    start = time.perf_counter()
+    tmp = target.with_name(f".{target.name}.{threading.get_ident()}.tmp")
+    fmt = "PNG" if target.suffix.lower() == ".png" else "JPEG"
+    phash = None
+
+    try:
+        with Image.open(BytesIO(data)) as img:
+            # JPEG: decode at reduced scale straight from the DCT
+            img.draft("RGB", (INGEST_MAX_PX, INGEST_MAX_PX))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((INGEST_MAX_PX, INGEST_MAX_PX))
+            if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            phash = phash_image(img)
+
+            # No exif= argument: metadata (GPS, camera) is dropped
+            if fmt == "JPEG":
+                img.save(tmp, fmt, quality=INGEST_QUALITY, optimize=True)
+            else:
+                img.save(tmp, fmt, optimize=True)
+        ok = True
+    except Exception:
+        # PIL raises more than OSError: DecompressionBombError,
+        # ValueError, SyntaxError, ... Keep the upload either way.
+        tmp.write_bytes(data)
+        phash = None
+        ok = False
+
+    tmp.replace(target)
+    if phash is not None:
+        remember_phash(target, phash)
+    return {
+        "bytes_in": len(data),
+        "bytes_out": target.stat().st_size,
+        "seconds": time.perf_counter() - start,
+        "ok": ok,
+    }
+
+
+def _record(future):
+    # Runs in the worker: every failure is counted, none escapes
+    try:
+        result = future.result()
+    except Exception:
+        result = {"bytes_in": 0, "bytes_out": 0, "seconds": 0.0, "ok": False}
+
+    with _ingest["lock"]:
+        stats = _ingest["stats"]
+        stats["files"] += 1
+        stats["failed"] += not result["ok"]
+        for key in ("bytes_in", "bytes_out", "seconds"):
+            stats[key] += result[key]
+
+
+def ingest_uploads(files, prefix: str) -> list[str]:
+    """
+    Queue uploaded files for normalization and return their final
+    paths right away (IMAGE_DIR/<prefix>_<name>), so the card or PYQ
+    record can be saved while the images are still being processed.
+    """
+    data_layer.IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    paths = []
+
+    with _ingest["lock"]:
+        if _ingest["pool"] is None:
+            _ingest["pool"] = ThreadPoolExecutor(
+                max_workers=INGEST_WORKERS, thread_name_prefix="ingest"
+            )
+        # A new batch starts once the previous one has finished
+        if all(f.done() for f in _ingest["jobs"].values()):
+            _ingest["jobs"] = {}
+
+        for f in files:
+            target = data_layer.IMAGE_DIR / f"{prefix}_{f.name}"
+            # getvalue() copies: the upload buffer ends with this rerun
+            future = _ingest["pool"].submit(normalize_image, f.getvalue(), target)
+            future.add_done_callback(_record)
+            _ingest["jobs"][str(target)] = future
+            paths.append(str(target))
+
+    return paths
+
+
+def ingest_progress() -> tuple[int, int]:
+    # (done, total) of the current batch; (0, 0) when idle
+    with _ingest["lock"]:
+        jobs = list(_ingest["jobs"].values())
+    return sum(f.done() for f in jobs), len(jobs)
+
+
+def is_ingesting(path: str | Path) -> bool:
+    with _ingest["lock"]:
+        future = _ingest["jobs"].get(str(path))
+    return future is not None and not future.done()
+
+
+def wait_for_ingest(timeout: float | None = None) -> bool:
+    with _ingest["lock"]:
+        jobs = list(_ingest["jobs"].values())
+    _, not_done = wait(jobs, timeout=timeout)
+    return not not_done
+
+
+def ingest_stats() -> dict:
+    with _ingest["lock"]:
+        return dict(_ingest["stats"])
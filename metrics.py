@@ -0,0 +1,452 @@
+"""
+Module 16 — Metrics
+
+Responsibilities:
+- Counters and histograms for data-layer loads / saves (latency, rows, bytes)
+- Backup duration and size, image bytes served, API request latency
+- Scrape-time gauges: cache hit ratios, write-buffer and ingest queues,
+  due topics per subject, disk space and process memory
+- Prometheus text exposition on a local port, periodic JSON snapshot
+- Overhead benchmark
+
+Instruments on the hot path only bump in-memory numbers under a
+per-metric lock; everything derived is computed when scraped, so an
+unscraped process pays nothing for it. data_layer imports this module,
+so it must not import data_layer (or Streamlit) at import time.
+
+Usage:
+    python metrics.py [--overhead] [--snapshot]
+"""
+
+import argparse
+import bisect
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))     # 0: no endpoint
+METRICS_ENABLED = os.environ.get("METRICS_DISABLED", "") == ""
+SNAPSHOT_FILE = Path("metrics.json")        # in data_layer.BASE_DIR
+SNAPSHOT_SECONDS = 60
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BACKUP_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+PREFIX = "neetpg_"
+
+_registry: dict = {}
+_exporter = {
+    "lock": threading.Lock(),
+    "server": None,
+    "thread": None,
+    "snapshot_file": None,
+    "error": None,
+}
+_caches: dict = {}      # name -> function returning {"hits", "misses"}
+_due_memo = {"key": None, "value": None}
+
+# =========================
+# INSTRUMENTS
+# =========================
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.values: dict = {}
+        self.lock = threading.Lock()
+        _registry[self.name] = self
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        with self.lock:
+            items = list(self.values.items())
+        return [(self.name, dict(zip(self.labels, k)), v) for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is one bisect plus two
+    additions; cumulative bucket counts are built when scraped.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values: dict = {}      # labels -> [count per bucket..., +Inf, sum]
+        self.lock = threading.Lock()
+        _registry[self.name] = self
+
+    def observe(self, value: float, *labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[slot] += 1
+            counts[-1] += value
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        with self.lock:
+            items = [(k, list(v)) for k, v in self.values.items()]
+
+        out = []
+        for key, counts in items:
+            base = dict(zip(self.labels, key))
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+                total += count
+                out.append((f"{self.name}_bucket", {**base, "le": _format_value(bound)}, total))
+            out.append((f"{self.name}_sum", base, counts[-1]))
+            out.append((f"{self.name}_count", base, total))
+        return out
+
+    def quantile(self, q: float, *labels) -> float | str | None:
+        # Upper bound of the bucket holding quantile q (for the snapshot)
+        with self.lock:
+            counts = list(self.values.get(labels, []))
+        total = sum(counts[:-1])
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+            seen += count
+            if seen >= q * total:
+                return _format_value(bound) if bound == math.inf else bound
+        return None
+
+
+IO_SECONDS = Histogram("data_io_seconds", "Latency of data_layer loads and saves", ("op", "table"))
+IO_ROWS = Counter("data_io_rows_total", "Rows returned by loads and written by saves", ("op", "table"))
+DISK_BYTES = Counter("data_disk_bytes_total", "Bytes read from and written to data files", ("op", "file"))
+BACKUP_SECONDS = Histogram("backup_seconds", "Full backup duration", buckets=BACKUP_BUCKETS)
+BACKUP_BYTES = Counter("backup_bytes_total", "Bytes written by full backups")
+BACKUP_LAST_BYTES = Gauge("backup_last_bytes", "Size of the most recent full backup")
+IMAGES_SERVED = Counter("images_served_total", "Images handed to the browser", ("via",))
+IMAGE_BYTES = Counter("image_bytes_served_total", "Image bytes handed to the browser", ("via",))
+API_SECONDS = Histogram("api_request_seconds", "HTTP API request latency", ("route", "status"))
+
+
+def register_cache(name: str, stats) -> None:
+    # stats() -> {"hits": int, "misses": int}, read when scraped
+    _caches[name] = stats
+
+
+def record_io(op: str, table: str, start: float, rows: int = 0) -> None:
+    # One load / save that started at time.perf_counter() == start
+    if not METRICS_ENABLED:
+        return
+    IO_SECONDS.observe(time.perf_counter() - start, op, table)
+    if rows:
+        IO_ROWS.inc(op, table, amount=rows)
+
+# =========================
+# SCRAPE-TIME COLLECTORS
+# =========================
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _cache_families(data_layer) -> list:
+    requests, ratios = [], []
+    for cache, stats in list(_caches.items()):
+        stats = stats()
+        hits, misses = stats["hits"], stats["misses"]
+        requests.append(({"cache": cache, "result": "hit"}, hits))
+        requests.append(({"cache": cache, "result": "miss"}, misses))
+        ratios.append(({"cache": cache}, hits / (hits + misses) if hits + misses else 0.0))
+
+    return [
+        ("cache_requests_total", "counter", "Cache lookups by result", requests),
+        ("cache_hit_ratio", "gauge", "Lifetime cache hit ratio", ratios),
+    ]
+
+
+def due_by_subject(data_layer) -> dict:
+    # subject -> (topics, due); recomputed when the data or the day changes
+    key = (data_layer.data_version(), date.today())
+    if _due_memo["key"] != key:
+        pyqs = data_layer.load_pyqs()
+        due = data_layer.is_due(pyqs)
+        subjects = pyqs["subject"].astype(object).fillna(data_layer.UNASSIGNED)
+        grouped = due.groupby(subjects).agg(["size", "sum"])
+        _due_memo.update(key=key, value={
+            s: (int(row["size"]), int(row["sum"])) for s, row in grouped.iterrows()
+        })
+    return _due_memo["value"]
+
+
+def _queue_families(data_layer) -> list:
+    due = due_by_subject(data_layer)
+    with data_layer._buffer["lock"]:
+        pending = len(data_layer._buffer["pending"])
+        events = len(data_layer._buffer["events"])
+        first_at = data_layer._buffer["first_at"]
+    age = time.monotonic() - first_at if first_at else 0.0
+
+    families = [
+        ("topics", "gauge", "Topics per subject", [({"subject": s}, n) for s, (n, _) in due.items()]),
+        ("due_topics", "gauge", "Topics due for revision per subject", [({"subject": s}, d) for s, (_, d) in due.items()]),
+        ("write_buffer_pending_topics", "gauge", "Outcomes waiting in the write-behind buffer", [({}, pending)]),
+        ("write_buffer_pending_events", "gauge", "Review events waiting to be appended", [({}, events)]),
+        ("write_buffer_oldest_seconds", "gauge", "Age of the oldest unflushed outcome", [({}, age)]),
+        ("write_buffer_saves_total", "counter", "Buffered flushes written", [({}, data_layer.write_stats()["saves"])]),
+    ]
+    if "media" in sys.modules:
+        done, total = sys.modules["media"].ingest_progress()
+        families.append(("ingest_queue", "gauge", "Image uploads still being ingested", [({}, total - done)]))
+    return families
+
+
+def _host_families(data_layer) -> list:
+    disk = shutil.disk_usage(data_layer.BASE_DIR)
+    families = [
+        ("disk_free_bytes", "gauge", "Free space on the data volume", [({}, disk.free)]),
+        ("disk_total_bytes", "gauge", "Size of the data volume", [({}, disk.total)]),
+    ]
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1024 if sys.platform.startswith("linux") else 1
+        families.append(("process_peak_rss_bytes", "gauge", "Peak resident memory of this process", [({}, peak)]))
+    return families
+
+
+def collect() -> list[tuple[str, str, str, list]]:
+    """
+    Every metric family as (name, type, help, samples), samples being
+    (name, labels, value). Instruments first, then scrape-time gauges.
+    """
+    import data_layer
+
+    # Collectors first: loads they trigger show up in this scrape
+    collected = []
+    for collector in (_queue_families, _cache_families, _host_families):
+        for name, kind, help, samples in collector(data_layer):
+            collected.append((
+                PREFIX + name, kind, help,
+                [(PREFIX + name, labels, value) for labels, value in samples],
+            ))
+    return [(m.name, m.kind, m.help, m.samples()) for m in _registry.values()] + collected
+
+# =========================
+# EXPOSITION
+# =========================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus() -> str:
+    # Prometheus text format 0.0.4
+    lines = []
+    for name, kind, help, samples in collect():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples:
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{sample}{{{label_text}}} {_format_value(value)}" if label_text
+                         else f"{sample} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict:
+    """
+    The same families as JSON, histograms summarised as count, sum
+    and bucket-bound p50 / p95 / p99.
+    """
+    metrics = {}
+    for name, kind, help, samples in collect():
+        metric = _registry.get(name)
+        if kind == "histogram":
+            values = [
+                {
+                    "labels": dict(zip(metric.labels, key)),
+                    "count": sum(counts[:-1]),
+                    "sum": round(counts[-1], 6),
+                    **{f"p{int(q * 100)}": metric.quantile(q, *key) for q in (0.5, 0.95, 0.99)},
+                }
+                for key, counts in list(metric.values.items())
+            ]
+        else:
+            values = [{"labels": labels, "value": value} for _, labels, value in samples]
+        metrics[name] = {"type": kind, "values": values}
+
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(), "metrics": metrics}
+
+
+def write_snapshot(path: Path = SNAPSHOT_FILE) -> Path:
+    data = json.dumps(snapshot(), default=str, separators=(",", ":"))
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(data)
+    tmp.replace(path)
+    return path
+
+# =========================
+# EXPORTER
+# =========================
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body = render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.split("?")[0] == "/metrics.json":
+            body = json.dumps(snapshot(), default=str).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _snapshot_loop():
+    while True:
+        time.sleep(SNAPSHOT_SECONDS)
+        try:
+            write_snapshot(_exporter["snapshot_file"])
+        except (OSError, ValueError, KeyError):
+            # Tables replaced mid-read (restore); next interval retries
+            pass
+
+
+def ensure_exporter(port: int | None = METRICS_PORT, snapshot_file: Path = SNAPSHOT_FILE) -> None:
+    """
+    Start the snapshot writer and, unless port is falsy, the
+    /metrics endpoint, once per process. A port already in use
+    (a second app instance) leaves only the snapshot running.
+    """
+    if not METRICS_ENABLED:
+        return
+    with _exporter["lock"]:
+        thread = _exporter["thread"]
+        if thread is not None and thread.is_alive():
+            return
+
+        _exporter["snapshot_file"] = snapshot_file
+        thread = threading.Thread(target=_snapshot_loop, daemon=True, name="metrics-snapshot")
+        _exporter["thread"] = thread
+        thread.start()
+
+        if port and _exporter["server"] is None:
+            try:
+                server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+            except OSError as e:
+                _exporter["error"] = str(e)
+                return
+            server.daemon_threads = True
+            _exporter["server"] = server
+            threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+
+# =========================
+# OVERHEAD BENCHMARK
+# =========================
+
+def measure_overhead(calls: int = 200_000) -> dict:
+    """
+    ns per record_io() (two timer reads, histogram, row counter),
+    enabled and disabled, against a cache-hit load_pyqs(), the
+    hottest instrumented call. Also the cost of one scrape.
+    """
+    global METRICS_ENABLED
+    import data_layer
+
+    def per_call() -> float:
+        start = time.perf_counter()
+        for _ in range(calls):
+            record_io("bench", "bench", time.perf_counter(), 1)
+        return (time.perf_counter() - start) / calls
+
+    enabled = per_call()
+    METRICS_ENABLED = False
+    try:
+        disabled = per_call()
+    finally:
+        METRICS_ENABLED = True
+    for metric in (IO_SECONDS, IO_ROWS):
+        with metric.lock:
+            metric.values.pop(("bench", "bench"), None)
+
+    data_layer.load_pyqs()
+    start = time.perf_counter()
+    for _ in range(2000):
+        data_layer.load_pyqs()
+    load = (time.perf_counter() - start) / 2000
+
+    start = time.perf_counter()
+    text = render_prometheus()
+    scrape = time.perf_counter() - start
+
+    return {
+        "record_io_ns": round(enabled * 1e9),
+        "record_io_disabled_ns": round(disabled * 1e9),
+        "load_pyqs_hit_us": round(load * 1e6, 1),
+        "overhead_pct_of_load": round(100 * enabled / load, 2),
+        "scrape_ms": round(scrape * 1000, 2),
+        "scrape_bytes": len(text),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print metrics for the data in this directory")
+    parser.add_argument("--overhead", action="store_true", help="benchmark instrumentation cost")
+    parser.add_argument("--snapshot", action="store_true", help=f"write {SNAPSHOT_FILE} and exit")
+    args = parser.parse_args()
+
+    # data_layer records into the imported module, not into __main__
+    import metrics
+
+    if args.overhead:
+        print(json.dumps(metrics.measure_overhead(), indent=1))
+    elif args.snapshot:
+        print(metrics.write_snapshot())
+    else:
+        sys.stdout.write(metrics.render_prometheus())
@@ -0,0 +1,191 @@
+"""
+Module 18 — Mock Exam
+
+Responsibilities:
+- Paper generation: N topics stratified across subjects in NEET PG
+  proportions, weighted by fail_count, staleness and PYQ frequency
+- Scoring of a finished paper per subject
+- One batched write of all answers when the paper is submitted
+
+Sampling and scoring are vectorized over the whole deck: weighted
+sampling without replacement uses one exponential key per topic
+(Efraimidis–Spirakis: the k smallest Exp(1) / weight of a stratum),
+so a paper is a sort, not a loop over draws.
+
+No Streamlit here; the screens live in exam_modes.
+"""
+
+import numpy as np
+import pandas as pd
+
+import data_layer
+
+PAPER_SIZES = [50, 100, 200]
+SECONDS_PER_ITEM = 63           # 200 questions in 210 minutes
+
+STALE_CAP_DAYS = 60             # never revised counts as this stale
+FAIL_WEIGHT = 1.0
+PYQ_YEAR = r"\d{4}"             # one per year listed in pyq_years
+
+PAPER_COLUMNS = [
+    "id", "topic", "subject", "trigger_line", "pyq_years",
+    "revision_count", "fail_count", "last_revised", "pyq_image_paths",
+    "card_id", "image_paths", "body_offset", "body_length",
+]
+
+# =========================
+# SUBJECT PROPORTIONS
+# =========================
+
+# Approximate questions per subject in a NEET PG paper (relative)
+SUBJECT_SHARES = {
+    "anatomy": 17, "physiology": 17, "biochemistry": 17,
+    "pathology": 25, "pharmacology": 20, "microbiology": 20,
+    "forensic medicine": 10, "psm": 25, "ent": 15, "ophthalmology": 15,
+    "medicine": 37, "dermatology": 6, "psychiatry": 6,
+    "surgery": 37, "orthopaedics": 8, "anaesthesia": 5, "radiology": 5,
+    "obg": 30, "pediatrics": 10,
+}
+OTHER_SHARE = 5                 # subjects not in the table
+
+SUBJECT_ALIASES = {
+    "spm": "psm", "community medicine": "psm",
+    "social and preventive medicine": "psm", "preventive and social medicine": "psm",
+    "obgyn": "obg", "ob/gyn": "obg", "obs and gynae": "obg",
+    "obstetrics and gynaecology": "obg", "obstetrics and gynecology": "obg",
+    "paediatrics": "pediatrics", "orthopedics": "orthopaedics", "ortho": "orthopaedics",
+    "anesthesia": "anaesthesia", "fmt": "forensic medicine", "forensic": "forensic medicine",
+    "ophthalmology (eye)": "ophthalmology", "eye": "ophthalmology",
+    "biochem": "biochemistry", "pharma": "pharmacology", "micro": "microbiology",
+    "derma": "dermatology", "psych": "psychiatry",
+}
+
+
+def subject_share(subject: str) -> float:
+    key = " ".join(str(subject).lower().replace("&", "and").split())
+    return SUBJECT_SHARES.get(SUBJECT_ALIASES.get(key, key), OTHER_SHARE)
+
+
+def allocate(available: pd.Series, n: int) -> pd.Series:
+    """
+    Items per subject: n split by subject_share (largest remainder),
+    capped by the topics a subject has; a capped subject's surplus
+    goes to the others in proportion.
+    """
+    shares = pd.Series([subject_share(s) for s in available.index], index=available.index, dtype=float)
+    quotas = pd.Series(0, index=available.index)
+    n = min(int(n), int(available.sum()))
+
+    while quotas.sum() < n:
+        room = available - quotas
+        open_ = room > 0
+        left = n - int(quotas.sum())
+        exact = left * shares[open_] / shares[open_].sum()
+        add = np.floor(exact).astype(int)
+        extra = left - int(add.sum())
+        add[(exact - add).sort_values(ascending=False, kind="stable").index[:extra]] += 1
+        quotas[open_] += np.minimum(add, room[open_])
+
+    return quotas
+
+# =========================
+# PAPER GENERATION
+# =========================
+
+def topic_weights(deck: pd.DataFrame) -> np.ndarray:
+    """
+    Sampling weight per topic:
+    (1 + fail_count) x (1 + staleness) x (1 + PYQ years),
+    staleness being days since last_revised over STALE_CAP_DAYS (max 1).
+    """
+    today = pd.Timestamp.now().normalize()
+    fails = deck["fail_count"].fillna(0).clip(lower=0).to_numpy(dtype=float)
+    stale = (
+        (today - deck["last_revised"]).dt.days
+        .fillna(STALE_CAP_DAYS).clip(0, STALE_CAP_DAYS)
+        .to_numpy(dtype=float) / STALE_CAP_DAYS
+    )
+    years = deck["pyq_years"].fillna("").str.count(PYQ_YEAR).to_numpy(dtype=float)
+    return (1 + FAIL_WEIGHT * fails) * (1 + stale) * (1 + years)
+
+
+def sample_paper(n: int, require_card: bool = False, seed: int | None = None) -> pd.DataFrame:
+    """
+    A paper of up to n distinct topics in random order, stratified by
+    subject (allocate) and weighted within each subject (topic_weights),
+    with empty outcome / time_ms answer columns.
+    """
+    deck = data_layer.query(has_card=True if require_card else None, columns=PAPER_COLUMNS)
+    if deck.empty:
+        return deck
+
+    rng = np.random.default_rng(seed)
+    keys = rng.exponential(size=len(deck)) / topic_weights(deck)
+
+    codes, subjects = pd.factorize(deck["subject"].astype("string").fillna(data_layer.UNASSIGNED))
+    available = pd.Series(np.bincount(codes, minlength=len(subjects)), index=subjects)
+    quotas = allocate(available, n).to_numpy()
+
+    # Rank of every topic inside its subject by key; keep the first quota
+    order = np.lexsort((keys, codes))
+    sorted_codes = codes[order]
+    starts = np.searchsorted(sorted_codes, np.arange(len(subjects)))
+    rank = np.arange(len(order)) - starts[sorted_codes]
+    picked = order[rank < quotas[sorted_codes]]
+
+    paper = deck.iloc[rng.permutation(picked)].reset_index(drop=True)
+    paper["outcome"] = None         # filled in as the paper is answered
+    paper["time_ms"] = np.nan
+    return paper
+
+# =========================
+# SCORING
+# =========================
+
+def score_paper(paper: pd.DataFrame) -> tuple[dict, pd.DataFrame]:
+    """
+    Totals and a per-subject table for a paper whose `outcome`
+    column holds "revised" / "weak" / None (not reached).
+    """
+    answered = paper["outcome"].notna()
+    revised = paper["outcome"] == "revised"
+    table = (
+        pd.DataFrame({
+            "Subject": paper["subject"],
+            "Items": 1,
+            "Answered": answered,
+            "Revised": revised,
+            "Weak": paper["outcome"] == "weak",
+            "Seconds": paper["time_ms"].fillna(0) / 1000,
+        })
+        .groupby("Subject", sort=True, observed=True)
+        .sum()
+        .reset_index()
+    )
+    table["Accuracy %"] = (100 * table["Revised"] / table["Answered"].where(table["Answered"] > 0)).round(0)
+    table["Seconds"] = table["Seconds"].round(0).astype(int)
+
+    totals = {
+        "items": len(paper),
+        "answered": int(answered.sum()),
+        "revised": int(revised.sum()),
+        "weak": int((paper["outcome"] == "weak").sum()),
+        "seconds": int(paper["time_ms"].fillna(0).sum() // 1000),
+    }
+    totals["accuracy"] = round(100 * totals["revised"] / totals["answered"]) if totals["answered"] else None
+    return totals, table
+
+
+def submit_paper(paper: pd.DataFrame) -> int:
+    """
+    Write every answered item back in one batch; unanswered items
+    are left untouched. Returns the number of topics written.
+    """
+    done = paper[paper["outcome"].notna()]
+    answers = pd.DataFrame({
+        "topic_id": done["id"],
+        "outcome": done["outcome"],
+        "time_on_card_ms": done["time_ms"].fillna(0).astype(int),
+    })
+    data_layer.record_batch_outcomes(answers, mode="mock_exam")
+    return len(answers)
@@ -0,0 +1,260 @@
+"""
+Module 9 — PDF Export
+
+Responsibilities:
+- Printable per-subject revision booklets (reportlab)
+- Cards drawn one at a time, page by page
+- Downscaled image derivatives instead of raw uploads
+- Subjects rendered in parallel worker processes
+- Output cached by a content hash of each part's inputs
+- One on-disk ZIP bundle per set of parts; superseded parts and
+  bundles are removed
+
+reportlab keeps a document in memory until it is saved, so each
+subject is split into parts of BOOKLET_PART_SIZE cards; worker memory
+is bounded by one part, whatever the deck size.
+"""
+
+import hashlib
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+
+import data_layer
+import media
+
+EXPORT_DIR = data_layer.BASE_DIR / "exports" / "pdf"
+EXPORT_IMAGE_PX = 800
+BOOKLET_PART_SIZE = 500
+
+PAGE_W, PAGE_H = A4
+MARGIN = 15 * mm
+TEXT_W = PAGE_W - 2 * MARGIN
+MAX_IMAGE_H = 70 * mm
+
+BOOKLET_COLUMNS = [
+    "topic_id", "topic", "subject", "trigger_line", "pyq_years",
+    "bullets", "image_paths",
+]
+
+# =========================
+# INPUTS
+# =========================
+
+def booklet_frame(pyqs: pd.DataFrame, cards: pd.DataFrame) -> pd.DataFrame:
+    cards = cards.assign(bullets=data_layer.card_bodies(cards))
+    joined = cards.merge(
+        pyqs[["id", "topic", "subject", "trigger_line", "pyq_years"]],
+        left_on="topic_id",
+        right_on="id",
+        how="inner"
+    )
+    joined["bullets"] = joined["bullets"].fillna("").astype(str)
+    joined["image_paths"] = joined["image_paths"].fillna("").astype(str)
+    return joined[BOOKLET_COLUMNS].sort_values(["subject", "topic"])
+
+
+def part_hash(frame: pd.DataFrame) -> str:
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+
+    # Image edits change the booklet even if the paths do not
+    for value in frame["image_paths"]:
+        for p in media.split_paths(value):
+            path = Path(p)
+            if path.exists():
+                stat = path.stat()
+                h.update(f"{p}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    h.update(str(EXPORT_IMAGE_PX).encode())
+    return h.hexdigest()[:16]
+
+
+def safe_name(subject: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in subject)
+
+
+def booklet_path(subject: str, part: int, digest: str) -> Path:
+    return EXPORT_DIR / f"{safe_name(subject)}-{part:02d}_{digest}.pdf"
+
+
+def bundle_path(results: dict[str, list[Path]]) -> Path:
+    # Named after the parts it holds, whose names carry their digests
+    h = hashlib.sha256()
+    for subject, paths in sorted(results.items()):
+        for path in paths:
+            h.update(Path(path).name.encode())
+    return EXPORT_DIR / f"booklets_{h.hexdigest()[:16]}.zip"
+
+# =========================
+# RENDERING (WORKER)
+# =========================
+
+class _Writer:
+    def __init__(self, path: Path, subject: str):
+        self.c = canvas.Canvas(str(path), pagesize=A4, pageCompression=1)
+        self.c.setTitle(f"{subject} — Revision Booklet")
+        self.subject = subject
+        self.page = 0
+        self.new_page()
+
+    def new_page(self):
+        if self.page:
+            self.c.showPage()
+        self.page += 1
+        self.y = PAGE_H - MARGIN
+        self.c.setFont("Helvetica", 8)
+        self.c.drawRightString(PAGE_W - MARGIN, MARGIN / 2, f"{self.subject} · {self.page}")
+
+    def ensure(self, height: float):
+        if self.y - height < MARGIN:
+            self.new_page()
+
+    def text(self, value: str, font: str = "Helvetica", size: int = 10):
+        lines = simpleSplit(value, font, size, TEXT_W)
+        for line in lines:
+            self.ensure(size * 1.3)
+            self.c.setFont(font, size)
+            self.c.drawString(MARGIN, self.y - size, line)
+            self.y -= size * 1.3
+
+    def image(self, path: Path):
+        reader = ImageReader(str(path))
+        w, h = reader.getSize()
+        scale = min(TEXT_W / w, MAX_IMAGE_H / h, 1.0)
+        w, h = w * scale, h * scale
+
+        self.ensure(h + 4)
+        self.c.drawImage(reader, MARGIN, self.y - h, w, h)
+        self.y -= h + 4
+
+    def gap(self, height: float):
+        self.y -= height
+
+    def close(self):
+        self.c.save()
+
+
+def render_booklet(subject: str, part: int, records: list[dict], out_path: str) -> str:
+    out = Path(out_path)
+    tmp = out.with_suffix(".part")
+    writer = _Writer(tmp, subject)
+
+    writer.text(f"{subject} — Revision Booklet ({part})", "Helvetica-Bold", 16)
+    writer.gap(6)
+
+    for rec in records:
+        writer.ensure(40)
+        writer.text(rec["topic"], "Helvetica-Bold", 12)
+
+        if rec["trigger_line"].strip():
+            writer.text(f"Trigger: {rec['trigger_line']}", "Helvetica-Oblique", 9)
+        if rec["pyq_years"].strip():
+            writer.text(f"PYQ years: {rec['pyq_years']}", "Helvetica-Oblique", 9)
+
+        for line in rec["bullets"].splitlines():
+            if line.strip():
+                writer.text(line)
+
+        for p in media.split_paths(rec["image_paths"]):
+            derived = media.derivative(p, EXPORT_IMAGE_PX)
+            if derived is not None:
+                writer.image(derived)
+
+        writer.gap(8)
+
+    writer.close()
+    tmp.replace(out)
+    return str(out)
+
+# =========================
+# EXPORT
+# =========================
+
+def export_booklets(
+    subjects: list[str] | None = None,
+    workers: int | None = None
+) -> dict[str, list[Path]]:
+    """
+    Render (or reuse) the booklet parts of every subject.
+    Returns {subject: [pdf_path, ...]} in reading order.
+    """
+    frame = booklet_frame(data_layer.load_pyqs(), data_layer.load_cards())
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    jobs = []
+
+    for subject, group in frame.groupby("subject", sort=True, observed=True):
+        if subjects and subject not in subjects:
+            continue
+
+        results[subject] = []
+        for part, start in enumerate(range(0, len(group), BOOKLET_PART_SIZE), 1):
+            chunk = group.iloc[start:start + BOOKLET_PART_SIZE]
+            path = booklet_path(subject, part, part_hash(chunk))
+            results[subject].append(path)
+
+            # Content-hash cache: unchanged parts are not re-rendered
+            if not path.exists():
+                jobs.append((subject, part, chunk.to_dict("records"), str(path)))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(render_booklet, *job) for job in jobs]
+            for f in futures:
+                f.result()
+
+    prune_booklets(results, everything=not subjects)
+    return results
+
+
+def prune_booklets(results: dict[str, list[Path]], everything: bool = False) -> int:
+    """
+    Delete superseded parts of the exported subjects (of every subject
+    when everything is set). Returns the number of files removed.
+    """
+    current = {Path(p).name for paths in results.values() for p in paths}
+    names = "|".join(re.escape(safe_name(s)) for s in results)
+    if everything:
+        names = r"\w+"
+    elif not names:
+        return 0
+    part = re.compile(rf"({names})-\d{{2,}}_[0-9a-f]+\.pdf")
+
+    removed = 0
+    for path in EXPORT_DIR.glob("*.pdf"):
+        if part.fullmatch(path.name) and path.name not in current:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def bundle_booklets(results: dict[str, list[Path]]) -> Path:
+    """
+    ZIP of the parts, written to disk once per set of parts and
+    streamed member by member; older bundles are removed.
+    """
+    out = bundle_path(results)
+    if out.exists():
+        return out
+
+    # PDFs are already compressed: store, do not deflate again
+    tmp = out.with_name(out.name + ".tmp")
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as z:
+        for subject, paths in sorted(results.items()):
+            for part, path in enumerate(paths, 1):
+                z.write(path, arcname=f"{safe_name(subject)}-{part:02d}.pdf")
+    tmp.replace(out)
+
+    for old in EXPORT_DIR.glob("booklets_*.zip"):
+        if old != out:
+            old.unlink(missing_ok=True)
+    return out
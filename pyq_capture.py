@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
 import data_layer
+import media
+import voice_capture
 
 # =========================
 # CONSTANTS
@@ -81,13 +83,30 @@ def render_pyq_capture():
     st.session_state.setdefault("last_added_pyq", None)
     image_paths: list[str] = []
 
+    # ---------------------
+    # DICTATED TRIGGER LINE
+    # ---------------------
+    with st.expander("🎙️ Dictate trigger line"):
+        recording = st.file_uploader(
+            "Upload voice note",
+            type=["wav", "mp3", "m4a", "ogg"],
+            key="pyq_voice_note"
+        )
+        if recording and st.button("Transcribe"):
+            with st.spinner("Transcribing…"):
+                transcript, _ = voice_capture.transcribe_recording(recording)
+            st.session_state.dictated_trigger = " ".join(transcript.split())
+
     # ---------------------
     # PYQ FORM
     # ---------------------
     with st.form("pyq_form", clear_on_submit=True):
         topic = st.text_input("Topic")
         subject = st.selectbox("Subject", SUBJECTS)
-        trigger = st.text_input("Trigger line (one-liner)")
+        trigger = st.text_input(
+            "Trigger line (one-liner)",
+            value=st.session_state.get("dictated_trigger", "")
+        )
         years = st.text_input("PYQ Years (comma separated)")
 
         pyq_images = st.file_uploader(
@@ -115,12 +134,8 @@ def render_pyq_capture():
         new_id = data_layer.safe_next_id(pyqs["id"])
 
         if pyq_images:
-            data_layer.IMAGE_DIR.mkdir(parents=True, exist_ok=True)
-            for f in pyq_images:
-                path = data_layer.IMAGE_DIR / f"pyq_{new_id}_{f.name}"
-                with open(path, "wb") as out:
-                    out.write(f.getbuffer())
-                image_paths.append(str(path))
+            # Normalized in the background; the row is saved right away
+            image_paths = media.ingest_uploads(pyq_images, f"pyq_{new_id}")
 
         row = data_layer.new_pyq_row(
             topic=topic.strip(),
@@ -138,6 +153,7 @@ def render_pyq_capture():
 
         # 🔑 CRITICAL: Persist for next action
         st.session_state.last_added_pyq = row
+        st.session_state.pop("dictated_trigger", None)
 
         st.success("✅ PYQ added successfully.")
 
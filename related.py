@@ -0,0 +1,521 @@
+"""
+Module 21 — Related Topics
+
+Responsibilities:
+- Sparse TF-IDF vectors over topic, trigger line and card bullets
+  (hashed word unigrams + bigrams; no vocabulary is kept)
+- Bulk build of the index and of the top-k neighbours of every topic
+- Incremental refresh after card / topic edits: only changed topics
+  are re-vectorized and re-matched
+- O(1) neighbour lookup for "related next" in revision
+
+Neighbours are approximate. A topic is matched through its
+QUERY_TERMS heaviest terms against postings cut to the
+POSTINGS_PER_TERM heaviest topics of each term (impact order), so a
+build costs at most QUERY_TERMS x POSTINGS_PER_TERM pairs per topic.
+Query terms are taken from terms shared with at least one other
+topic: the rarest terms weigh most but, seen in one topic only, they
+match nothing. Terms in more than MAX_DF of all topics tell nothing
+apart and are dropped.
+
+Changed topics get a new row and their old row is tombstoned, as in
+the card body store; once the delta passes COMPACT_FRACTION the rows
+are compacted, the postings rebuilt and the index saved. Document
+frequencies are kept up to date on refresh; once the idf they give
+has drifted by IDF_DRIFT from the one the rows were weighted with,
+the index is rebuilt in bulk instead.
+
+Usage:
+    python related.py [--rebuild] [--topic ID] [--k 10]
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_layer
+
+RELATED_INDEX_FILE = data_layer.BASE_DIR / "related_index.npz"
+INDEX_FORMAT = 2
+
+FEATURE_BITS = 20               # hashed feature space: 1M columns
+FEATURES = 1 << FEATURE_BITS
+TOKEN = r"[a-z0-9]{2,}"
+FIELD_WEIGHTS = {"topic": 2.0, "trigger_line": 1.0, "bullets": 1.0}
+MAX_DF = 0.2
+VECTORIZE_CHUNK = 5000
+
+TOP_K = 10
+QUERY_TERMS = 8
+POSTINGS_PER_TERM = 128
+MIN_SCORE = 0.05
+MATCH_BLOCK = 2048              # topics matched per vectorized step
+COMPACT_FRACTION = 0.05         # delta + dead rows before compaction
+IDF_DRIFT = 0.01                # df-weighted idf change before a rebuild
+
+_index = {"key": None, "index": None, "refresh": None}
+_lock = threading.Lock()
+_stats = {"builds": 0, "refreshes": 0, "refreshed_topics": 0, "compactions": 0, "drift_rebuilds": 0}
+
+# =========================
+# DOCUMENTS
+# =========================
+
+def topic_documents() -> pd.DataFrame:
+    """
+    id, topic, trigger_line, body_offset, body_length and a 64-bit
+    signature of those per topic. Bullets are not read here; the
+    body reference changes whenever they do.
+    """
+    pyqs = data_layer.load_pyqs()[["id", "topic", "trigger_line"]]
+    cards = data_layer.load_cards().drop_duplicates("topic_id")[["topic_id", "body_offset", "body_length"]]
+    docs = (
+        pyqs.merge(cards, left_on="id", right_on="topic_id", how="left")
+        .drop(columns="topic_id")
+        .dropna(subset=["id"])
+        .reset_index(drop=True)
+    )
+    docs["id"] = docs["id"].astype("int64")
+    docs["signature"] = pd.util.hash_pandas_object(
+        docs[["topic", "trigger_line", "body_offset", "body_length"]], index=False
+    ).to_numpy()
+    return docs
+
+
+# =========================
+# VECTORS
+# =========================
+
+def field_terms(text: pd.Series, weight: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (row, feature, weight) for the hashed unigrams and bigrams of each text
+    values = pd.Series(text.to_numpy(dtype=object, na_value=""), dtype=object)
+    tokens = values.str.lower().str.findall(TOKEN).explode().dropna()
+    if tokens.empty:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+    rows = tokens.index.to_numpy(dtype=np.int64)
+    words = tokens.to_numpy(dtype=object)
+    same = rows[1:] == rows[:-1]
+    terms = np.concatenate([words, words[:-1][same] + " " + words[1:][same]])
+    term_rows = np.concatenate([rows, rows[1:][same]])
+    # hash_array is seeded with a fixed key: stable across processes
+    features = (pd.util.hash_array(terms) & np.uint64(FEATURES - 1)).astype(np.int64)
+    return term_rows, features, np.full(len(terms), weight)
+
+
+def idf_weights(df: np.ndarray, n: int) -> np.ndarray:
+    # Smoothed idf of n documents; terms in more than MAX_DF of them weigh 0
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+    idf[df > max(MAX_DF * n, 2)] = 0
+    return idf
+
+
+def vectorize(docs: pd.DataFrame, idf: np.ndarray | None = None) -> dict:
+    """
+    L2-normalized TF-IDF rows (CSR: indptr, indices, data) and the
+    document frequency of every feature for docs. Tokens and bullets
+    are handled VECTORIZE_CHUNK topics at a time; only the (row,
+    feature, tf) arrays span the whole deck. idf is computed from docs
+    when not given (bulk build) and reused as is for incremental rows.
+    """
+    n = len(docs)
+    parts = []
+    for start in range(0, n, VECTORIZE_CHUNK):
+        chunk = docs.iloc[start:start + VECTORIZE_CHUNK].reset_index(drop=True)
+        chunk = chunk.assign(bullets=data_layer.card_bodies(chunk).to_numpy())
+        terms = [field_terms(chunk[f], w) for f, w in FIELD_WEIGHTS.items()]
+        rows = np.concatenate([t[0] for t in terms])
+        features = np.concatenate([t[1] for t in terms])
+
+        # Sorted (row, feature) keys: CSR order straight away
+        keys, inverse = np.unique(rows * FEATURES + features, return_inverse=True)
+        tf = np.bincount(inverse, weights=np.concatenate([t[2] for t in terms]))
+        parts.append((
+            ((keys >> FEATURE_BITS) + start).astype(np.int32),
+            (keys & (FEATURES - 1)).astype(np.int32),
+            tf.astype(np.float32),
+        ))
+
+    rows = np.concatenate([p[0] for p in parts]) if parts else np.array([], dtype=np.int32)
+    features = np.concatenate([p[1] for p in parts]) if parts else np.array([], dtype=np.int32)
+    tf = np.concatenate([p[2] for p in parts]) if parts else np.array([], dtype=np.float32)
+    del parts
+
+    df = np.bincount(features, minlength=FEATURES).astype(np.int32)
+    if idf is None:
+        idf = idf_weights(df, n)
+
+    data = (1 + np.log(tf)) * idf[features]
+    keep = data > 0
+    rows, features, data = rows[keep], features[keep], data[keep]
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=n)).astype(np.float32)
+    data /= norms[rows]
+
+    return {
+        "indptr": np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))]).astype(np.int64),
+        "indices": features,
+        "data": data,
+        "idf": idf,
+        "df": df,
+    }
+
+
+def idf_drift(idf: np.ndarray, df: np.ndarray, n: int) -> float:
+    # df-weighted relative change of idf, were it recomputed from df now
+    fresh = idf_weights(df, n)
+    weights = df.astype(np.float64)
+    return float((weights * np.abs(fresh - idf)).sum() / max((weights * idf).sum(), 1e-9))
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # starts[i], starts[i] + 1, ... (counts[i] values), concatenated
+    return np.repeat(starts, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+
+def _top_per_group(groups: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+    # Positions of the n largest values of every group, groups ascending
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    starts = np.searchsorted(sorted_groups, sorted_groups, side="left")
+    return order[np.arange(len(order)) - starts < n]
+
+# =========================
+# POSTINGS AND MATCHING
+# =========================
+
+def build_postings(index: dict, rows: np.ndarray, per_term: int | None = POSTINGS_PER_TERM) -> tuple:
+    """
+    Inverted lists (ptr over features, row, weight) of the given CSR
+    rows, heaviest first and cut to per_term entries per feature.
+    """
+    indptr, indices, data = index["indptr"], index["indices"], index["data"]
+    counts = indptr[rows + 1] - indptr[rows]
+    entries = _ranges(indptr[rows], counts)
+    entry_rows = np.repeat(rows.astype(np.int32), counts)
+    features, weights = indices[entries], data[entries]
+    del entries
+
+    # Grouped by feature, heaviest first
+    keep = _top_per_group(features, weights, per_term) if per_term else np.lexsort((-weights, features))
+    ptr = np.searchsorted(features[keep], np.arange(FEATURES + 1))
+    return ptr.astype(np.int64), entry_rows[keep].astype(np.int32), weights[keep]
+
+
+def query_terms(index: dict, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (row, feature, weight) of each row's QUERY_TERMS heaviest shared terms
+    indptr = index["indptr"]
+    counts = indptr[rows + 1] - indptr[rows]
+    entries = _ranges(indptr[rows], counts)
+    entry_rows = np.repeat(rows, counts)
+    shared = index["df"][index["indices"][entries]] >= 2
+    entries, entry_rows = entries[shared], entry_rows[shared]
+    top = _top_per_group(entry_rows, index["data"][entries], QUERY_TERMS)
+    return entry_rows[top], index["indices"][entries[top]], index["data"][entries[top]]
+
+
+def _probe(postings: tuple, q_rows, q_features, q_weights) -> tuple:
+    ptr, post_rows, post_weights = postings
+    starts, ends = ptr[q_features], ptr[q_features + 1]
+    counts = ends - starts
+    hits = _ranges(starts, counts)
+    return np.repeat(q_rows, counts), post_rows[hits], np.repeat(q_weights, counts) * post_weights[hits]
+
+
+def match(index: dict, rows: np.ndarray, postings: list[tuple]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (row, candidate row, score) pairs for rows, the TOP_K best per
+    row, scored over the rows' query terms against every posting set.
+    """
+    q = query_terms(index, rows)
+    found = [_probe(p, *q) for p in postings]
+    src = np.concatenate([f[0] for f in found])
+    dst = np.concatenate([f[1] for f in found]).astype(np.int64)
+    score = np.concatenate([f[2] for f in found])
+
+    useful = (src != dst) & index["live"][dst]
+    src, dst, score = src[useful], dst[useful], score[useful]
+
+    keys, inverse = np.unique(src * len(index["live"]) + dst, return_inverse=True)
+    score = np.bincount(inverse, weights=score)
+    src, dst = keys // len(index["live"]), keys % len(index["live"])
+    good = score >= MIN_SCORE
+    src, dst, score = src[good], dst[good], score[good]
+
+    top = _top_per_group(src, score, TOP_K)
+    return src[top], dst[top], score[top]
+
+
+def fill_neighbours(index: dict, rows: np.ndarray, postings: list[tuple]) -> None:
+    # Recompute the neighbour rows of `rows` in MATCH_BLOCK steps
+    ids = index["ids"]
+    for start in range(0, len(rows), MATCH_BLOCK):
+        block = rows[start:start + MATCH_BLOCK]
+        index["nbr_ids"][block] = -1
+        index["nbr_scores"][block] = 0
+        src, dst, score = match(index, block, postings)
+        if not len(src):
+            continue
+        slot = np.arange(len(src)) - np.searchsorted(src, src, side="left")
+        index["nbr_ids"][src, slot] = ids[dst]
+        index["nbr_scores"][src, slot] = score
+
+# =========================
+# BUILD / REFRESH
+# =========================
+
+def build_index(docs: pd.DataFrame | None = None) -> dict:
+    """Vectors, postings and top-k neighbours of every topic, in bulk."""
+    start = time.perf_counter()
+    docs = topic_documents() if docs is None else docs
+    index = vectorize(docs)
+    n = len(docs)
+    index.update(
+        format=INDEX_FORMAT,
+        ids=docs["id"].to_numpy(dtype=np.int64),
+        signatures=docs["signature"].to_numpy(dtype=np.uint64),
+        live=np.ones(n, dtype=bool),
+        posted=n,
+        nbr_ids=np.full((n, TOP_K), -1, dtype=np.int64),
+        nbr_scores=np.zeros((n, TOP_K), dtype=np.float32),
+    )
+    index["postings"] = build_postings(index, np.arange(n))
+    fill_neighbours(index, np.arange(n), [index["postings"]])
+    index["positions"] = dict(zip(index["ids"].tolist(), range(n)))
+    index["built_seconds"] = round(time.perf_counter() - start, 2)
+    _stats["builds"] += 1
+    return index
+
+
+def _delta_postings(index: dict) -> tuple | None:
+    # Rows added since the postings were built, searched in full
+    delta = np.flatnonzero(index["live"][index["posted"]:]) + index["posted"]
+    return build_postings(index, delta, per_term=None) if len(delta) else None
+
+
+def refresh(index: dict, docs: pd.DataFrame) -> dict:
+    """
+    A new index reflecting docs: changed / new topics are vectorized
+    into appended rows, removed ones tombstoned, and neighbour rows of
+    the changed topics and of topics that listed them recomputed.
+    """
+    known = pd.Series(index["signatures"][index["live"]], index=index["ids"][index["live"]])
+    current = docs.set_index("id")["signature"]
+    common = current.index.intersection(known.index)
+    edited = common[current.loc[common].to_numpy() != known.loc[common].to_numpy()]
+    changed = current.index.difference(known.index).append(edited)
+    removed = known.index.difference(current.index)
+    if not len(changed) and not len(removed):
+        return index
+
+    index = dict(index)
+    for name in ("live", "nbr_ids", "nbr_scores"):
+        index[name] = index[name].copy()
+    positions = dict(index["positions"])
+
+    gone = np.array([positions.pop(i) for i in list(changed) + list(removed) if i in positions], dtype=np.int64)
+    index["live"][gone] = False
+
+    # Appended rows, scored with the idf of the last build
+    new = docs[docs["id"].isin(changed)].reset_index(drop=True)
+    vectors = vectorize(new, index["idf"])
+
+    # df of the live rows. Dead rows only hold terms with a non-zero idf,
+    # so terms cut by MAX_DF stay over-counted until the next build.
+    dead = _ranges(index["indptr"][gone], index["indptr"][gone + 1] - index["indptr"][gone])
+    index["df"] = index["df"] - np.bincount(index["indices"][dead], minlength=FEATURES).astype(np.int32) + vectors["df"]
+    if idf_drift(index["idf"], index["df"], len(positions) + len(new)) > IDF_DRIFT:
+        _stats["drift_rebuilds"] += 1
+        index = build_index(docs)
+        save_index(index)
+        return index
+
+    base = len(index["ids"])
+    index["indptr"] = np.concatenate([index["indptr"], vectors["indptr"][1:] + index["indptr"][-1]])
+    index["indices"] = np.concatenate([index["indices"], vectors["indices"]])
+    index["data"] = np.concatenate([index["data"], vectors["data"]])
+    index["ids"] = np.concatenate([index["ids"], new["id"].to_numpy(dtype=np.int64)])
+    index["signatures"] = np.concatenate([index["signatures"], new["signature"].to_numpy(dtype=np.uint64)])
+    index["live"] = np.concatenate([index["live"], np.ones(len(new), dtype=bool)])
+    index["nbr_ids"] = np.vstack([index["nbr_ids"], np.full((len(new), TOP_K), -1, dtype=np.int64)])
+    index["nbr_scores"] = np.vstack([index["nbr_scores"], np.zeros((len(new), TOP_K), dtype=np.float32)])
+    added = np.arange(base, base + len(new))
+    positions.update(zip(new["id"].tolist(), added.tolist()))
+    index["positions"] = positions
+
+    # Rows that listed a changed topic, plus rows a changed topic now outscores
+    touched = np.isin(index["nbr_ids"], np.asarray(list(changed) + list(removed), dtype=np.int64)).any(axis=1)
+    postings = [index["postings"]] + [p for p in [_delta_postings(index)] if p]
+    src, dst, score = match(index, added, postings)
+    weakest = np.where(index["nbr_ids"][:, -1] < 0, 0, index["nbr_scores"][:, -1])
+    touched[dst[score > weakest[dst]]] = True
+
+    rows = np.union1d(added, np.flatnonzero(touched & index["live"]))
+    fill_neighbours(index, rows, postings)
+
+    _stats["refreshes"] += 1
+    _stats["refreshed_topics"] += len(changed) + len(removed)
+
+    delta = len(index["ids"]) - index["posted"] + int((~index["live"][:index["posted"]]).sum())
+    return compact(index) if delta > COMPACT_FRACTION * len(positions) else index
+
+
+def compact(index: dict) -> dict:
+    """
+    Drop tombstoned rows, rebuild the postings and save. Neighbour
+    lists are kept: refresh already matched the delta in full.
+    """
+    live = np.flatnonzero(index["live"])
+    counts = index["indptr"][live + 1] - index["indptr"][live]
+    entries = _ranges(index["indptr"][live], counts)
+
+    out = {
+        "format": INDEX_FORMAT,
+        "idf": index["idf"],
+        "df": index["df"],
+        "indptr": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "indices": index["indices"][entries],
+        "data": index["data"][entries],
+        "ids": index["ids"][live],
+        "signatures": index["signatures"][live],
+        "live": np.ones(len(live), dtype=bool),
+        "posted": len(live),
+        "nbr_ids": index["nbr_ids"][live],
+        "nbr_scores": index["nbr_scores"][live],
+    }
+    out["postings"] = build_postings(out, np.arange(len(live)))
+    out["positions"] = dict(zip(out["ids"].tolist(), range(len(live))))
+
+    save_index(out)
+    _stats["compactions"] += 1
+    return out
+
+# =========================
+# PERSISTENCE
+# =========================
+
+SAVED_ARRAYS = ["idf", "df", "indptr", "indices", "data", "ids", "signatures", "live", "nbr_ids", "nbr_scores"]
+
+
+def save_index(index: dict) -> None:
+    ptr, rows, weights = index["postings"]
+    tmp = RELATED_INDEX_FILE.with_name(RELATED_INDEX_FILE.name + ".tmp.npz")
+    np.savez(
+        tmp,
+        meta=np.array([INDEX_FORMAT, FEATURE_BITS, TOP_K, index["posted"]]),
+        post_ptr=ptr, post_rows=rows, post_weights=weights,
+        **{name: index[name] for name in SAVED_ARRAYS}
+    )
+    tmp.replace(RELATED_INDEX_FILE)
+
+
+def load_index() -> dict | None:
+    # None when missing or written with other parameters
+    if not RELATED_INDEX_FILE.exists():
+        return None
+    try:
+        with np.load(RELATED_INDEX_FILE) as f:
+            fmt, bits, k, posted = f["meta"].tolist()
+            if (fmt, bits, k) != (INDEX_FORMAT, FEATURE_BITS, TOP_K):
+                return None
+            index = {name: f[name] for name in SAVED_ARRAYS}
+            index["postings"] = (f["post_ptr"], f["post_rows"], f["post_weights"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+    live = np.flatnonzero(index["live"])
+    index.update(format=fmt, posted=posted, positions=dict(zip(index["ids"][live].tolist(), live.tolist())))
+    return index
+
+
+def sync_index(rebuild: bool = False) -> dict:
+    """Bring the index up to date with the deck, building it if needed."""
+    with _lock:
+        key = data_layer.data_version(include_outcomes=False)
+        index = None if rebuild else (_index["index"] or load_index())
+        docs = topic_documents()
+        if index is None:
+            index = build_index(docs)
+            save_index(index)
+        else:
+            index = refresh(index, docs)
+        _index.update(key=key, index=index)
+        return index
+
+
+def refresh_async() -> None:
+    # Revision never waits for a build or refresh
+    thread = _index["refresh"]
+    if thread and thread.is_alive():
+        return
+    thread = threading.Thread(target=sync_index, daemon=True)
+    _index["refresh"] = thread
+    thread.start()
+
+# =========================
+# LOOKUP
+# =========================
+
+def neighbours(topic_id: int, k: int = TOP_K) -> list[tuple[int, float]]:
+    """
+    (topic_id, score) of up to k related topics, best first: one dict
+    lookup and one row read. Out-of-date or missing indexes are
+    refreshed in the background; until then the current one answers
+    (or nothing, while the first build runs).
+    """
+    if _index["key"] != data_layer.data_version(include_outcomes=False):
+        refresh_async()
+    index = _index["index"]
+    if index is None:
+        return []
+
+    pos = index["positions"].get(int(topic_id))
+    if pos is None:
+        return []
+    ids, scores = index["nbr_ids"][pos], index["nbr_scores"][pos]
+    return [(int(i), float(s)) for i, s in zip(ids[:k], scores[:k]) if i >= 0]
+
+
+def index_ready() -> bool:
+    return _index["index"] is not None
+
+
+def index_stats() -> dict:
+    index = _index["index"]
+    if index is None:
+        return {"ready": False, **_stats}
+    live = index["live"]
+    arrays = [index[name] for name in SAVED_ARRAYS] + list(index["postings"])
+    return {
+        "ready": True,
+        "topics": int(live.sum()),
+        "rows": len(live),
+        "nonzeros": len(index["data"]),
+        "postings": len(index["postings"][1]),
+        "mean_neighbours": round(float((index["nbr_ids"][live] >= 0).sum(axis=1).mean()), 2) if live.any() else 0,
+        "array_mb": round(sum(a.nbytes for a in arrays) / 1e6, 1),
+        **_stats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build / refresh the related-topic index")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the saved index")
+    parser.add_argument("--topic", type=int, help="print this topic's neighbours")
+    parser.add_argument("--k", type=int, default=TOP_K)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sync_index(rebuild=args.rebuild)
+    result = {"seconds": round(time.perf_counter() - start, 2), **index_stats()}
+
+    if args.topic is not None:
+        titles = data_layer.load_pyqs().set_index("id")["topic"]
+        result["neighbours"] = [
+            {"id": i, "topic": titles.get(i), "score": round(s, 3)}
+            for i, s in neighbours(args.topic, args.k)
+        ]
+    print(json.dumps(result, indent=1, default=str))
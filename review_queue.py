@@ -0,0 +1,267 @@
+"""
+Module 7 — Review Queue
+
+Responsibilities:
+- Session-scoped read-ahead of the next revision candidates
+- Candidates from data_layer.query as slotted QueueItem records; image
+  paths resolved once per build
+- Local advance on every answer (no reload / re-sort)
+- Optional "related next": neighbours of the answered topic moved up
+- Background refill when the queue runs low
+- Invalidation when another session changes the data files
+"""
+
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+import data_layer
+import related
+
+QUEUE_SIZE = 20
+REFILL_AT = 5
+RELATED_NEXT = 3            # related topics moved up after an answer
+
+# =========================
+# CANDIDATES
+# =========================
+
+QUEUE_COLUMNS = [
+    "id", "topic", "subject", "trigger_line", "pyq_years",
+    "revision_count", "fail_count", "pyq_image_paths",
+    "card_id", "image_paths", "body_offset", "body_length",
+]
+
+
+def select_candidates(
+    subject: str = "All",
+    require_card: bool = True,
+    exclude: set | None = None,
+    limit: int | None = None,
+    ids: list | None = None
+) -> pd.DataFrame:
+    # Never revised, weak or due; weakest first
+    return data_layer.query(
+        subject,
+        needs_revision=True,
+        has_card=True if require_card else None,
+        ids=ids,
+        exclude_ids=exclude,
+        order="priority",
+        limit=limit,
+        columns=QUEUE_COLUMNS
+    )
+
+
+def resolve_paths(value) -> list[str]:
+    if not isinstance(value, str) or not value.strip():
+        return []
+    return [p for p in value.split(";") if p.strip() and Path(p).exists()]
+
+
+class QueueItem(data_layer.Record):
+    # One queued topic; image paths resolved to lists of existing files
+    __slots__ = (
+        "id", "topic", "subject", "trigger_line", "pyq_years",
+        "revision_count", "fail_count", "pyq_image_paths",
+        "has_card", "body_offset", "body_length", "image_paths",
+    )
+
+
+def build_items(candidates: pd.DataFrame) -> list[QueueItem]:
+    items = []
+    for row in candidates.itertuples(index=False):
+        has_card = not pd.isna(row.card_id)
+        items.append(QueueItem(
+            id=row.id,
+            topic=row.topic,
+            subject=row.subject,
+            trigger_line=row.trigger_line,
+            pyq_years=row.pyq_years,
+            revision_count=int(row.revision_count),
+            fail_count=int(row.fail_count),
+            pyq_image_paths=resolve_paths(row.pyq_image_paths),
+            has_card=has_card,
+            # Bullet text is read only when the card is rendered
+            body_offset=row.body_offset if has_card else None,
+            body_length=row.body_length if has_card else None,
+            image_paths=resolve_paths(row.image_paths) if has_card else [],
+        ))
+
+    return items
+
+
+def record_item(pyq: data_layer.PYQRecord, card: data_layer.CardRecord | None) -> QueueItem:
+    # Same item as build_items, from get_pyq / get_card records
+    return QueueItem(
+        id=pyq.id,
+        topic=pyq.topic,
+        subject=pyq.subject,
+        trigger_line=pyq.trigger_line,
+        pyq_years=pyq.pyq_years,
+        revision_count=int(pyq.revision_count or 0),
+        fail_count=int(pyq.fail_count or 0),
+        pyq_image_paths=resolve_paths(pyq.pyq_image_paths),
+        has_card=card is not None,
+        body_offset=card.body_offset if card else None,
+        body_length=card.body_length if card else None,
+        image_paths=resolve_paths(card.image_paths) if card else [],
+    )
+
+# =========================
+# QUEUE
+# =========================
+
+class ReviewQueue:
+    def __init__(self, subject: str = "All", require_card: bool = True):
+        self.subject = subject
+        self.require_card = require_card
+        self.items = deque()
+        self.seen = set()
+        self.version = None
+        self.lock = threading.Lock()
+        self.refill_thread = None
+        self.shown_id = None
+        self.shown_at = None
+
+    def build(self):
+        self.version = data_layer.data_version()
+        self._fill()
+
+    def is_stale(self) -> bool:
+        return self.version != data_layer.data_version()
+
+    def _fill(self):
+        with self.lock:
+            exclude = self.seen | {item.id for item in self.items}
+            limit = QUEUE_SIZE - len(self.items)
+
+        items = build_items(
+            select_candidates(self.subject, self.require_card, exclude, limit)
+        )
+
+        # Everything already seen this round → start a new round
+        if not items and self.seen and not self.items:
+            with self.lock:
+                self.seen.clear()
+            items = build_items(
+                select_candidates(self.subject, self.require_card, None, limit)
+            )
+
+        with self.lock:
+            known = {item.id for item in self.items}
+            self.items.extend(i for i in items if i.id not in known)
+
+    def refill_async(self):
+        if self.refill_thread and self.refill_thread.is_alive():
+            return
+        self.refill_thread = threading.Thread(target=self._fill, daemon=True)
+        self.refill_thread.start()
+
+    def current(self) -> QueueItem | None:
+        with self.lock:
+            item = self.items[0] if self.items else None
+
+        if item is None:
+            # Queue drained: wait for a pending refill, else refill inline
+            if self.refill_thread and self.refill_thread.is_alive():
+                self.refill_thread.join()
+            else:
+                self._fill()
+
+            with self.lock:
+                item = self.items[0] if self.items else None
+
+        if item is not None and item.id != self.shown_id:
+            self.shown_id = item.id
+            self.shown_at = time.monotonic()
+
+        return item
+
+    def elapsed_ms(self) -> int:
+        # Time the current card has been on screen
+        if self.shown_at is None:
+            return 0
+        return int((time.monotonic() - self.shown_at) * 1000)
+
+    def advance(self):
+        with self.lock:
+            if self.items:
+                self.seen.add(self.items.popleft().id)
+            low = len(self.items) < REFILL_AT
+
+        if low:
+            self.refill_async()
+
+    def follow_related(self, topic_id: int):
+        """
+        Put up to RELATED_NEXT topics related to topic_id at the front,
+        best first: unseen this round and eligible for this queue
+        (never revised, weak or due; in its subject; with a card when
+        it requires one), so nothing is revised ahead of its schedule.
+        Neighbours are precomputed (related.neighbours); eligibility is
+        one query over them, each item one record lookup.
+        """
+        with self.lock:
+            skip = self.seen | {topic_id}
+
+        candidates = [n for n, _ in related.neighbours(topic_id) if n not in skip]
+        if not candidates:
+            return
+        eligible = set(select_candidates(self.subject, self.require_card, ids=candidates)["id"])
+
+        items = []
+        for neighbour in candidates:
+            if neighbour not in eligible:
+                continue
+            pyq = data_layer.get_pyq(neighbour)
+            card = data_layer.get_card(neighbour)
+            if pyq is None:
+                continue
+            items.append(record_item(pyq, card))
+            if len(items) == RELATED_NEXT:
+                break
+
+        with self.lock:
+            ids = {item.id for item in items}
+            rest = [item for item in self.items if item.id not in ids]
+            self.items = deque(items + rest)
+
+    def ack_write(self):
+        # Our own save must not invalidate our own queue
+        self.version = data_layer.data_version()
+
+# =========================
+# SESSION HELPERS
+# =========================
+
+def get_session_queue(key: str, subject: str, require_card: bool = True) -> ReviewQueue:
+    queue = st.session_state.get(key)
+
+    if queue is not None and queue.subject != subject:
+        # Subject change closes a revision run: persist it now
+        data_layer.flush_pending()
+
+    if queue is None or queue.subject != subject or queue.is_stale():
+        queue = ReviewQueue(subject, require_card)
+        queue.build()
+        st.session_state[key] = queue
+
+    return queue
+
+
+def get_session_subjects(key: str, require_card: bool = True) -> list[str]:
+    version = data_layer.data_version(include_outcomes=False)
+    cached = st.session_state.get(key)
+
+    if cached and cached[0] == version:
+        return cached[1]
+
+    # Straight from the partition manifest: no table is read
+    subjects = data_layer.manifest_subjects("cards" if require_card else "pyqs")
+    st.session_state[key] = (version, subjects)
+    return subjects
@@ -7,6 +7,7 @@ Responsibilities:
 - Spaced repetition handling
 - Revised / Weak actions
 - Image-only revision mode
+- "Related next": related topics follow the one just revised
 - Today’s target indicator
 - Quiet revision streak
 
@@ -14,11 +15,12 @@ Responsibilities:
 """
 
 import streamlit as st
-import pandas as pd
-from datetime import date
 import time
 
 import data_layer
+import media
+import related
+import review_queue
 
 # =========================
 # SESSION STATE INIT
@@ -26,20 +28,6 @@ import data_layer
 
 def init_revision_session():
     st.session_state.setdefault("start_time", time.time())
-    st.session_state.setdefault("revised_today", 0)
-    st.session_state.setdefault("revision_streak", 0)
-    st.session_state.setdefault("last_revision_date", None)
-
-
-# =========================
-# PRIORITIZATION
-# =========================
-
-def prioritize(df: pd.DataFrame) -> pd.DataFrame:
-    return df.sort_values(
-        by=["fail_count", "revision_count"],
-        ascending=[False, True]
-    )
 
 
 # =========================
@@ -56,60 +44,40 @@ def render_revision_engine():
 
     init_revision_session()
 
-    base_pyqs = data_layer.load_pyqs()
-    cards = data_layer.load_cards()
+    subjects = review_queue.get_session_subjects("revision_subjects")
 
-    if cards.empty:
-        st.info("No study cards available yet.")
-        return
-
-    # Only topics WITH study cards (view-level)
-    view_pyqs = base_pyqs[base_pyqs.id.isin(cards.topic_id)]
-
-    if view_pyqs.empty:
+    if not subjects:
         st.info("No topics available for revision yet.")
         return
 
     # -------------------------
     # SUBJECT FILTER
     # -------------------------
-    subjects = ["All"] + sorted(view_pyqs.subject.unique().tolist())
-    subject = st.selectbox("Subject", subjects)
-
-    if subject != "All":
-        view_pyqs = view_pyqs[view_pyqs.subject == subject]
+    subject = st.selectbox("Subject", ["All"] + subjects)
 
     # -------------------------
     # REVISION CANDIDATES
     # -------------------------
-    candidates = view_pyqs[
-        (view_pyqs.revision_count == 0)
-        | (view_pyqs.fail_count > 0)
-        | (data_layer.is_due(view_pyqs))
-    ]
+    queue = review_queue.get_session_queue("revision_queue", subject)
+    row = queue.current()
 
-    if candidates.empty:
+    if row is None:
         st.info("No topics available for revision right now.")
         return
 
-    candidates = prioritize(candidates)
-
-    row = candidates.iloc[0]
-    card = cards[cards.topic_id == row.id].iloc[0]
-
     # -------------------------
     # HEADER
     # -------------------------
-    st.markdown(f"### {row.topic}")
-    st.caption(row.subject)
+    st.markdown(f"### {row['topic']}")
+    st.caption(row["subject"])
 
     st.markdown("---")
 
-    if isinstance(row.trigger_line, str) and row.trigger_line.strip():
-        st.markdown(f"**🧠 Trigger line:** {row.trigger_line}")
+    if isinstance(row["trigger_line"], str) and row["trigger_line"].strip():
+        st.markdown(f"**🧠 Trigger line:** {row['trigger_line']}")
 
-    if isinstance(row.pyq_years, str) and row.pyq_years.strip():
-        st.markdown(f"**📅 PYQ Years:** {row.pyq_years}")
+    if isinstance(row["pyq_years"], str) and row["pyq_years"].strip():
+        st.markdown(f"**📅 PYQ Years:** {row['pyq_years']}")
 
     st.markdown("---")
 
@@ -117,59 +85,63 @@ def render_revision_engine():
     # DISPLAY
     # -------------------------
     image_only = st.toggle("Image-only revision", value=False)
+    related_next = st.toggle("🔗 Related next", value=False, help="Revise similar topics together")
 
-    if isinstance(card.image_paths, str) and card.image_paths.strip():
-        for p in card.image_paths.split(";"):
-            st.image(p)
+    for p in row["image_paths"]:
+        st.image(media.image_url(p))
 
     if not image_only:
-        for line in card.bullets.splitlines():
+        for line in data_layer.card_body(row).splitlines():
             st.write(line)
 
+    if related_next:
+        titles = [
+            pyq.topic for pyq in (data_layer.get_pyq(i) for i, _ in related.neighbours(row.id, 3))
+            if pyq is not None
+        ]
+        if titles:
+            st.caption("🔗 Related: " + " · ".join(titles))
+        elif not related.index_ready():
+            st.caption("🔗 Building the related-topics index…")
+
     # -------------------------
     # ACTIONS
     # -------------------------
     col1, col2 = st.columns(2)
 
-    today = date.today()
-
     with col1:
         if st.button("✅ Revised"):
-            new_revision_count = int(row.revision_count) + 1
-            new_fail_count = max(int(row.fail_count) - 1, 0)
-            next_date = data_layer.compute_next_revision(new_revision_count)
-
-            base_pyqs.loc[base_pyqs.id == row.id, "revision_count"] = new_revision_count
-            base_pyqs.loc[base_pyqs.id == row.id, "fail_count"] = new_fail_count
-            base_pyqs.loc[base_pyqs.id == row.id, "last_revised"] = today
-            base_pyqs.loc[base_pyqs.id == row.id, "next_revision_date"] = next_date
-
-            data_layer.save_pyqs(base_pyqs)
-
-            # ---- streak handling ----
-            if st.session_state.last_revision_date != today:
-                st.session_state.revision_streak += 1
-                st.session_state.last_revision_date = today
-
-            st.session_state.revised_today += 1
+            data_layer.record_answer(row, "revised", "revision", queue.elapsed_ms())
+            queue.ack_write()
+            queue.advance()
+            if related_next:
+                queue.follow_related(row.id)
             st.rerun()
 
     with col2:
         if st.button("❌ Weak"):
-            new_fail_count = int(row.fail_count) + 1
-            next_date = data_layer.compute_next_revision(int(row.revision_count))
-
-            base_pyqs.loc[base_pyqs.id == row.id, "fail_count"] = new_fail_count
-            base_pyqs.loc[base_pyqs.id == row.id, "last_revised"] = today
-            base_pyqs.loc[base_pyqs.id == row.id, "next_revision_date"] = next_date
-
-            data_layer.save_pyqs(base_pyqs)
+            data_layer.record_answer(row, "weak", "revision", queue.elapsed_ms())
+            queue.ack_write()
+            queue.advance()
+            if related_next:
+                queue.follow_related(row.id)
             st.rerun()
 
     # -------------------------
     # FOOTER INFO
     # -------------------------
-    st.caption(f"Revision streak: {st.session_state.revision_streak} days")
+    # Streak comes from the persisted daily rollup, not the session
+    daily = data_layer.load_daily_rollup()
+    st.caption(
+        f"Revision streak: {data_layer.review_streak(daily)} days · "
+        f"reviewed today: {data_layer.reviews_today(daily)}"
+    )
+
+    stats = data_layer.write_stats()
+    st.caption(
+        f"Saves avoided: {stats['saves_avoided']} · "
+        f"pending: {stats['pending']}"
+    )
 
     if st.session_state.get("revision_filter") == "weak":
         st.info("Showing weak topics first")
\ No newline at end of file
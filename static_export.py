@@ -0,0 +1,252 @@
+"""
+Module 11 — Static Export
+
+Responsibilities:
+- Per-subject JSON shards of PYQs + study cards for the Pages site
+- Small top-level index.json
+- Precompressed .gz (and .br when brotli is installed)
+- Content-hashed, resized image derivatives
+- Incremental rebuilds: only changed subjects are rewritten
+
+deck.html fetches the export from deck/, so deck/ is committed with
+it and GitHub Pages serves both from the repository. Pruning only
+touches files this exporter wrote: shard names it generates and the
+images listed in the previous _build.json. A non-empty directory
+without a _build.json is refused as an output directory.
+
+Usage:
+    python static_export.py [--out deck] [--image-px 1024]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import data_layer
+import media
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = data_layer.BASE_DIR / "deck"
+STATIC_IMAGE_PX = 1024
+SHARD_FORMAT = 1
+SHARD_NAME = re.compile(r"[a-z0-9_]+-[0-9a-f]{16}\.json(\.gz|\.br)?")
+
+SHARD_COLUMNS = [
+    "id", "topic", "subject", "pyq_years", "trigger_line",
+    "pyq_image_paths", "card_title", "bullets", "image_paths",
+]
+
+# =========================
+# INPUTS
+# =========================
+
+def deck_frame(pyqs: pd.DataFrame, cards: pd.DataFrame) -> pd.DataFrame:
+    cards = cards.drop_duplicates("topic_id")
+    cards = cards.assign(bullets=data_layer.card_bodies(cards))[
+        ["topic_id", "card_title", "bullets", "image_paths"]
+    ]
+    joined = pyqs.merge(cards, left_on="id", right_on="topic_id", how="left")
+
+    for col in ["card_title", "bullets", "image_paths", "pyq_image_paths"]:
+        joined[col] = joined[col].fillna("").astype(str)
+
+    return joined[SHARD_COLUMNS].sort_values(["subject", "topic"])
+
+
+def shard_digest(group: pd.DataFrame, image_px: int) -> str:
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(group, index=False).values.tobytes())
+
+    for col in ["image_paths", "pyq_image_paths"]:
+        for value in group[col]:
+            for p in media.split_paths(value):
+                path = Path(p)
+                if path.exists():
+                    stat = path.stat()
+                    h.update(f"{p}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    h.update(f"{SHARD_FORMAT}:{image_px}".encode())
+    return h.hexdigest()[:16]
+
+
+def safe_name(subject: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in subject).lower()
+
+# =========================
+# WRITERS
+# =========================
+
+def write_compressed(path: Path, data: bytes) -> int:
+    # Write-then-rename: a half-built shard is never served
+    for target, payload in [
+        (path, data),
+        (path.with_name(path.name + ".gz"), gzip.compress(data, 9, mtime=0)),
+    ] + (
+        [(path.with_name(path.name + ".br"), brotli.compress(data))] if brotli else []
+    ):
+        tmp = target.with_name(target.name + ".tmp")
+        tmp.write_bytes(payload)
+        tmp.replace(target)
+    return len(data)
+
+
+def publish_image(src: str, out_dir: Path, image_px: int) -> str | None:
+    derived = media.derivative(src, image_px)
+    if derived is None:
+        return None
+
+    target = out_dir / "img" / derived.name
+    if not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(derived, target)
+
+    return f"img/{derived.name}"
+
+
+def shard_records(group: pd.DataFrame, out_dir: Path, image_px: int) -> list[dict]:
+    records = []
+    for row in group.itertuples(index=False):
+        images = [
+            url for url in (
+                publish_image(p, out_dir, image_px)
+                for p in media.split_paths(row.image_paths)
+            ) if url
+        ]
+        pyq_images = [
+            url for url in (
+                publish_image(p, out_dir, image_px)
+                for p in media.split_paths(row.pyq_image_paths)
+            ) if url
+        ]
+        records.append({
+            "id": int(row.id),
+            "topic": row.topic,
+            "trigger_line": row.trigger_line,
+            "pyq_years": row.pyq_years,
+            "bullets": [b for b in row.bullets.splitlines() if b.strip()],
+            "images": images,
+            "pyq_images": pyq_images,
+        })
+    return records
+
+# =========================
+# BUILD
+# =========================
+
+def build_static_deck(
+    out_dir: Path = STATIC_DIR,
+    image_px: int = STATIC_IMAGE_PX
+) -> dict:
+    """
+    Export (or refresh) the static deck. Subjects whose inputs are
+    unchanged keep their existing shard. Returns build stats.
+    """
+    start = time.perf_counter()
+    out_dir = Path(out_dir)
+    build_file = out_dir / "_build.json"
+    if out_dir.is_dir() and not build_file.exists() and any(out_dir.iterdir()):
+        raise ValueError(f"{out_dir} is not empty and holds no static deck build")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    frame = deck_frame(data_layer.load_pyqs(), data_layer.load_cards())
+
+    previous = json.loads(build_file.read_text()) if build_file.exists() else {}
+
+    index = {"format": SHARD_FORMAT, "subjects": []}
+    build = {}
+    rebuilt = []
+
+    for subject, group in frame.groupby("subject", sort=True, observed=True):
+        digest = shard_digest(group, image_px)
+        shard = f"{safe_name(subject)}-{digest}.json"
+        old = previous.get(subject)
+
+        if old and old["digest"] == digest and (out_dir / shard).exists():
+            build[subject] = old
+        else:
+            records = shard_records(group, out_dir, image_px)
+            data = json.dumps(
+                {"subject": subject, "cards": records},
+                ensure_ascii=False,
+                separators=(",", ":")
+            ).encode()
+            build[subject] = {
+                "digest": digest,
+                "shard": shard,
+                "count": len(records),
+                "bytes": write_compressed(out_dir / shard, data),
+                "images": sorted({
+                    url for r in records for url in r["images"] + r["pyq_images"]
+                }),
+            }
+            rebuilt.append(subject)
+
+        index["subjects"].append({
+            "name": subject,
+            "count": build[subject]["count"],
+            "shard": build[subject]["shard"],
+            "bytes": build[subject]["bytes"],
+        })
+
+    write_compressed(
+        out_dir / "index.json",
+        json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode()
+    )
+    build_file.write_text(json.dumps(build, indent=1))
+
+    removed = prune_static_deck(out_dir, build, previous)
+
+    return {
+        "subjects": len(build),
+        "rebuilt": rebuilt,
+        "removed_files": removed,
+        "cards": int(sum(b["count"] for b in build.values())),
+        "shard_bytes": int(sum(b["bytes"] for b in build.values())),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def prune_static_deck(out_dir: Path, build: dict, previous: dict) -> int:
+    """
+    Old shard versions, and images of the previous build no longer
+    referenced by any shard. Nothing else in out_dir is touched.
+    """
+    keep = set()
+    for entry in build.values():
+        keep.add(entry["shard"])
+        keep.update(entry["images"])
+
+    stale = [p for p in out_dir.iterdir() if p.is_file() and SHARD_NAME.fullmatch(p.name)]
+    stale += [out_dir / url for entry in previous.values() for url in entry.get("images", [])]
+
+    removed = 0
+    for path in stale:
+        base = path.relative_to(out_dir).as_posix().removesuffix(".gz").removesuffix(".br")
+        if base not in keep and path.is_file():
+            path.unlink()
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the deck for the static site")
+    parser.add_argument("--out", type=Path, default=STATIC_DIR)
+    parser.add_argument("--image-px", type=int, default=STATIC_IMAGE_PX)
+    args = parser.parse_args()
+
+    try:
+        result = build_static_deck(args.out, args.image_px)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(result, indent=1))
@@ -5,8 +5,12 @@ Module 2 — Study Cards
 import streamlit as st
 import pandas as pd
 import re
+import textwrap
 
 import data_layer
+import image_dedup
+import media
+import voice_capture
 
 # =========================
 # STUDY CARD TEMPLATES
@@ -57,6 +61,16 @@ def auto_generate_bullets(text: str, max_bullets: int = 5) -> str:
     return "\n".join(f"• {b}" for b in bullets)
 
 
+def transcript_bullets(transcript: str, width: int = 100) -> str:
+    # Offline transcripts have no punctuation: wrap each chunk's line
+    # at word boundaries instead of filtering sentences, so no dictated
+    # text is dropped
+    lines = []
+    for line in transcript.splitlines():
+        lines.extend(textwrap.wrap(line, width, break_long_words=False))
+    return "\n".join(f"• {b}" for b in lines)
+
+
 def generate_structured_template(topic_row) -> str:
     subject = topic_row.subject
     trigger = topic_row.trigger_line or ""
@@ -81,21 +95,47 @@ def generate_structured_template(topic_row) -> str:
 
     return "\n".join(bullets)
 
+# =========================
+# DICTATION
+# =========================
+
+def dictate(recording) -> str:
+    # Partial transcript is streamed into the page while chunks finish
+    progress = st.progress(0.0, text="Transcribing…")
+    partial = st.empty()
+    transcript = ""
+
+    for done, total, transcript in voice_capture.transcribe_stream(recording):
+        progress.progress(done / total, text=f"Transcribing… {done}/{total}")
+        partial.text_area("Transcript so far", transcript, height=150, disabled=True)
+
+    progress.empty()
+    return transcript
+
 # =========================
 # IMAGE HANDLING
 # =========================
 
 def save_uploaded_images(files, topic_id: int) -> list[str]:
-    paths = []
-    data_layer.IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    # Paths are final now; the files appear once normalized
+    return media.ingest_uploads(files, str(topic_id))
 
-    for f in files:
-        path = data_layer.IMAGE_DIR / f"{topic_id}_{f.name}"
-        with open(path, "wb") as out:
-            out.write(f.getbuffer())
-        paths.append(str(path))
 
-    return paths
+def render_duplicates(duplicates):
+    st.warning("⚠️ Possible duplicate images")
+
+    for name, matches in duplicates:
+        st.caption(f"**{name}** looks like:")
+        cols = st.columns(min(len(matches), 3))
+        for col, match in zip(cols, matches[:3]):
+            used = ", ".join(
+                f"{r['topic']} ({r['kind']})" for r in match["refs"]
+            ) or "unreferenced"
+            with col:
+                st.image(media.image_url(match["path"]), width=160)
+                st.caption(f"{used} · distance {match['distance']}")
+
+    st.checkbox("Attach anyway", key="keep_duplicate_images")
 
 # =========================
 # MAIN UI
@@ -112,7 +152,6 @@ def render_study_cards():
     st.subheader("🗂️ Study Cards")
 
     pyqs = data_layer.load_pyqs()
-    cards = data_layer.load_cards()
 
     if pyqs.empty:
         st.info("No PYQ topics found yet.")
@@ -141,7 +180,7 @@ def render_study_cards():
         return
 
     filtered = filtered.copy()
-    filtered["label"] = filtered["topic"] + " (" + filtered["subject"] + ")"
+    filtered["label"] = filtered["topic"] + " (" + filtered["subject"].astype(str) + ")"
     topic_map = dict(zip(filtered["label"], filtered["id"]))
 
     # -------------------------
@@ -161,8 +200,8 @@ def render_study_cards():
         )
 
     topic_id = topic_map[selected_label]
-    topic_row = pyqs[pyqs.id == topic_id].iloc[0]
-    card_df = cards[cards.topic_id == topic_id]
+    topic_row = data_layer.get_pyq(topic_id)
+    card = data_layer.get_card(topic_id)
 
     st.caption(f"Subject: {topic_row.subject}")
     st.markdown("---")
@@ -170,18 +209,16 @@ def render_study_cards():
     # -------------------------
     # PREVIEW MODE
     # -------------------------
-    if not card_df.empty and not st.session_state.edit_card:
-        card = card_df.iloc[0]
-
+    if card is not None and not st.session_state.edit_card:
         st.markdown("### 📄 Study Card Preview")
 
-        for line in card.bullets.splitlines():
+        for line in data_layer.card_body(card).splitlines():
             st.write(line)
 
         if isinstance(card.image_paths, str) and card.image_paths.strip():
             st.markdown("#### 🖼️ Images")
-            for p in card.image_paths.split(";"):
-                st.image(p)
+            for p in media.ready_paths(card.image_paths):
+                st.image(media.image_url(p))
 
         st.markdown("---")
 
@@ -214,8 +251,8 @@ def render_study_cards():
 
     if st.session_state.get("auto_card_draft"):
         default_bullets = st.session_state.auto_card_draft
-    elif not card_df.empty:
-        default_bullets = card_df.iloc[0].bullets
+    elif card is not None:
+        default_bullets = data_layer.card_body(card)
     else:
         default_bullets = generate_structured_template(topic_row)
 
@@ -224,6 +261,17 @@ def render_study_cards():
         if st.button("Generate Draft") and raw_text.strip():
             st.session_state["draft_bullets"] = auto_generate_bullets(raw_text)
 
+    with st.expander("🎙️ Dictate Key Points"):
+        recording = st.file_uploader(
+            "Upload voice note",
+            type=["wav", "mp3", "m4a", "ogg"],
+            key="card_voice_note"
+        )
+        if recording and st.button("Transcribe to Draft"):
+            transcript = dictate(recording)
+            if transcript:
+                st.session_state["draft_bullets"] = transcript_bullets(transcript)
+
     bullets = st.text_area(
         "One concept per line",
         value=st.session_state.get("draft_bullets", default_bullets),
@@ -238,6 +286,10 @@ def render_study_cards():
         accept_multiple_files=True
     )
 
+    duplicates = image_dedup.upload_duplicates(images) if images else []
+    if duplicates:
+        render_duplicates(duplicates)
+
     st.markdown("---")
 
     col1, col2 = st.columns(2)
@@ -249,6 +301,10 @@ def render_study_cards():
                 st.error("Minimum 3 bullet points required.")
                 return
 
+            if duplicates and not st.session_state.get("keep_duplicate_images"):
+                st.error("Some images are already in the deck. Remove them or tick 'Attach anyway'.")
+                return
+
             image_paths = save_uploaded_images(images, topic_id) if images else []
 
             data_layer.upsert_card(
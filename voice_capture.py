@@ -0,0 +1,151 @@
+"""
+Module 10 — Voice Capture
+
+Responsibilities:
+- Split long recordings on silence (pydub)
+- Transcribe chunks in parallel with an offline recognizer
+- Stream partial transcripts in recording order
+- Real-time factor reporting
+
+Offline backends are the SpeechRecognition recognizers that run
+locally: sphinx (pocketsphinx), vosk and whisper. Each needs its own
+package / model installed; sphinx is the default.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from pathlib import Path
+
+import speech_recognition as sr
+from pydub import AudioSegment
+from pydub.silence import split_on_silence
+
+OFFLINE_BACKENDS = {
+    "sphinx": "recognize_sphinx",
+    "vosk": "recognize_vosk",
+    "whisper": "recognize_whisper",
+}
+
+MIN_SILENCE_MS = 700
+KEEP_SILENCE_MS = 250
+SILENCE_BELOW_AVG_DB = 16
+MAX_CHUNK_MS = 30_000
+SILENCE_SEEK_MS = 10
+
+# =========================
+# SPLITTING
+# =========================
+
+def load_recording(file) -> AudioSegment:
+    # WAV decodes natively; other formats go through ffmpeg
+    name = getattr(file, "name", file if isinstance(file, str) else "")
+    fmt = Path(str(name)).suffix.lstrip(".").lower() or None
+
+    # Mono 16 kHz is what the offline recognizers expect
+    audio = AudioSegment.from_file(file, format=fmt)
+    return audio.set_channels(1).set_frame_rate(16000)
+
+
+def split_recording(audio: AudioSegment) -> list[AudioSegment]:
+    chunks = split_on_silence(
+        audio,
+        min_silence_len=MIN_SILENCE_MS,
+        silence_thresh=audio.dBFS - SILENCE_BELOW_AVG_DB,
+        keep_silence=KEEP_SILENCE_MS,
+        seek_step=SILENCE_SEEK_MS,
+    ) or [audio]
+
+    # Monologues without pauses would make one huge chunk
+    bounded = []
+    for chunk in chunks:
+        for start in range(0, len(chunk), MAX_CHUNK_MS):
+            bounded.append(chunk[start:start + MAX_CHUNK_MS])
+    return bounded
+
+
+def to_wav_bytes(chunk: AudioSegment) -> bytes:
+    buffer = BytesIO()
+    chunk.export(buffer, format="wav")
+    return buffer.getvalue()
+
+# =========================
+# TRANSCRIPTION (WORKER)
+# =========================
+
+def transcribe_chunk(index: int, wav: bytes, backend: str = "sphinx") -> tuple[int, str]:
+    recognizer = sr.Recognizer()
+    with sr.AudioFile(BytesIO(wav)) as source:
+        audio = recognizer.record(source)
+
+    try:
+        text = getattr(recognizer, OFFLINE_BACKENDS[backend])(audio)
+    except sr.UnknownValueError:
+        text = ""
+
+    return index, text.strip()
+
+
+def transcribe_stream(
+    file,
+    backend: str = "sphinx",
+    workers: int | None = None
+):
+    """
+    Yield (done, total, partial_transcript) as chunks finish.
+    The partial transcript only grows in recording order, so
+    it can be shown to the user while the rest is still running.
+    Each silence-delimited chunk becomes one line.
+    """
+    if backend not in OFFLINE_BACKENDS:
+        raise ValueError(f"Unknown offline backend: {backend}")
+
+    audio = file if isinstance(file, AudioSegment) else load_recording(file)
+    chunks = split_recording(audio)
+    total = len(chunks)
+    results = {}
+    next_index = 0
+    lines = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(transcribe_chunk, i, to_wav_bytes(c), backend)
+            for i, c in enumerate(chunks)
+        ]
+
+        for done, future in enumerate(as_completed(futures), 1):
+            index, text = future.result()
+            results[index] = text
+
+            while next_index in results:
+                if results[next_index]:
+                    lines.append(results.pop(next_index))
+                next_index += 1
+
+            yield done, total, "\n".join(lines)
+
+
+def transcribe_recording(
+    file,
+    backend: str = "sphinx",
+    workers: int | None = None
+) -> tuple[str, dict]:
+    """
+    Full transcript plus timing stats.
+    rtf = processing time / audio duration (lower is faster).
+    """
+    start = time.perf_counter()
+    audio = load_recording(file)
+    audio_s = len(audio) / 1000
+
+    transcript, chunks = "", 0
+    for _, chunks, transcript in transcribe_stream(audio, backend, workers):
+        pass
+    elapsed = time.perf_counter() - start
+
+    return transcript, {
+        "audio_s": round(audio_s, 1),
+        "elapsed_s": round(elapsed, 1),
+        "chunks": chunks,
+        "rtf": round(elapsed / audio_s, 3) if audio_s else None,
+    }